@@ -1,11 +1,13 @@
 #include <TimerOne.h>
 #include <SoftwareSerial.h>
-// check signal parameters from serial
-// if first charakter 'S' start interrupt
+// check signal parameters from serial, commands end with '\r'
+// if first charakter 'P' answer "1"
+// if first charakter 'S' start interrupt, answer "2 <fps>"
 // integer following S ist the FPS-setting
-// if first charakter 'Q' stop interrupt
-// dutycycle is set in dependancy of freq  to be ~ 5ms 
-// if first charakter 'T' send following string to intan
+// if first charakter 'Q' stop interrupt, answer "3 <number of pulses fired since start>"
+// dutycycle is set in dependancy of freq  to be ~ 5ms
+// if first charakter 'T' send following string to intan, answer "4"
+// every command is answered once it took effect, so the host can wait for it and measure the round trip
 const byte rxPin = 2;
 const byte txPin = 3;
 SoftwareSerial mySerial(rxPin, txPin,1);
@@ -15,9 +17,18 @@ long fps = 30;
 float duration = 5000.0;
 int input;
 float dutyCycle = 30.0;
+volatile unsigned long pulseCount = 0;
+
+void countPulse(void)
+{
+  // timer overflow, once per PWM period, i.e. once per pulse
+  pulseCount++;
+}
+
 void setup(void)
 {
   Serial.begin(9600);
+  Serial.setTimeout(50);
   mySerial.begin(600);
   digitalWrite(LedPin,0);
 }
@@ -27,9 +38,9 @@ void loop(void)
   if(Serial.available()>0)
   {
     input=Serial.read();
-    if (input=='P') // Poll the arduino, expect answer bit '1' 
+    if (input=='P') // Poll the arduino, expect answer '1'
     {
-      Serial.print(1);
+      Serial.println(1);
     }
 
     if (input=='Q')
@@ -38,30 +49,41 @@ void loop(void)
       {
         Timer1.disablePwm(LedPin);
         Timer1.stop();
-        Serial.println(3);
+        Timer1.detachInterrupt();
         pinStatus=0;
       }
+      noInterrupts();
+      unsigned long count = pulseCount;
+      interrupts();
+      Serial.print(3);
+      Serial.print(' ');
+      Serial.println(count);
     }
 
     if (input=='S')
     {
-      fps=Serial.parseInt(); 
-      Serial.println(2);
-      Serial.print(fps);     
+      fps=Serial.parseInt();
       //duration=(float)Serial.parseInt(); // if we also want to set a duration of pulse
       if (pinStatus==0)
       {
+        noInterrupts();
+        pulseCount = 0;
+        interrupts();
         Timer1.initialize(1000000/fps);  // 40 us = 25 kHz
         dutyCycle = duration/(1000000/fps); // calculate duty cycle to have pulse length ~5ms
+        Timer1.attachInterrupt(countPulse);
         Timer1.pwm(LedPin, (dutyCycle) * 1023);
         pinStatus=1;
       }
+      Serial.print(2);
+      Serial.print(' ');
+      Serial.println(fps);
     }
     if (input=='T')
     {
-      String text=Serial.readString();
+      String text=Serial.readStringUntil('\r');
       mySerial.print(text); //Write the text from Serial port
+      Serial.println(4);
     }
-    delay(100);
-  } 
+  }
 }
@@ -1,30 +1,82 @@
+import os
 from utils.VideoWriterFast import codec_t
 
 
 class params_t:
     cam_set = 'neuro'
     # cam_set = 'info'
+    # cam_set = 'sim'  # simulated cameras, see below
+
+    camera_backend = 'pylon'
+    # camera_backend = 'simulated'  # no hardware needed, use together with trigger_type = 'Simulated'
 
     """ default camera parameters """
     fps = 10.0
     cam_timeout = 1000   # time in ms
+    cam_setup_workers = None  # threads opening and configuring cameras, None is one per camera
+    auto_max_frames = 100  # images an auto function (gain, exposure, white balance) may take to converge
+    auto_timeout = 60.0  # sec an auto function may take to converge
+    profile_path = os.path.join(os.path.expanduser('~'), '.record_tool_profiles.json')  # settings per camera found by the auto functions
     exposure = 5000  # default value exposure time in us
     gain = 3.5  # default value gain
+    pixel_format = 'native'  # default pixel format: 'native' is the sensors Bayer pattern or Mono8, 'BGR8' demosaics on the camera
 
     """ default save parameters """
     out_path = '/home/zimmermc/projects/RecordTool/recordings'
     codec = codec_t.divx
+    # codec = codec_t.raw  # uncompressed capture for short high fps sessions, convert with transcode_raw.py afterwards
+    # codec = codec_t.ffmpeg  # encode with ffmpeg using the settings below, faster than OpenCV for H.264
+    ffmpeg_codec = 'libx264'  # any ffmpeg encoder, e.g. 'libx264', 'libx265' or 'ffv1' (lossless)
+    ffmpeg_preset = 'veryfast'  # speed/size trade-off of libx264 and libx265
+    ffmpeg_crf = 23  # quality of libx264 and libx265 (lower is better), None for the encoders default
+    ffmpeg_threads = 0  # encoder threads per video, 0 lets ffmpeg decide
+    ffmpeg_pix_fmt = 'yuv420p'  # pixel format of the video, None keeps the input format (use with 'ffv1')
+    ffmpeg_container = 'mp4'  # file extension of the videos, use 'mkv' for 'ffv1'
+    ffmpeg_bin = 'ffmpeg'  # path to the ffmpeg executable
+    # codec = codec_t.frames  # every frame compressed on its own, for random access with utils/FrameStore.py
+    frames_compression = 'jpg'  # 'jpg', 'png' or, if the packages are installed, 'zstd' or 'lz4' (last three are lossless)
+    frames_quality = 95  # JPEG quality or zstd level
+    frames_chunk_size = 1000  # frames per chunk file
+    frames_workers = 0  # threads compressing frames per camera, 0 uses all cores
+    raw_prealloc_sec = 60.0  # recording time disk space is preallocated for with codec_t.raw (files grow if needed)
+    frame_pool_size = 8  # number of preallocated frame buffers per camera, more are taken from the RAM budget when needed
+    writer_ram_budget = None  # bytes all writers together may use for frames waiting to be written, None: see below
+    writer_ram_fraction = 0.5  # without writer_ram_budget this fraction of the RAM available at start is used
+    writer_mode = 'thread'  # encode videos in threads of this process
+    # writer_mode = 'process'  # encode videos in separate processes, use this for many cameras or high fps
+    writer_ring_size = 128  # frames each shared memory ring in 'process' mode can hold at most, limited by the RAM budget
+    writer_processes = None  # number of encoder processes in 'process' mode, None means one per camera
+    overflow_policy = 'duplicate'  # what writers do with frames they have no room for: 'error', 'block', 'drop_newest', 'drop_oldest' or 'duplicate'
+    overflow_timeout = 0.1  # seconds a writer waits for room with overflow_policy 'block'
+    tuner_num_frames = 60  # frames grabbed from the first camera to compare encoders with (UI command "c")
+    tuner_margin = 1.5  # encoders need to be this much faster than the recording needs
+    tuner_min_psnr = 30.0  # minimal quality in dB an encoder has to reach
+    tuner_cache_path = os.path.join(os.path.expanduser('~'), '.record_tool_codecs.json')  # results per host and load
+    write_frame_meta = True  # write frame ids, camera timestamps and skipped frames of each video to runXXX_camN.meta
 
     """ default trigger parameters """
     # trigger_type = 'GPIO'
     trigger_type = 'Arduino'
+    # trigger_type = 'Simulated'  # software trigger clock of the simulated cameras
     trigger_delay = 0.0  # delay making cameras ready and trigger start (GPIO only)
+    trigger_spin_budget = 0.05  # fraction of each period the GPIO trigger may busy wait to hit its deadline (GPIO only)
     gpio_path = '/dev/ttyACM0'  # where the Arduino or GPIO module registers
+    trigger_ack_timeout = 1.0  # sec to wait for the Arduino to confirm a command (Arduino only)
+    trigger_boot_timeout = 3.0  # sec the Arduino may take to answer after opening its port, it resets (Arduino only)
 
     """ valid value range. """
     min_fps = 0.1  # min fps
     max_fps = 100.0  # max fps, also cant be exceeded in hw trigger mode (looks like the python api is limited to around 50fps, Our cameras are limited to 75 fps in BGR mode)
 
+    """ simulated cameras (camera_backend = 'simulated') """
+    sim_num_cams = 8  # number of cameras to simulate (at most as many as there are camera infos)
+    sim_size = (1024, 1280)  # height, width of the simulated frames
+    sim_color = True  # simulate color cameras, otherwise mono
+    sim_skip_rate = 0.0  # probability that a frame is followed by a skipped one
+    sim_timeout_rate = 0.0  # probability that retrieving a frame times out
+    sim_open_time = 0.0  # sec it takes to open a simulated camera
+    sim_node_time = 0.0  # sec it takes to write a setting of a simulated camera
+
     """ UI settings """
     show_recorded_frames = True  # make false if recording with high fps
     show_delay = 0.5  # maximum time in sec between showing two recorded frames, dont chose this to high because showing is fairly expensive
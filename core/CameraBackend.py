@@ -0,0 +1,37 @@
+from config.params import params_t
+
+
+def camera_backend_factory():
+    if params_t.camera_backend == 'pylon':
+        from core.PylonBackend import PylonBackend
+        return PylonBackend()
+    elif params_t.camera_backend == 'simulated':
+        from core.SimulatedBackend import SimulatedBackend
+        return SimulatedBackend()
+    else:
+        raise NotImplementedError
+
+
+""" Camera backend base class.
+
+    A backend enumerates the attached devices and creates camera objects from them. Cameras follow the interface of
+    pylon.InstantCamera. Grab strategies, timeout handling and the exception thrown on timeouts are provided as
+    attributes of the backend, so the recorder does not depend on pypylon directly.
+"""
+class CameraBackend(object):
+    GrabStrategy_LatestImages = None
+    GrabStrategy_LatestImageOnly = None
+    GrabStrategy_OneByOne = None
+    TimeoutHandling_ThrowException = None
+    TimeoutException = None
+
+    def __init__(self):
+        raise NotImplementedError
+
+    def enumerate_devices(self):
+        """ Returns a list of device infos, which provide IsSerialNumberAvailable() and GetSerialNumber(). """
+        raise NotImplementedError
+
+    def create_camera(self, device):
+        """ Creates a camera object from a device info returned by enumerate_devices(). """
+        raise NotImplementedError
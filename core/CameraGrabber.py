@@ -0,0 +1,152 @@
+import cv2
+import time
+import numpy as np
+from threading import Thread, Event
+from contextlib import contextmanager
+
+from utils.VideoWriterFast import QueueOverflow
+from utils.LatestValue import LatestFrame
+
+from config.params import params_t
+
+
+@contextmanager
+def grab_array(grab_result):
+    """ View on the grab buffer if pypylon supports it, otherwise a copy of it. """
+    if hasattr(grab_result, 'GetArrayZeroCopy'):
+        with grab_result.GetArrayZeroCopy() as img:
+            yield img
+    else:
+        yield grab_result.GetArray()
+
+
+"""
+    Grabs frames of a single camera in a separate thread and feeds them to the cameras video writer.
+    This way a slow camera (or a slow writer) only delays itself and not all others.
+"""
+class CameraGrabber(object):
+    def __init__(self, cid, cam_name, cam, video_writer, backend, meta_writer=None):
+        self.cid = cid
+        self.cam_name = cam_name
+        self.cam = cam
+        self.video_writer = video_writer
+        self.backend = backend
+        self.meta_writer = meta_writer  # optional FrameMetaWriter
+
+        # statistics, only written by the grabbing thread
+        self.num_frames = 0
+        self.num_skipped = 0
+        self.polling_freq = 0.0  # smoothed time between two frames in sec
+        self.latest_frame = LatestFrame()  # most recent frame, used for visualization
+        self.error = None  # set when grabbing ended because something went wrong
+
+        self.ready = Event()  # set once the thread waits for frames
+        self.stopped = False
+        self.draining = False
+        self._drain_timeout = params_t.cam_timeout
+
+        # intialize thread
+        self.thread = Thread(target=self.update, args=())
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def update(self):
+        last_poll = 0.0
+        timeout = params_t.cam_timeout
+        self.ready.set()
+        while not self.stopped:
+            if self.draining:
+                # trigger is stopped already: only fetch what is left in the buffers
+                timeout = self._drain_timeout
+
+            try:
+                grabResult = self.cam.RetrieveResult(timeout, self.backend.TimeoutHandling_ThrowException)
+            except self.backend.TimeoutException as e:
+                if not self.draining:
+                    self.error = e
+                break
+            host_time = time.time()
+
+            num_skipped = grabResult.GetNumberOfSkippedImages()
+            if self.meta_writer is not None:
+                frame_id, timestamp = grabResult.GetBlockID(), grabResult.GetTimeStamp()
+            if num_skipped > 0:
+                self.num_skipped += num_skipped
+                if params_t.warn_frame_missing:
+                    print('WARNING: %s missed %d frames' % (self.cam_name, num_skipped))
+
+            # copy the grab buffer once into a preallocated buffer of the writer (in the cameras pixel format)
+            try:
+                with grab_array(grabResult) as img:
+                    slot, frame = self.video_writer.acquire(img.shape, img.dtype)
+                    if slot is not None:
+                        np.copyto(frame, img)
+            except QueueOverflow as e:
+                self.error = e
+                break
+            finally:
+                grabResult.Release()
+
+            if slot is None:
+                # the writer had no room and its overflow policy dropped the frame, it is accounted for by the writer
+                if self.meta_writer is not None:
+                    self.meta_writer.append(self.num_frames, frame_id, timestamp, num_skipped, host_time)
+                self.num_frames += 1
+                continue
+
+            if params_t.inpaint_image_id:
+                color = (0, 255, 0) if len(frame.shape) == 3 else 255
+                cv2.putText(frame, '%s_%d' % (self.cam_name, self.num_frames),
+                            (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+
+            # keep image around for visualization, copied while the slot is still ours
+            self.latest_frame.put(frame)
+
+            # feed image to the writer
+            try:
+                self.video_writer.feed(frame, slot)
+            except QueueOverflow as e:
+                self.error = e
+                break
+            if getattr(self.video_writer, 'error', None) is not None:
+                self.error = self.video_writer.error
+                break
+            if self.meta_writer is not None:
+                self.meta_writer.append(self.num_frames, frame_id, timestamp, num_skipped, host_time)
+
+            # keep track of our speed
+            if last_poll > 0:
+                if self.polling_freq > 0:
+                    self.polling_freq = 0.85*self.polling_freq + 0.15*(host_time - last_poll)
+                else:
+                    self.polling_freq = host_time - last_poll
+            last_poll = host_time
+            self.num_frames += 1
+
+        self.stopped = True
+
+    def running(self):
+        return not self.stopped
+
+    def drain(self, timeout):
+        """ Fetch the frames remaining in the cameras buffer and stop once none arrives within timeout ms. """
+        self._drain_timeout = int(timeout)
+        self.draining = True
+
+    def wait_to_finish(self):
+        self.thread.join()
+
+    def stop(self):
+        # indicate that the thread should be stopped and wait for the current frame to be written
+        self.stopped = True
+        self.thread.join()
+
+    def get_state(self):
+        if self.polling_freq > 0:
+            state = 'Polling freq = %d' % round(1.0 / self.polling_freq)
+        else:
+            state = 'Polling freq = nan'
+        return state + ' Queue state ' + self.video_writer.get_state()
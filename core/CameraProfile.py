@@ -0,0 +1,78 @@
+"""
+    Camera settings per serial number.
+
+    A profile starts with gain and exposure of the camera infos (config/camera_infos.py) and takes over what the auto
+    functions found for the camera. Those values are stored in params_t.profile_path, so they are used again after a
+    restart. apply_nodes() only writes nodes whose value differs from what the camera has already, which saves most
+    GenICam round trips when setting up a rig that was configured before.
+"""
+import os
+import json
+import threading
+
+from config.params import params_t
+
+
+def same_value(a, b):
+    """ Floats are compared loosely, cameras round them to their increments. """
+    if isinstance(a, float) or isinstance(b, float):
+        return abs(float(a) - float(b)) <= 1e-3 * max(abs(float(b)), 1.0)
+    return a == b
+
+
+def apply_nodes(cam, nodes):
+    """ Sets nodes, a list of (node name, value), in the given order and returns how many were written. Nodes behind a
+        selector are preceded by it, e.g. ('LineSelector', 'Line3'), ('LineMode', 'Input'). """
+    num_written = 0
+    for name, value in nodes:
+        node = getattr(cam, name)
+        if not same_value(node.GetValue(), value):
+            node.SetValue(value)
+            num_written += 1
+    return num_written
+
+
+class CameraProfiles(object):
+    def __init__(self, camera_info, path=None):
+        self._camera_info = camera_info
+        self.path = params_t.profile_path if path is None else path
+        self._saved = dict()  # serial number -> node values found by auto functions
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as fi:
+                self._saved = json.load(fi)
+        self._lock = threading.Lock()  # auto functions of all cameras update at the same time
+
+    def get(self, sn):
+        """ Node name -> value for camera sn. Nodes behind a selector hold a dict selector value -> value. """
+        profile = {'Gain': self._camera_info[sn]['gain'], 'ExposureTime': self._camera_info[sn]['exposure']}
+        profile.update(self._saved.get(sn, dict()))
+        return profile
+
+    def nodes(self, sn):
+        """ The profile of camera sn as list for apply_nodes(). """
+        nodes = list()
+        for name, value in sorted(self.get(sn).items()):
+            if isinstance(value, dict):
+                for selected, v in sorted(value.items()):
+                    nodes += [(name + 'Selector', selected), (name, v)]
+            else:
+                nodes.append((name, value))
+        return nodes
+
+    def update(self, sn, values):
+        with self._lock:
+            self._saved.setdefault(sn, dict()).update(values)
+            self._save()
+
+    def reset(self, sn, names):
+        """ Forgets the saved values of nodes, so the camera infos apply again. """
+        with self._lock:
+            for name in names:
+                self._saved.get(sn, dict()).pop(name, None)
+            self._save()
+
+    def _save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as fo:
+            json.dump(self._saved, fo, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,77 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from config.params import params_t
+
+
+"""
+    Keeps the attached cameras open between commands.
+
+    Creating and opening a camera takes a noticeable time per device. The session holds one open camera per serial
+    number, refresh() enumerates the devices again and only creates cameras that were attached since, cameras that
+    are gone are dropped. Opening and configuring runs on a thread pool, one camera per thread, so setting up a rig
+    takes about as long as setting up its slowest camera.
+"""
+class CameraSession(object):
+    def __init__(self, backend, camera_info, verbosity=0):
+        self._backend = backend
+        self._camera_info = camera_info
+        self._verbosity = verbosity
+        self.cams = dict()  # serial number -> open camera
+        self.serials = list()  # in the order the devices were enumerated
+
+    def refresh(self):
+        """ Looks for attached and detached cameras. Returns the list of cameras and the list of their given names. """
+        devices = dict()
+        for dev in self._backend.enumerate_devices():
+            assert dev.IsSerialNumberAvailable(), 'Could not read serial number.'
+            sn = dev.GetSerialNumber()
+            msg = 'Camera with serial number %s does not have a given name. Please define one in config/camera_names.py' % sn
+            assert sn in self._camera_info.keys(), msg
+            devices[sn] = dev
+
+        for sn in list(self.cams.keys()):
+            if sn not in devices or self._is_removed(self.cams[sn]):
+                if self._verbosity > 0:
+                    print('Camera %s (%s) was detached' % (self._camera_info[sn]['name'], sn))
+                self._close(self.cams.pop(sn))
+
+        new_serials = [sn for sn in devices if sn not in self.cams]
+        for sn, cam in zip(new_serials, self.map(lambda sn: self._open(devices[sn]), new_serials)):
+            self.cams[sn] = cam
+        self.serials = list(devices.keys())
+        return self.camera_list(), [self._camera_info[sn]['name'] for sn in self.serials]
+
+    def camera_list(self):
+        return [self.cams[sn] for sn in self.serials]
+
+    def map(self, fct, items=None):
+        """ Calls fct for every item, the cameras by default, in parallel and returns the results in order. The first
+            exception raised by a call is raised again. """
+        if items is None:
+            items = self.camera_list()
+        if len(items) <= 1:
+            return [fct(x) for x in items]
+        num_workers = params_t.cam_setup_workers or len(items)
+        with ThreadPoolExecutor(min(num_workers, len(items))) as pool:
+            return list(pool.map(fct, items))
+
+    def close(self):
+        for cam in self.cams.values():
+            self._close(cam)
+        self.cams, self.serials = dict(), list()
+
+    def _open(self, device):
+        cam = self._backend.create_camera(device)
+        cam.Open()
+        return cam
+
+    def _close(self, cam):
+        try:
+            cam.Close()
+        except Exception:
+            pass  # the device is gone already
+
+    def _is_removed(self, cam):
+        # pylon notices when a device got unplugged, even if it is back by now its handle is not usable anymore
+        is_removed = getattr(cam, 'IsCameraDeviceRemoved', None)
+        return is_removed is not None and is_removed()
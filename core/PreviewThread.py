@@ -0,0 +1,78 @@
+import cv2
+import time
+import numpy as np
+from threading import Thread
+
+from utils.PreviewCompositor import PreviewCompositor
+from utils.LatestValue import LatestValue
+
+from config.params import params_t
+
+
+"""
+    Shows the recorded frames and reads the stop key without delaying grabbing.
+    Gets the most recent frame of each camera through a LatestValue and composes the preview in a separate thread.
+    HighGUI only works reliably on the main thread, so the window is shown by wait(), which the recording loop calls
+    instead of waiting on stop_event. It sets stop_event when "q" is pressed.
+"""
+class PreviewThread(object):
+    def __init__(self, latest_frames, pixel_formats, stop_event, show_frames=True):
+        self.latest_frames = latest_frames
+        self.pixel_formats = pixel_formats
+        self.stop_event = stop_event
+        self.show_frames = show_frames
+
+        self.canvas = LatestValue()  # finished preview images, handed to the main thread
+        self._canvases = list()  # two copies of the compositors image, one is shown while the other is written
+        self._shown = 0  # sequence number of the canvas shown last
+
+        self.stopped = False
+        # intialize thread
+        self.thread = Thread(target=self.update, args=())
+        self.thread.daemon = True
+
+    def start(self):
+        if self.show_frames:
+            self.thread.start()
+        return self
+
+    def update(self):
+        compositor = None
+        shown = [0] * len(self.latest_frames)
+        while not self.stopped:
+            frames = [latest.get() for latest in self.latest_frames]
+            if all([frame is not None for _, frame in frames]):
+                if compositor is None:
+                    compositor = PreviewCompositor([frame.shape for _, frame in frames], self.pixel_formats,
+                                                   target_size=params_t.show_size)
+                    self._canvases = [compositor.image.copy(), compositor.image.copy()]
+                if any([seq != shown[cid] for cid, (seq, _) in enumerate(frames)]):
+                    for cid, (seq, frame) in enumerate(frames):
+                        if seq != shown[cid]:
+                            compositor.update(cid, frame)
+                            shown[cid] = seq
+                    out = self._canvases[self.canvas.get()[0] % 2]
+                    np.copyto(out, compositor.image)
+                    self.canvas.put(out)
+            time.sleep(params_t.show_delay)
+
+    def wait(self, timeout):
+        """ Main thread: Shows the latest preview and waits up to timeout sec for a key. Returns True once stop_event
+            is set, like Event.wait(). """
+        seq, canvas = self.canvas.get()
+        if canvas is None:
+            # dummy show image (otherwise 'q' key is not readable)
+            cv2.imshow('cams', np.ones((25, 25, 3), dtype=np.uint8))
+        elif seq != self._shown:
+            cv2.imshow('cams', canvas)
+            self._shown = seq
+        k = cv2.waitKey(max(int(timeout * 1000), 1))
+        if k == ord('q'):
+            self.stop_event.set()
+        return self.stop_event.is_set()
+
+    def stop(self):
+        self.stopped = True
+        if self.thread.is_alive():
+            self.thread.join()
+        cv2.destroyAllWindows()
@@ -0,0 +1,29 @@
+from pypylon import genicam
+from pypylon import pylon
+
+from core.CameraBackend import CameraBackend
+
+
+# Another way to get warnings when images are missing ... not used
+class MyImageEventHandler(pylon.ImageEventHandler):
+    def OnImagesSkipped(self, camera, countOfSkippedImages):
+        print("EVENT: OnImagesSkipped", countOfSkippedImages)
+
+
+""" Basler cameras attached to this machine. """
+class PylonBackend(CameraBackend):
+    GrabStrategy_LatestImages = pylon.GrabStrategy_LatestImages
+    GrabStrategy_LatestImageOnly = pylon.GrabStrategy_LatestImageOnly
+    GrabStrategy_OneByOne = pylon.GrabStrategy_OneByOne
+    TimeoutHandling_ThrowException = pylon.TimeoutHandling_ThrowException
+    TimeoutException = genicam.TimeoutException
+
+    def __init__(self):
+        # Get the transport layer factory.
+        self._tl_factory = pylon.TlFactory.GetInstance()
+
+    def enumerate_devices(self):
+        return self._tl_factory.EnumerateDevices()
+
+    def create_camera(self, device):
+        return pylon.InstantCamera(self._tl_factory.CreateDevice(device))
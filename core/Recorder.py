@@ -1,31 +1,33 @@
 import os
+import json
+import shutil
 import cv2
 import time
 import datetime
-import numpy as np
-from collections import defaultdict
+import threading
 
-from pypylon import genicam
-from pypylon import pylon
-
-from core.Trigger import trigger_factory
+from core.Trigger import trigger_factory, TriggerTimeout
+from core.CameraBackend import camera_backend_factory
+from core.CameraGrabber import CameraGrabber
+from core.CameraSession import CameraSession
+from core.CameraProfile import CameraProfiles, apply_nodes
+from core.PreviewThread import PreviewThread
 
 from utils.general_util import my_mkdir
-from utils.VideoWriterFast import VideoWriterFast
-from utils.StitchedImage import StitchedImage
+from utils.VideoWriterFast import VideoWriterFast, codec_t, file_extension
+from utils.FFmpegStream import ffmpeg_options
+from utils.FrameStore import frame_store_options
+from utils import CodecTuner
+from utils.RawVideo import RawVideoWriter
+from utils.FrameMeta import FrameMetaWriter
+from utils.MemoryGovernor import MemoryGovernor
+from utils.VideoWriterProcess import VideoWriterProcess, EncoderPool, EncoderDied
+from utils.PixelFormat import to_bgr, native_pixel_format
 
 from config.params import params_t
 from config.camera_infos import get_camera_infos
 
 
-# Another way to get warnings when images are missing ... not used
-class MyImageEventHandler(pylon.ImageEventHandler):
-    def OnImagesSkipped(self, camera, countOfSkippedImages):
-        print("EVENT: OnImagesSkipped", countOfSkippedImages)
-
-def zeros():
-    return 0.0
-
 def rel_close(v, max_v, thresh=5.0):
     v_scaled = v / max_v * 100.0
     if 100.0 - v_scaled < thresh:
@@ -38,6 +40,9 @@ class Recorder(object):
         self._verbosity = verbosity
 
         self._camera_info = get_camera_infos()
+        self._backend = camera_backend_factory()
+        self._session = CameraSession(self._backend, self._camera_info, verbosity)
+        self._profiles = CameraProfiles(self._camera_info)
         self._camera_list = list()
         self._camera_names_list = list()
 
@@ -45,6 +50,8 @@ class Recorder(object):
         self._rid = 0
         self.fps = params_t.fps
         self._trigger = None
+        self._encoder_pool = None
+        self._governor = None
 
     @property
     def fps(self):
@@ -77,378 +84,501 @@ class Recorder(object):
             return
         ind = self._camera_names_list.index(cam_name)
         self._config_cams_continuous(self._camera_list[ind])
-        self._camera_list[ind].StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
+        self._camera_list[ind].StartGrabbing(self._backend.GrabStrategy_LatestImageOnly)
 
         k = None
         while not k == ord('q'):
             try:
-                grabResult = self._camera_list[ind].RetrieveResult(params_t.cam_timeout, pylon.TimeoutHandling_ThrowException)
-                img = grabResult.GetArray()
-                if len(img.shape) == 2:
-                    img = np.stack([img]*3, -1)
+                grabResult = self._camera_list[ind].RetrieveResult(params_t.cam_timeout, self._backend.TimeoutHandling_ThrowException)
+                img = to_bgr(grabResult.GetArray(), self._camera_list[ind].PixelFormat.GetValue())
 
                 cv2.imshow(cam_name, img)
                 k = cv2.waitKey(10)
 
-            except genicam.TimeoutException as e:
+            except self._backend.TimeoutException as e:
                 print(e)
                 print('Timeout happened. Giving up')
                 break
 
-        self._camera_list[ind].Close()
+        self._camera_list[ind].StopGrabbing()
         cv2.destroyAllWindows()
 
-    def run_record_cams(self):
+    def run_record_cams(self, duration=None):
+        """ Record until "q" is pressed or, if given, for duration seconds. """
+        setup_start = time.time()
         self._setup_cams()
         print('Start recording with hardware trigger at %.1f FPS. (press "q" to stop recording)' % self.fps)
 
         video_path_template = self._init_recording()
-        self._init_trigger()
+        # whatever fails until the trigger runs, the cameras, writers and threads started so far are stopped again
+        grabber_list, video_writer_list, preview = list(), list(), None
+        started = False
+        try:
+            self._init_trigger()
+
+            # make cameras ready for trigger, every camera gets its own grabbing thread and writer
+            self._session.map(self._config_cams_hw_trigger)
+            pixel_format_list = [cam.PixelFormat.GetValue() for cam in self._camera_list]
+            video_writer_list = self._init_writers(video_path_template, pixel_format_list)
+            for cid, (cam_name, cam) in enumerate(zip(self._camera_names_list, self._camera_list)):
+                cam.StartGrabbing(self._backend.GrabStrategy_LatestImages)
+                # cam.StartGrabbing(self._backend.GrabStrategy_LatestImageOnly)  # here you dont have any buffer
+                # cam.StartGrabbing(self._backend.GrabStrategy_OneByOne)  # here you dont get warnings if something gets skipped
+                meta_writer = None
+                if params_t.write_frame_meta:
+                    meta_writer = FrameMetaWriter(os.path.splitext(video_path_template % cam_name)[0] + '.meta')
+                grabber_list.append( CameraGrabber(cid, cam_name, cam, video_writer_list[cid], self._backend,
+                                                   meta_writer=meta_writer).start() )
+
+            # preview and stop key, not needed when recording for a fixed duration
+            stop_event = threading.Event()
+            if params_t.show_recorded_frames or duration is None:
+                preview = PreviewThread([g.latest_frame for g in grabber_list], pixel_format_list, stop_event,
+                                        show_frames=params_t.show_recorded_frames).start()
+
+            # start trigger, but only once every camera waits for it. Pulses before would not be recorded by all of them
+            for g in grabber_list:
+                if not g.ready.wait(params_t.cam_timeout / 1000.0) or not g.cam.IsGrabbing():
+                    raise RuntimeError('%s is not ready for the trigger.' % g.cam_name)
+            if self._verbosity > 1:
+                print('Cameras ready for the trigger after %.2f sec' % (time.time() - setup_start))
+            self._trigger.start()
+            started = True
+        finally:
+            if not started:
+                self._abort_recording(grabber_list, video_writer_list, preview)
+        start = time.time()
+
+        # coordinating loop: only checks on the grabbers and prints statistics, the preview window is shown meanwhile
+        wait = stop_event.wait if preview is None else preview.wait
+        while not wait(0.1):
+            if duration is not None and (time.time() - start) > duration:
+                break
 
-        # make cameras ready for trigger
-        video_writer_list = list()
-        for cam_name, cam in zip(self._camera_names_list, self._camera_list):
-            self._config_cams_hw_trigger(cam)
-            cam.StartGrabbing(pylon.GrabStrategy_LatestImages)
-            # cam.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)  # here you dont have any buffer
-            # cam.StartGrabbing(pylon.GrabStrategy_OneByOne)  # here you dont get warnings if something gets skipped
-            video_writer_list.append( VideoWriterFast(video_path_template % cam_name,
-                                                      fps=self.fps,
-                                                      codec=params_t.codec) )
-
-        # start trigger
-        self._trigger.start()
-
-        # recording loop
-        k = None
-        last_show = 0
-        num_frames = defaultdict(zeros)
-        video_writer_q_state, cam_polling_freq, cam_last_poll = defaultdict(zeros), defaultdict(zeros), defaultdict(zeros)
-        while not k == ord('q'):
-            try:
-                img_list = list()
-                for cid, (cam_name, cam) in enumerate(zip(self._camera_names_list, self._camera_list)):
-                    grabResult = cam.RetrieveResult(params_t.cam_timeout, pylon.TimeoutHandling_ThrowException)
-
-                    if params_t.warn_frame_missing:
-                        if grabResult.GetNumberOfSkippedImages() > 0:
-                            print('WARNING: Missed %d frames' % grabResult.GetNumberOfSkippedImages())
-
-                    img = grabResult.GetArray()
-
-                    if len(img.shape) == 2:
-                        img = np.stack([img]*3, -1)
-
-                    if params_t.inpaint_image_id:
-                        cv2.putText(img, '%s_%d' % (cam_name, num_frames[cid]),
-                                    (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-
-                    # feed image to the writer
-                    video_writer_list[cid].feed(img)
-
-                    # keep track of our speed
-                    if params_t.print_aquisition_state:
-                        video_writer_q_state[cid] = video_writer_list[cid].get_state()
-                        if cam_last_poll[cid] > 0:
-                            if cam_polling_freq[cid] > 0:
-                                cam_polling_freq[cid] = 0.85*cam_polling_freq[cid] + 0.15 * (time.time() - cam_last_poll[cid])
-                            else:
-                                cam_polling_freq[cid] = time.time() - cam_last_poll[cid]
-                        cam_last_poll[cid] = time.time()
-                    num_frames[cid] += 1
-
-                    # keep image around for visualization
-                    img_list.append(img)
-
-                # show image
-                if (time.time() - last_show) > params_t.show_delay and params_t.show_recorded_frames:
-                    stitch = StitchedImage(img_list, target_size=params_t.show_size)
-                    cv2.imshow('cams', stitch.image)
-                    k = cv2.waitKey(1)
-                    last_show = time.time()
-
-                # dummy show image (otherwise 'q' key is not readable)
-                if not params_t.show_recorded_frames:
-                    cv2.imshow('cams', np.ones((25, 25, 3), dtype=np.uint8))
-                    k = cv2.waitKey(1)
-
-                # print speed measurements if needed
-                if params_t.print_aquisition_state:
-                    for cid in range(len(cam_polling_freq)):
-                        print('dev%d' % cid, 'Polling freq = %d' % round(1.0/cam_polling_freq[cid]), 'Queue state', video_writer_q_state[cid], end='\t')
-                    print('', end='\r')
-                    # print('', end='\n')
-
-            except genicam.TimeoutException as e:
-                print(e)
-                print('Timeout happened. Giving up.')
+            failed = [g for g in grabber_list if not g.running()]
+            if len(failed) > 0:
+                for g in failed:
+                    if g.error is not None:
+                        print('%s: %s' % (g.cam_name, g.error))
+                print('Grabbing stopped for %s. Giving up.' % ', '.join([g.cam_name for g in failed]))
                 break
 
+            # print speed measurements if needed
+            if params_t.print_aquisition_state:
+                for g in grabber_list:
+                    print('dev%d' % g.cid, g.get_state(), end='\t')
+                print(self._governor.get_state(), end='\t')
+                print('', end='\r')
+                # print('', end='\n')
+
         if params_t.print_aquisition_state:
             print('')
-
-        # stop trigger
-        self._trigger.end()
-        del self._trigger
+        if preview is not None:
+            preview.stop()
+
+        # stop trigger and fetch the frames that are still buffered by the cameras
+        try:
+            self._trigger.end()
+        except TriggerTimeout as e:
+            print('WARNING: %s The number of trigger pulses is not known.' % e)
+            self._trigger.num_pulses = None
+        finally:
+            self._trigger.close()
+        if self._verbosity > 1 and hasattr(self._trigger, 'get_state'):
+            print('Trigger:%s' % self._trigger.get_state())
+        num_pulses = getattr(self._trigger, 'num_pulses', None)
         self._trigger = None
+        duration = time.time() - start
+
+        for g in grabber_list:
+            g.drain(timeout=2000.0 / self.fps + 50.0)
+        for g in grabber_list:
+            g.wait_to_finish()
+            if g.meta_writer is not None:
+                g.meta_writer.close()
+        self._reconcile_frames(grabber_list, num_pulses, video_path_template)
 
         if self._verbosity > 2:
-            for cid, num in num_frames.items():
-                print('Device %d recorded %d frames' % (cid, num))
+            for g in grabber_list:
+                print('Device %d recorded %d frames (%.1f FPS)' % (g.cid, g.num_frames, g.num_frames / duration))
 
         for cam in self._camera_list:
-            cam.Close()
+            cam.StopGrabbing()
 
         if self._verbosity > 0:
             print('Waiting for writers to finish ...')
-        for writer in video_writer_list:
-            writer.wait_to_finish()
-            writer.stop()
-        cv2.destroyAllWindows()
+        for g in grabber_list:
+            g.latest_frame.clear()
+            try:
+                g.video_writer.wait_to_finish()
+                g.video_writer.stop()
+            except EncoderDied:
+                pass  # reported below, the writer released its memory already
+            if getattr(g.video_writer, 'error', None) is not None:
+                print('ERROR: Writing %s failed: %s' % (g.cam_name, g.video_writer.error))
+            self._save_overflow(g, video_path_template)
+            if self._verbosity > 2 and hasattr(g.video_writer, 'metrics'):
+                print('Writer of %s:%s' % (g.cam_name, g.video_writer.metrics.get_state()))
+        if self._encoder_pool is not None:
+            self._encoder_pool.stop()
+            self._encoder_pool = None
+        if self._verbosity > 1:
+            print(self._governor.report())
+        self._governor = None
 
         self._rid += 1
 
-    def run_white_balance(self):
-        self._setup_cams()
-
-        for idx, (cam_name, cam) in enumerate(zip(self._camera_names_list, self._camera_list)):
-            cam.Open()
-
-            if not self.is_color_cam(cam):
-                print('Not a color cam: %d \t%s \t\t%s' % (idx, cam_name, cam.GetDeviceInfo().GetSerialNumber()))
-                print('Skipping white balancing.')
-                continue
-
-            cam.AutoFunctionROISelector.SetValue('ROI1')
-            cam.AutoFunctionROIUseWhiteBalance.SetValue(False)
-            cam.AutoFunctionROISelector.SetValue('ROI2')
-            cam.AutoFunctionROIUseWhiteBalance.SetValue(True)
+    def _reconcile_frames(self, grabber_list, num_pulses, video_path_template):
+        """ Compares the frames of each camera with the pulses the trigger fired and writes both to runXXX.trigger.json.
+            Frames skipped by a camera were received, but not retrieved in time. """
+        frames = {g.cam_name: {'recorded': g.num_frames, 'skipped': g.num_skipped} for g in grabber_list}
+        with open(os.path.join(os.path.dirname(video_path_template), 'run%03d.trigger.json' % self._rid), 'w') as fo:
+            json.dump({'fps': self.fps, 'num_pulses': num_pulses, 'frames': frames}, fo, indent=2)
+        if num_pulses is None:
+            return
 
-            # define ROI to use
-            cam.AutoFunctionROISelector.SetValue('ROI2')
-            cam.AutoFunctionROIWidth.SetValue(cam.Width.GetValue())
-            cam.AutoFunctionROIHeight.SetValue(cam.Height.GetValue())
-            cam.AutoFunctionROIOffsetX.SetValue(0)
-            cam.AutoFunctionROIOffsetY.SetValue(0)
+        for g in grabber_list:
+            missing = num_pulses - g.num_frames - g.num_skipped
+            if missing != 0 and self._verbosity > 0:
+                print('WARNING: %s got %d of %d trigger pulses (%d recorded, %d skipped).' % (
+                    g.cam_name, g.num_frames + g.num_skipped, num_pulses, g.num_frames, g.num_skipped))
+
+    def _abort_recording(self, grabber_list, video_writer_list, preview):
+        """ Stops what run_record_cams() started when the recording could not start. Nothing was triggered, so nothing
+            is written anymore. """
+        if preview is not None:
+            preview.stop()
+        if self._trigger is not None:
+            try:
+                self._trigger.end()  # the trigger may run although starting it failed, e.g. an acknowledge got lost
+            except Exception:
+                pass
+            finally:
+                self._trigger.close()
+                self._trigger = None
+        for g in grabber_list:
+            g.stop()
+            if g.meta_writer is not None:
+                g.meta_writer.close()
+        for cam in self._camera_list:
+            cam.StopGrabbing()
+        for video_writer in video_writer_list:
+            try:
+                video_writer.stop()
+            except EncoderDied:
+                pass
+        if self._encoder_pool is not None:
+            self._encoder_pool.stop()
+            self._encoder_pool = None
+        self._governor = None
+
+    def _save_overflow(self, grabber, video_path_template):
+        """ Writes which frames of a camera were affected by the writers overflow policy to runXXX_camN.overflow.json. """
+        overflow = getattr(grabber.video_writer, 'overflow', None)
+        if overflow is None:
+            return
+        overflow.save(os.path.splitext(video_path_template % grabber.cam_name)[0] + '.overflow.json')
+        if self._verbosity > 0 and (overflow.num_lost() > 0 or len(overflow.blocked) > 0):
+            print('WARNING: Writer of %s could not keep up:%s' % (grabber.cam_name, overflow.get_state()))
 
-            # get initial values
-            if self._verbosity > 1:
-                print('Initial balance ratio:', end='\t')
-                cam.BalanceRatioSelector.SetValue('Red')
-                print('Red= ', cam.BalanceRatio.GetValue(), end='\t')
-                cam.BalanceRatioSelector.SetValue('Green')
-                print('Green= ', cam.BalanceRatio.GetValue(), end='\t')
-                cam.BalanceRatioSelector.SetValue('Blue')
-                print('Blue= ', cam.BalanceRatio.GetValue())
-
-            cam.BalanceWhiteAuto.SetValue('Once')
-
-            i = 0
-            while not cam.BalanceWhiteAuto.GetValue() == 'Off':
-                cam.GrabOne(5000)
-                i += 1
-
-                if i > 100:
-                    print('Auto Gain was not successful')
-                    break
-
-            # get final values
-            if self._verbosity > 1:
-                print('Final balance ratio:', end='\t')
-                cam.BalanceRatioSelector.SetValue('Red')
-                print('Red= ', cam.BalanceRatio.GetValue(), end='\t')
-                cam.BalanceRatioSelector.SetValue('Green')
-                print('Green= ', cam.BalanceRatio.GetValue(), end='\t')
-                cam.BalanceRatioSelector.SetValue('Blue')
-                print('Blue= ', cam.BalanceRatio.GetValue())
+    def run_codec_tuning(self, retune=False):
+        """ Picks the encoder settings that keep up with all cameras at the current fps (see utils/CodecTuner.py).
+            Frames of the first camera are used for testing. The result is cached per host, unless retune is set. """
+        self._setup_cams()
+        cam = self._camera_list[0]
+        self._config_cams_continuous(cam)
+        pixel_format = cam.PixelFormat.GetValue()
+
+        cam.StartGrabbing(self._backend.GrabStrategy_OneByOne)
+        frames = list()
+        while len(frames) < params_t.tuner_num_frames:
+            grabResult = cam.RetrieveResult(params_t.cam_timeout, self._backend.TimeoutHandling_ThrowException)
+            frames.append(grabResult.GetArray())
+            grabResult.Release()
+        cam.StopGrabbing()
+
+        key = CodecTuner.load_key(self.fps, len(self._camera_list), frames[0].shape, pixel_format)
+        choice = None if retune else CodecTuner.load_cached(params_t.tuner_cache_path, key)
+        if choice is not None:
+            print('Using cached encoder settings for %s: %s' % (key, choice['name']))
+        else:
+            print('Testing encoders with %d frames of %s (%s) ...' % (len(frames), self._camera_names_list[0], pixel_format))
+            choice, _ = CodecTuner.tune(frames, pixel_format, self.fps, len(self._camera_list),
+                                        margin=params_t.tuner_margin, min_psnr=params_t.tuner_min_psnr,
+                                        ffmpeg_bin=params_t.ffmpeg_bin, verbose=self._verbosity > 0)
+            if choice is None:
+                print('WARNING: No encoder keeps up with %d cameras at %.1f FPS. Keeping codec %s, consider '
+                      'codec_t.raw.' % (len(self._camera_list), self.fps, params_t.codec))
+                return
+            CodecTuner.save_cached(params_t.tuner_cache_path, key, choice)
+
+        CodecTuner.apply(choice, params_t)
+        print('Recording with %s (%.1f Mbit/s per camera, PSNR %.1f dB)' % (choice['name'], choice['bitrate_mbit'],
+                                                                        choice['psnr']))
 
-            cam.Close()
+    def run_white_balance(self):
+        """ Auto white balance of all color cameras at once. """
+        self._setup_cams()
+        self._run_auto('White balance', self._white_balance_cam)
+
+    def _white_balance_cam(self, cam):
+        if not self.is_color_cam(cam):
+            return {'status': 'skipped', 'value': 'not a color cam'}
+
+        cam.AutoFunctionROISelector.SetValue('ROI1')
+        cam.AutoFunctionROIUseWhiteBalance.SetValue(False)
+        cam.AutoFunctionROISelector.SetValue('ROI2')
+        cam.AutoFunctionROIUseWhiteBalance.SetValue(True)
+
+        # define ROI to use
+        cam.AutoFunctionROISelector.SetValue('ROI2')
+        cam.AutoFunctionROIWidth.SetValue(cam.Width.GetValue())
+        cam.AutoFunctionROIHeight.SetValue(cam.Height.GetValue())
+        cam.AutoFunctionROIOffsetX.SetValue(0)
+        cam.AutoFunctionROIOffsetY.SetValue(0)
+
+        def balance_ratios():
+            ratios = list()
+            for color in ['Red', 'Green', 'Blue']:
+                cam.BalanceRatioSelector.SetValue(color)
+                ratios.append(cam.BalanceRatio.GetValue())
+            return ratios
+
+        initial = balance_ratios()
+        cam.BalanceWhiteAuto.SetValue('Once')
+        num_frames, converged = self._wait_auto(cam, cam.BalanceWhiteAuto)
+        final = balance_ratios()
+        if converged:
+            sn = cam.GetDeviceInfo().GetSerialNumber()
+            self._profiles.update(sn, {'BalanceRatio': dict(zip(['Red', 'Green', 'Blue'], final))})
+        return {'frames': num_frames, 'status': 'ok' if converged else 'timeout',
+                'value': 'RGB %s' % ' '.join(['%.2f->%.2f' % x for x in zip(initial, final)])}
 
     def set_gain_exposure(self):
-        """ Set default values defined in config/params.py """
+        """ Set default values defined in config/params.py, forgetting what the auto functions found. """
         self._setup_cams()
 
         for idx, (cam_name, cam) in enumerate(zip(self._camera_names_list, self._camera_list)):
-            cam.Open()
             # set exposure to its reference value
             sn = cam.GetDeviceInfo().GetSerialNumber()
-            cam.Gain.SetValue(self._camera_info[sn]['gain'])
-            cam.ExposureTime.SetValue(self._camera_info[sn]['exposure'])
-            cam.Close()
+            self._profiles.reset(sn, ['Gain', 'ExposureTime'])
+            apply_nodes(cam, [('Gain', self._camera_info[sn]['gain']),
+                              ('ExposureTime', self._camera_info[sn]['exposure'])])
 
     def run_auto_gain(self):
-        """ Adjust gain while keeping exposure time fixed. """
+        """ Adjust gain while keeping exposure time fixed, on all cameras at once. """
         self._setup_cams()
-
-        for idx, (cam_name, cam) in enumerate(zip(self._camera_names_list, self._camera_list)):
-            print('Auto gain for: %d \t%s \t\t%s' % (idx, cam_name, cam.GetDeviceInfo().GetSerialNumber()))
-
-            cam.Open()
-            cam.AutoFunctionROISelector.SetValue('ROI1')
-            cam.AutoFunctionROIUseBrightness.SetValue(True)
-            cam.AutoFunctionROISelector.SetValue('ROI2')
-            cam.AutoFunctionROIUseBrightness.SetValue(False)
-
-            # define ROI to use
-            cam.AutoFunctionROISelector.SetValue('ROI1')
-            wOff = int(cam.Width.GetValue() / 4)
-            hOff = int(cam.Height.GetValue() / 4)
-            wSize = int(cam.Width.GetValue() / 2)
-            hSize = int(cam.Height.GetValue() / 2)
-
-            # Enforce size is a multiple of two (important because of bayer pattern)
-            wSize = int(wSize/2)*2
-            hSize = int(hSize/2)*2
-
-            # set ROI
-            cam.AutoFunctionROIWidth.SetValue(wSize)
-            cam.AutoFunctionROIHeight.SetValue(hSize)
-            cam.AutoFunctionROIOffsetX.SetValue(wOff)
-            cam.AutoFunctionROIOffsetY.SetValue(hOff)
-
-            # 0.3 means that the target brightness is 30 % of the maximum brightness
-            # of the raw pixel value read out from the sensor.
-            cam.AutoTargetBrightness.SetValue(0.2)
-
-            # give auto some bounds
-            cam.AutoGainLowerLimit.SetValue(cam.Gain.GetMin())
-            cam.AutoGainUpperLimit.SetValue(cam.Gain.GetMax())
-
-            # set exposure to its reference value
-            sn = cam.GetDeviceInfo().GetSerialNumber()
-            cam.ExposureTime.SetValue(self._camera_info[sn]['exposure'])
-            # print('Initial gain', cam.Gain.GetValue())
-            cam.GainAuto.SetValue('Once')
-
-            i = 0
-            while not cam.GainAuto.GetValue() == 'Off':
-                cam.GrabOne(5000)
-                i += 1
-
-                if i > 100:
-                    print('Auto Gain was not successful')
-                    break
-
-            if self._verbosity > 1:
-                print('Final gain after %d images %.1f '
-                      '(in [%.1f, %.1f])' % (i, cam.Gain.GetValue(),
-                                             cam.Gain.GetMin(), cam.Gain.GetMax()))
-
-            # check if we should give warnings
-            if rel_close(cam.Gain.GetValue(), cam.Gain.GetMax()):
-                if self._verbosity > 0:
-                    print('Final gain value is very close to its maximum value:'
-                          ' Consider increasing gain, opening camera shutter wider or put more light.')
-
-            cam.Close()
+        self._run_auto('Auto gain', self._auto_gain_cam)
+
+    def _auto_gain_cam(self, cam):
+        self._set_brightness_roi(cam)
+
+        # give auto some bounds
+        cam.AutoGainLowerLimit.SetValue(cam.Gain.GetMin())
+        cam.AutoGainUpperLimit.SetValue(cam.Gain.GetMax())
+
+        # set exposure to its reference value
+        sn = cam.GetDeviceInfo().GetSerialNumber()
+        cam.ExposureTime.SetValue(self._camera_info[sn]['exposure'])
+        initial = cam.Gain.GetValue()
+        cam.GainAuto.SetValue('Once')
+        num_frames, converged = self._wait_auto(cam, cam.GainAuto)
+        if converged:
+            self._profiles.update(sn, {'Gain': cam.Gain.GetValue(), 'ExposureTime': cam.ExposureTime.GetValue()})
+
+        result = {'frames': num_frames, 'status': 'ok' if converged else 'timeout',
+                  'value': 'gain %.1f->%.1f (in [%.1f, %.1f])' % (initial, cam.Gain.GetValue(),
+                                                                  cam.Gain.GetMin(), cam.Gain.GetMax())}
+        # check if we should give warnings
+        if rel_close(cam.Gain.GetValue(), cam.Gain.GetMax()):
+            result['warning'] = 'Final gain value is very close to its maximum value:' \
+                                ' Consider increasing gain, opening camera shutter wider or put more light.'
+        return result
 
     def run_auto_exposure(self):
-        """ Adjust exposure time while keeping gain fixed. """
+        """ Adjust exposure time while keeping gain fixed, on all cameras at once. """
         self._setup_cams()
-
-        for idx, (cam_name, cam) in enumerate(zip(self._camera_names_list, self._camera_list)):
-
-            print('Auto exposure for: %d \t%s \t\t%s' % (idx, cam_name, cam.GetDeviceInfo().GetSerialNumber()))
-
-            cam.Open()
-            cam.AutoFunctionROISelector.SetValue('ROI1')
-            cam.AutoFunctionROIUseBrightness.SetValue(True)
-            cam.AutoFunctionROISelector.SetValue('ROI2')
-            cam.AutoFunctionROIUseBrightness.SetValue(False)
-
-            # define ROI to use
-            cam.AutoFunctionROISelector.SetValue('ROI1')
-            wOff = int(cam.Width.GetValue() / 4)
-            hOff = int(cam.Height.GetValue() / 4)
-            wSize = int(cam.Width.GetValue() / 2)
-            hSize = int(cam.Height.GetValue() / 2)
-
-            # Enforce size is a multiple of two (important because of bayer pattern)
-            wSize = int(wSize/2)*2
-            hSize = int(hSize/2)*2
-
-            # set ROI
-            cam.AutoFunctionROIWidth.SetValue(wSize)
-            cam.AutoFunctionROIHeight.SetValue(hSize)
-            cam.AutoFunctionROIOffsetX.SetValue(wOff)
-            cam.AutoFunctionROIOffsetY.SetValue(hOff)
-
-            # 0.3 means that the target brightness is 30 % of the maximum brightness
-            # of the raw pixel value read out from the sensor.
-            cam.AutoTargetBrightness.SetValue(0.2)
-
-            # give auto some bounds
-            cam.AutoExposureTimeLowerLimit.SetValue(cam.AutoExposureTimeLowerLimit.GetMin())
-            cam.AutoExposureTimeUpperLimit.SetValue(cam.AutoExposureTimeUpperLimit.GetMax())
-
-            # set exposure to its reference value
-            sn = cam.GetDeviceInfo().GetSerialNumber()
-            cam.Gain.SetValue(self._camera_info[sn]['gain'])
-            # print('Initial exposure', cam.ExposureTime.GetValue())
-            cam.ExposureAuto.SetValue('Once')
-
-            i = 0
-            while not cam.ExposureAuto.GetValue() == 'Off':
-                cam.GrabOne(5000)
-                i += 1
-
-                if i > 100:
-                    print('Auto ExposureAuto was not successful')
-                    break
-
-            if self._verbosity > 1:
-                print('Final exposure after %d '
-                      'images %d ms (in [%d, %d])' % (i, cam.ExposureTime.GetValue(),
-                                                      cam.AutoExposureTimeLowerLimit.GetMin(), cam.AutoExposureTimeUpperLimit.GetMax()))
-
-            # check if we should give warnings
-            if rel_close(cam.ExposureTime.GetValue(), cam.AutoExposureTimeUpperLimit.GetMax()):
-                if self._verbosity > 0:
-                    print('Final exposure value is very close to its maximum value:'
-                          ' Consider increasing gain, opening camera shutter wider or put more light.')
-
-            cam.Close()
+        self._run_auto('Auto exposure', self._auto_exposure_cam)
+
+    def _auto_exposure_cam(self, cam):
+        self._set_brightness_roi(cam)
+
+        # give auto some bounds
+        cam.AutoExposureTimeLowerLimit.SetValue(cam.AutoExposureTimeLowerLimit.GetMin())
+        cam.AutoExposureTimeUpperLimit.SetValue(cam.AutoExposureTimeUpperLimit.GetMax())
+
+        # set gain to its reference value
+        sn = cam.GetDeviceInfo().GetSerialNumber()
+        cam.Gain.SetValue(self._camera_info[sn]['gain'])
+        initial = cam.ExposureTime.GetValue()
+        cam.ExposureAuto.SetValue('Once')
+        num_frames, converged = self._wait_auto(cam, cam.ExposureAuto)
+        if converged:
+            self._profiles.update(sn, {'Gain': cam.Gain.GetValue(), 'ExposureTime': cam.ExposureTime.GetValue()})
+
+        result = {'frames': num_frames, 'status': 'ok' if converged else 'timeout',
+                  'value': 'exposure %d->%d us (in [%d, %d])' % (initial, cam.ExposureTime.GetValue(),
+                                                                cam.AutoExposureTimeLowerLimit.GetMin(),
+                                                                cam.AutoExposureTimeUpperLimit.GetMax())}
+        # check if we should give warnings
+        if rel_close(cam.ExposureTime.GetValue(), cam.AutoExposureTimeUpperLimit.GetMax()):
+            result['warning'] = 'Final exposure value is very close to its maximum value:' \
+                                ' Consider increasing gain, opening camera shutter wider or put more light.'
+        return result
+
+    def _set_brightness_roi(self, cam):
+        """ Brightness auto functions look at the center of the image. """
+        cam.AutoFunctionROISelector.SetValue('ROI1')
+        cam.AutoFunctionROIUseBrightness.SetValue(True)
+        cam.AutoFunctionROISelector.SetValue('ROI2')
+        cam.AutoFunctionROIUseBrightness.SetValue(False)
+
+        # define ROI to use
+        cam.AutoFunctionROISelector.SetValue('ROI1')
+        wOff = int(cam.Width.GetValue() / 4)
+        hOff = int(cam.Height.GetValue() / 4)
+        wSize = int(cam.Width.GetValue() / 2)
+        hSize = int(cam.Height.GetValue() / 2)
+
+        # Enforce size is a multiple of two (important because of bayer pattern)
+        wSize = int(wSize/2)*2
+        hSize = int(hSize/2)*2
+
+        # set ROI
+        cam.AutoFunctionROIWidth.SetValue(wSize)
+        cam.AutoFunctionROIHeight.SetValue(hSize)
+        cam.AutoFunctionROIOffsetX.SetValue(wOff)
+        cam.AutoFunctionROIOffsetY.SetValue(hOff)
+
+        # 0.3 means that the target brightness is 30 % of the maximum brightness
+        # of the raw pixel value read out from the sensor.
+        cam.AutoTargetBrightness.SetValue(0.2)
+
+    def _wait_auto(self, cam, auto_node):
+        """ Grabs images until a 'Once' auto function switched itself off. Returns (number of images, converged). """
+        start = time.time()
+        i = 0
+        while not auto_node.GetValue() == 'Off':
+            cam.GrabOne(5000)
+            i += 1
+
+            if i > params_t.auto_max_frames or time.time() - start > params_t.auto_timeout:
+                auto_node.SetValue('Off')  # keep the value it got to
+                return i, False
+        return i, True
+
+    def _run_auto(self, title, fct):
+        """ Runs fct on all cameras in parallel and prints a table of its results. fct returns a dict with status,
+            value and optionally frames and warning. """
+        start = time.time()
+
+        def run(cam):
+            try:
+                return fct(cam)
+            except Exception as e:
+                return {'status': 'failed', 'value': str(e)}
+        results = self._session.map(run)
+
+        print('%s of %d cameras took %.1f sec' % (title, len(results), time.time() - start))
+        print('Camera \tSerial \t\tImages \tResult \tValue')
+        for cam_name, sn, result in zip(self._camera_names_list, self._session.serials, results):
+            print('%s \t%s \t%s \t%s \t%s' % (cam_name, sn, result.get('frames', '-'), result['status'],
+                                                result['value']))
+        for cam_name, result in zip(self._camera_names_list, results):
+            if result['status'] == 'timeout':
+                print('WARNING: %s did not converge within %d images or %.0f sec.' % (
+                    cam_name, params_t.auto_max_frames, params_t.auto_timeout))
+            if 'warning' in result and self._verbosity > 0:
+                print('WARNING: %s: %s' % (cam_name, result['warning']))
 
     def _init_trigger(self):
         self._trigger = trigger_factory()
         self._trigger.set_fps(self.fps)
 
+    def _init_writers(self, video_path_template, pixel_format_list):
+        """ Creates a video writer for each camera. Depending on params_t.writer_mode they encode in threads or processes,
+            with codec_t.raw frames are written uncompressed. """
+        if params_t.codec == codec_t.ffmpeg and shutil.which(params_t.ffmpeg_bin) is None:
+            raise RuntimeError('codec_t.ffmpeg needs ffmpeg, but %s was not found.' % params_t.ffmpeg_bin)
+        if params_t.writer_mode == 'process' and params_t.codec != codec_t.raw:
+            num_processes = params_t.writer_processes
+            if num_processes is None:
+                num_processes = len(self._camera_names_list)
+            self._encoder_pool = EncoderPool(num_processes)
+
+        # all writers buffer frames from one RAM budget
+        self._governor = MemoryGovernor(params_t.writer_ram_budget, params_t.writer_ram_fraction)
+        if self._verbosity > 1:
+            print('Writers may buffer up to %.0f MB of frames' % (self._governor.budget / 1024.0**2))
+
+        video_writer_list = list()
+        for cam_name, pixel_format in zip(self._camera_names_list, pixel_format_list):
+            if params_t.codec == codec_t.raw:
+                video_writer = RawVideoWriter(os.path.splitext(video_path_template % cam_name)[0] + '.raw',
+                                              fps=self.fps,
+                                              max_frames=int(params_t.raw_prealloc_sec * self.fps),
+                                              pixel_format=pixel_format)
+            elif params_t.writer_mode == 'thread':
+                video_writer = VideoWriterFast(video_path_template % cam_name,
+                                               fps=self.fps,
+                                               codec=params_t.codec,
+                                               stream_options=self._stream_options(),
+                                               pool_size=params_t.frame_pool_size,
+                                               pixel_format=pixel_format,
+                                               overflow_policy=params_t.overflow_policy,
+                                               overflow_timeout=params_t.overflow_timeout,
+                                               governor=self._governor)
+            elif params_t.writer_mode == 'process':
+                video_writer = VideoWriterProcess(video_path_template % cam_name,
+                                                  fps=self.fps,
+                                                  codec=params_t.codec,
+                                                  stream_options=self._stream_options(),
+                                                  encoder=self._encoder_pool.get_encoder(),
+                                                  queue_size=params_t.writer_ring_size,
+                                                  pixel_format=pixel_format,
+                                                  overflow_policy=params_t.overflow_policy,
+                                                  overflow_timeout=params_t.overflow_timeout,
+                                                  governor=self._governor)
+            else:
+                raise NotImplementedError
+            video_writer_list.append(video_writer)
+        return video_writer_list
+
+    def _stream_options(self):
+        """ Settings of the encoder selected by params_t.codec. """
+        if params_t.codec == codec_t.ffmpeg:
+            return ffmpeg_options(params_t)
+        if params_t.codec == codec_t.frames:
+            return frame_store_options(params_t)
+        return None
+
     def _init_recording(self):
         """Create output folders. """
         take_name = self._take_name + '_' + datetime.datetime.now().strftime("%Y-%m-%d_%H-%M")
         out_path = os.path.join(params_t.out_path,
                                 take_name)
         my_mkdir(out_path)
-        out_path = out_path + '/run%03d' % self._rid + '_%s.avi'
+        out_path = out_path + '/run%03d' % self._rid + '_%s.' + file_extension(params_t.codec, params_t.ffmpeg_container)
         return out_path
 
     def _setup_cams(self):
-        """ Searches for attached Basler cams and puts them into our list of cameras. """
-        # reset cams
-        self._camera_list, self._camera_names_list = list(), list()
-
-        # Get the transport layer factory.
-        tlFactory = pylon.TlFactory.GetInstance()
-
-        devices = tlFactory.EnumerateDevices()
-        if len(devices) == 0:
+        """ Searches for attached Basler cams and puts them into our list of cameras. Cameras stay open between calls,
+            only newly attached ones are opened (see core/CameraSession.py). """
+        self._camera_list, self._camera_names_list = self._session.refresh()
+        if len(self._camera_list) == 0:
             print('No camera present. Quitting')
             exit()
 
         if self._verbosity > 0:
-            print('Found %d cameras' % len(devices))
-
-        for did, dev in enumerate(devices):
-            self._camera_list.append( pylon.InstantCamera(tlFactory.CreateDevice(dev)) )
-            assert devices[did].IsSerialNumberAvailable(), 'Could not read serial number.'
-            sn = dev.GetSerialNumber()
-            msg = 'Camera with serial number %s does not have a given name. Please define one in config/camera_names.py'  % sn
-            assert sn in self._camera_info.keys(), msg
-            give_name = self._camera_info[sn]['name']
-            self._camera_names_list.append(give_name)
-            if self._verbosity > 0:
+            print('Found %d cameras' % len(self._camera_list))
+            for did, (give_name, sn) in enumerate(zip(self._camera_names_list, self._session.serials)):
                 print('Device %d: %s %s' % (did, give_name, sn))
 
+    def close(self):
+        """ Closes all cameras. """
+        self._session.close()
+        self._camera_list, self._camera_names_list = list(), list()
+
     def _config_cams_continuous(self, cam):
         # cam.RegisterImageEventHandler(MyImageEventHandler(),
         #                               pylon.RegistrationMode_Append,
@@ -457,22 +587,14 @@ class Recorder(object):
         if not cam.IsOpen():
             cam.Open()
 
-        # some things are to be set as attributes ...
-        cam.AcquisitionFrameRate = self.fps
-        cam.AcquisitionFrameRateEnable = True
-
-        cam.MaxNumBuffer.SetValue(16)  # how many buffers there are in total (empty and full)
-        cam.OutputQueueSize.SetValue(8)  # maximal number of filled buffers (if another image is retrieved it replaces an old one and is called skipped)
-
-        # ... other via this weird nodemap
-        nodemap = cam.GetNodeMap()
-        nodemap.GetNode("AcquisitionMode").FromString("Continuous")
-        if self.is_color_cam(cam):
-            nodemap.GetNode("PixelFormat").FromString("BGR8")
-            cam.DemosaicingMode.SetValue('BaslerPGI')
-        else:
-            nodemap.GetNode("PixelFormat").FromString("Mono8")
-        nodemap.GetNode("TriggerMode").FromString("Off")
+        nodes = [('AcquisitionFrameRate', float(self.fps)),
+                 ('AcquisitionFrameRateEnable', True),
+                 ('MaxNumBuffer', 16),  # how many buffers there are in total (empty and full)
+                 ('OutputQueueSize', 8),  # maximal number of filled buffers (if another image is retrieved it replaces an old one and is called skipped)
+                 ('AcquisitionMode', 'Continuous')]
+        nodes += self._pixel_format_nodes(cam)
+        nodes += [('TriggerMode', 'Off')]
+        self._apply_config(cam, nodes)
 
     def _config_cams_hw_trigger(self, cam):
         # cam.RegisterImageEventHandler(MyImageEventHandler(),
@@ -480,26 +602,46 @@ class Recorder(object):
         #                               pylon.Cleanup_Delete)
         if not cam.IsOpen():
             cam.Open()
-        cam.AcquisitionFrameRate = params_t.max_fps  # here we go to max fps in order to not be limited
-        cam.AcquisitionFrameRateEnable = True
-        # behavior wrt to these values is a bit strange to me. Important seems to be to use LastImages Strategy and make MaxNumBuffers larger than OutputQueueSize. Otherwise its not guaranteed to work
-        cam.MaxNumBuffer.SetValue(16)  # how many buffers there are in total (empty and full)
-        cam.OutputQueueSize.SetValue(8)  # maximal number of filled buffers (if another image is retrieved it replaces an old one and is called skipped)
-
-        nodemap = cam.GetNodeMap()
-        nodemap.GetNode("AcquisitionMode").FromString("Continuous")
-        if self.is_color_cam(cam):
-            nodemap.GetNode("PixelFormat").FromString("BGR8")
-            cam.DemosaicingMode.SetValue('BaslerPGI')
-        else:
-            nodemap.GetNode("PixelFormat").FromString("Mono8")
-
-        nodemap.GetNode("LineSelector").FromString("Line3")
-        nodemap.GetNode("LineMode").FromString("Input")
-
-        nodemap.GetNode("TriggerMode").FromString("On")
-        nodemap.GetNode("TriggerSource").FromString("Line3")
-        nodemap.GetNode("TriggerActivation").FromString("RisingEdge")
+        # behavior wrt to buffer values is a bit strange to me. Important seems to be to use LastImages Strategy and make MaxNumBuffers larger than OutputQueueSize. Otherwise its not guaranteed to work
+        nodes = [('AcquisitionFrameRate', float(params_t.max_fps)),  # here we go to max fps in order to not be limited
+                 ('AcquisitionFrameRateEnable', True),
+                 ('MaxNumBuffer', 16),  # how many buffers there are in total (empty and full)
+                 ('OutputQueueSize', 8),  # maximal number of filled buffers (if another image is retrieved it replaces an old one and is called skipped)
+                 ('AcquisitionMode', 'Continuous')]
+        nodes += self._pixel_format_nodes(cam)
+        nodes += [('LineSelector', 'Line3'),
+                  ('LineMode', 'Input'),
+                  ('TriggerMode', 'On'),
+                  ('TriggerSource', 'Line3'),
+                  ('TriggerActivation', 'RisingEdge')]
+        self._apply_config(cam, nodes)
+
+    def _apply_config(self, cam, nodes):
+        """ Sets nodes and the cameras profile (see core/CameraProfile.py), only writing values that differ. """
+        sn = cam.GetDeviceInfo().GetSerialNumber()
+        nodes = nodes + self._profiles.nodes(sn)
+        num_written = apply_nodes(cam, nodes)
+        if self._verbosity > 1:
+            # one write per line, cameras are configured in parallel
+            print('%s: wrote %d of %d settings\n' % (self._camera_info[sn]['name'], num_written, len(nodes)), end='')
+
+    def _pixel_format_nodes(self, cam):
+        """ Pixel format given in the camera infos. 'native' is the sensors Bayer pattern or Mono8,
+            these frames are only converted to BGR when they are written. """
+        sn = cam.GetDeviceInfo().GetSerialNumber()
+        available_formats = cam.PixelFormat.Symbolics
+        pixel_format = self._camera_info[sn].get('pixel_format', 'native')
+        if pixel_format != 'native' and pixel_format not in available_formats:
+            print('Pixel format %s is not available for camera %s. Using its native format.' % (pixel_format, sn))
+            pixel_format = 'native'
+        if pixel_format == 'native':
+            pixel_format = native_pixel_format(available_formats)
+
+        nodes = [('PixelFormat', pixel_format)]
+        if pixel_format == 'BGR8':
+            # demosaicing on the camera
+            nodes.append(('DemosaicingMode', 'BaslerPGI'))
+        return nodes
 
     def is_color_cam(self, cam):
         # get available formats
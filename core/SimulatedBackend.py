@@ -0,0 +1,447 @@
+"""
+    Simulated camera backend.
+
+    Emulates the part of the pylon InstantCamera interface the recorder uses, so the full recording path can run
+    and be load tested without any Basler camera attached. Devices are enumerated from config/camera_infos.py,
+    frames are synthetic and in hardware trigger mode they follow a software trigger clock (see TriggerSimulated).
+"""
+import time
+import threading
+import numpy as np
+from contextlib import contextmanager
+
+from core.CameraBackend import CameraBackend
+
+from config.params import params_t
+from config.camera_infos import get_camera_infos
+
+
+class SimulatedTimeoutException(Exception):
+    pass
+
+
+class SoftwareTriggerClock(object):
+    """ Emits trigger pulses at a fixed rate. Pulse n is fired at time t0 + n / fps. """
+    def __init__(self):
+        self.fps = params_t.fps
+        self.generation = 0  # counts how often the clock was started
+        self._t0 = None
+        self._t_end = None
+
+    def start(self, fps):
+        self.fps = float(fps)
+        self._t_end = None
+        self._t0 = time.monotonic()
+        self.generation += 1
+
+    def stop(self):
+        self._t_end = time.monotonic()
+
+    def num_pulses(self):
+        """ Number of pulses fired so far. """
+        if self._t0 is None:
+            return 0
+        t = time.monotonic()
+        if self._t_end is not None:
+            t = min(t, self._t_end)
+        return int((t - self._t0) * self.fps) + 1
+
+    def pulse_time(self, n):
+        """ Time pulse n is fired at or None, if the clock stops before. """
+        if self._t0 is None:
+            return None
+        t = self._t0 + n / self.fps
+        if self._t_end is not None and t > self._t_end:
+            return None
+        return t
+
+
+_trigger_clock = SoftwareTriggerClock()
+
+
+def get_trigger_clock():
+    """ The clock all simulated cameras in hardware trigger mode listen to. """
+    return _trigger_clock
+
+
+class SimulatedDeviceInfo(object):
+    def __init__(self, serial_number):
+        self._serial_number = serial_number
+
+    def IsSerialNumberAvailable(self):
+        return True
+
+    def GetSerialNumber(self):
+        return self._serial_number
+
+    def GetModelName(self):
+        return 'Simulated'
+
+
+class SimulatedNode(object):
+    """ A camera parameter, behaves like a genicam node. """
+    def __init__(self, value, min_value=None, max_value=None, symbolics=None):
+        self._value = value
+        self._min = min_value
+        self._max = max_value
+        self.Symbolics = symbolics
+
+    def GetValue(self):
+        return self._value
+
+    def SetValue(self, value):
+        if params_t.sim_node_time > 0:
+            time.sleep(params_t.sim_node_time)
+        if self.Symbolics is not None:
+            assert value in self.Symbolics, 'Invalid value %s, expected one of %s' % (value, self.Symbolics)
+        if self._min is not None:
+            value = min(max(value, self._min), self._max)
+        self._value = value
+
+    def GetMin(self):
+        return self._min
+
+    def GetMax(self):
+        return self._max
+
+    def FromString(self, value):
+        if self.Symbolics is None and not isinstance(self._value, str):
+            value = type(self._value)(value)
+        self.SetValue(value)
+
+    def ToString(self):
+        return str(self._value)
+
+    def GetValueOrDefault(self, default):
+        return self._value
+
+
+class SimulatedNodeMap(object):
+    def __init__(self, nodes):
+        self._nodes = nodes
+
+    def GetNode(self, name):
+        return self._nodes[name]
+
+
+class SimulatedGrabResult(object):
+    def __init__(self, array, image_number, timestamp, num_skipped):
+        self._array = array
+        self._image_number = image_number
+        self._timestamp = timestamp
+        self._num_skipped = num_skipped
+
+    def GrabSucceeded(self):
+        return True
+
+    def GetArray(self):
+        # like pypylon this hands out a copy of the grab buffer
+        return np.array(self._array)
+
+    @contextmanager
+    def GetArrayZeroCopy(self):
+        yield self._array
+
+    def GetNumberOfSkippedImages(self):
+        return self._num_skipped
+
+    def GetImageNumber(self):
+        return self._image_number
+
+    def GetID(self):
+        return self._image_number
+
+    def GetBlockID(self):
+        return self._image_number
+
+    def GetTimeStamp(self):
+        return self._timestamp
+
+    def GetWidth(self):
+        return self._array.shape[1]
+
+    def GetHeight(self):
+        return self._array.shape[0]
+
+    def Release(self):
+        self._array = None
+
+
+"""
+    Simulated pylon.InstantCamera.
+
+    In trigger mode a frame is produced for every pulse of the software trigger clock, otherwise the camera runs
+    freely at AcquisitionFrameRate. When frames are not retrieved fast enough, the oldest ones are dropped once more
+    than OutputQueueSize are waiting and reported as skipped, like GrabStrategy_LatestImages does.
+    Skipped frames and timeouts can be injected with inject_skip() and inject_timeout() or randomly through
+    params_t.sim_skip_rate and params_t.sim_timeout_rate.
+"""
+class SimulatedCamera(object):
+    _auto_steps = 3  # number of frames an auto function needs to converge
+
+    def __init__(self, serial_number, size, color):
+        self._device_info = SimulatedDeviceInfo(serial_number)
+        self._size = size
+        self._is_open = False
+        self._grabbing = False
+        self._lock = threading.Lock()
+
+        self._clock = None
+        self._clock_generation = None
+        self._next_pulse = 0
+        self._image_number = 0
+        self._pattern = dict()
+        self._auto_counts = dict()
+
+        self._inject_skips = 0
+        self._inject_timeouts = 0
+        self._random = np.random.RandomState(int(serial_number) % 2**31)
+
+        formats = ['Mono8']
+        if color:
+            formats += ['BGR8', 'RGB8', 'BayerRG8']
+
+        nodes = dict()
+        nodes['Width'] = SimulatedNode(size[1], size[1], size[1])
+        nodes['Height'] = SimulatedNode(size[0], size[0], size[0])
+        nodes['PixelFormat'] = SimulatedNode('Mono8', symbolics=formats)
+        nodes['DemosaicingMode'] = SimulatedNode('Simple', symbolics=['Simple', 'BaslerPGI'])
+        nodes['AcquisitionMode'] = SimulatedNode('Continuous', symbolics=['Continuous', 'SingleFrame'])
+        nodes['AcquisitionFrameRate'] = SimulatedNode(params_t.fps, 0.1, 1000.0)
+        nodes['AcquisitionFrameRateEnable'] = SimulatedNode(False)
+        nodes['MaxNumBuffer'] = SimulatedNode(10, 1, 1024)
+        nodes['OutputQueueSize'] = SimulatedNode(5, 1, 1024)
+        nodes['LineSelector'] = SimulatedNode('Line1', symbolics=['Line1', 'Line2', 'Line3', 'Line4'])
+        nodes['LineMode'] = SimulatedNode('Input', symbolics=['Input', 'Output'])
+        nodes['TriggerMode'] = SimulatedNode('Off', symbolics=['On', 'Off'])
+        nodes['TriggerSource'] = SimulatedNode('Line1', symbolics=['Line1', 'Line2', 'Line3', 'Line4', 'Software'])
+        nodes['TriggerActivation'] = SimulatedNode('RisingEdge', symbolics=['RisingEdge', 'FallingEdge'])
+        nodes['Gain'] = SimulatedNode(0.0, 0.0, 24.0)
+        nodes['ExposureTime'] = SimulatedNode(5000.0, 20.0, 1000000.0)
+        nodes['GainAuto'] = SimulatedNode('Off', symbolics=['Off', 'Once', 'Continuous'])
+        nodes['ExposureAuto'] = SimulatedNode('Off', symbolics=['Off', 'Once', 'Continuous'])
+        nodes['BalanceWhiteAuto'] = SimulatedNode('Off', symbolics=['Off', 'Once', 'Continuous'])
+        nodes['BalanceRatioSelector'] = SimulatedNode('Red', symbolics=['Red', 'Green', 'Blue'])
+        nodes['BalanceRatio'] = SimulatedNode(1.0, 1.0, 15.98)
+        nodes['AutoTargetBrightness'] = SimulatedNode(0.3, 0.0, 1.0)
+        nodes['AutoGainLowerLimit'] = SimulatedNode(0.0, 0.0, 24.0)
+        nodes['AutoGainUpperLimit'] = SimulatedNode(24.0, 0.0, 24.0)
+        nodes['AutoExposureTimeLowerLimit'] = SimulatedNode(20.0, 20.0, 1000000.0)
+        nodes['AutoExposureTimeUpperLimit'] = SimulatedNode(1000000.0, 20.0, 1000000.0)
+        nodes['AutoFunctionROISelector'] = SimulatedNode('ROI1', symbolics=['ROI1', 'ROI2'])
+        nodes['AutoFunctionROIUseBrightness'] = SimulatedNode(True)
+        nodes['AutoFunctionROIUseWhiteBalance'] = SimulatedNode(False)
+        nodes['AutoFunctionROIWidth'] = SimulatedNode(size[1], 1, size[1])
+        nodes['AutoFunctionROIHeight'] = SimulatedNode(size[0], 1, size[0])
+        nodes['AutoFunctionROIOffsetX'] = SimulatedNode(0, 0, size[1])
+        nodes['AutoFunctionROIOffsetY'] = SimulatedNode(0, 0, size[0])
+        self._nodes = nodes
+        self._node_map = SimulatedNodeMap(nodes)
+
+    def __getattr__(self, name):
+        # only called when regular lookup fails: expose camera parameters as attributes like pypylon does
+        nodes = self.__dict__.get('_nodes')
+        if nodes is not None and name in nodes:
+            return nodes[name]
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        # pypylon allows to set a parameter by assigning to it
+        nodes = self.__dict__.get('_nodes')
+        if nodes is not None and name in nodes:
+            nodes[name].SetValue(value)
+        else:
+            object.__setattr__(self, name, value)
+
+    def inject_skip(self, num_frames=1):
+        """ The next retrieved frame comes after num_frames skipped ones. """
+        self._inject_skips += num_frames
+
+    def inject_timeout(self, num_timeouts=1):
+        """ The next num_timeouts calls of RetrieveResult time out. """
+        self._inject_timeouts += num_timeouts
+
+    def GetDeviceInfo(self):
+        return self._device_info
+
+    def GetNodeMap(self):
+        return self._node_map
+
+    def Open(self):
+        if not self._is_open:
+            time.sleep(params_t.sim_open_time)
+        self._is_open = True
+
+    def Close(self):
+        self.StopGrabbing()
+        self._is_open = False
+
+    def IsOpen(self):
+        return self._is_open
+
+    def IsGrabbing(self):
+        return self._grabbing
+
+    def StartGrabbing(self, strategy=None, *args):
+        if not self._is_open:
+            self.Open()
+        if self.TriggerMode.GetValue() == 'On':
+            self._clock = get_trigger_clock()
+            self._clock_generation = self._clock.generation
+            self._next_pulse = self._clock.num_pulses()
+        else:
+            # free running camera
+            self._clock = SoftwareTriggerClock()
+            self._clock.start(self.AcquisitionFrameRate.GetValue())
+            self._clock_generation = self._clock.generation
+            self._next_pulse = 0
+        self._grabbing = True
+
+    def StopGrabbing(self):
+        self._grabbing = False
+
+    def RetrieveResult(self, timeout, timeout_handling=None):
+        assert self._grabbing, 'Camera is not grabbing.'
+        with self._lock:
+            deadline = time.monotonic() + timeout / 1000.0
+
+            if self._inject_timeouts > 0 or self._random.rand() < params_t.sim_timeout_rate:
+                self._inject_timeouts = max(self._inject_timeouts - 1, 0)
+                self._wait_timeout(deadline)
+
+            num_skipped = 0
+            if self._inject_skips > 0 or self._random.rand() < params_t.sim_skip_rate:
+                num_skipped = max(self._inject_skips, 1)
+                self._inject_skips = 0
+
+            # wait for the pulse of the next frame
+            while True:
+                if self._clock.generation != self._clock_generation:
+                    # trigger was (re)started, so count pulses from its beginning
+                    self._clock_generation = self._clock.generation
+                    self._next_pulse = 0
+                if self._clock.num_pulses() > self._next_pulse + num_skipped:
+                    break
+
+                now = time.monotonic()
+                t_next = self._clock.pulse_time(self._next_pulse + num_skipped)
+                if now >= deadline or (t_next is not None and t_next > deadline):
+                    self._wait_timeout(deadline)
+                if t_next is None:
+                    # trigger is not running
+                    time.sleep(min(0.001, deadline - now))
+                else:
+                    time.sleep(max(t_next - now, 0.0))
+            self._next_pulse += num_skipped
+
+            # frames that did not fit into the output queue are lost
+            num_lost = max(self._clock.num_pulses() - self._next_pulse - self.OutputQueueSize.GetValue(), 0)
+            self._next_pulse += num_lost
+            num_skipped += num_lost
+            self._image_number += num_skipped
+
+            timestamp = int(self._clock.pulse_time(self._next_pulse) * 1e9)
+            result = SimulatedGrabResult(self._make_frame(self._image_number),
+                                         self._image_number, timestamp, num_skipped)
+            self._next_pulse += 1
+            self._image_number += 1
+        return result
+
+    def GrabOne(self, timeout):
+        time.sleep(1.0 / self.AcquisitionFrameRate.GetValue())
+        self._step_auto_functions()
+        result = SimulatedGrabResult(self._make_frame(self._image_number),
+                                     self._image_number, int(time.monotonic() * 1e9), 0)
+        self._image_number += 1
+        return result
+
+    def _wait_timeout(self, deadline):
+        time.sleep(max(deadline - time.monotonic(), 0.0))
+        raise SimulatedTimeoutException('Grab timed out. (%s)' % self._device_info.GetSerialNumber())
+
+    def _step_auto_functions(self):
+        """ 'Once' auto functions converge after a few frames and switch themselves off. """
+        targets = {'GainAuto': ('Gain', 0.5),
+                   'ExposureAuto': ('ExposureTime', 0.25),
+                   'BalanceWhiteAuto': ('BalanceRatio', 0.1)}
+        for auto_name, (node_name, rel_value) in targets.items():
+            if self._nodes[auto_name].GetValue() != 'Once':
+                self._auto_counts[auto_name] = 0
+                continue
+            self._auto_counts[auto_name] = self._auto_counts.get(auto_name, 0) + 1
+            if self._auto_counts[auto_name] >= self._auto_steps:
+                node = self._nodes[node_name]
+                node.SetValue(node.GetMin() + rel_value*(node.GetMax() - node.GetMin()))
+                self._nodes[auto_name].SetValue('Off')
+
+    def _make_frame(self, image_number):
+        """ Returns a view on a synthetic image, that shifts with every frame. """
+        pixel_format = self.PixelFormat.GetValue()
+        if pixel_format not in self._pattern:
+            self._pattern[pixel_format] = self._make_pattern(pixel_format)
+        pattern = self._pattern[pixel_format]
+        shift = image_number % (pattern.shape[1] - self._size[1] + 1)
+        return pattern[:, shift:shift + self._size[1]]
+
+    def _make_pattern(self, pixel_format, max_shift=64):
+        h, w = self._size
+        w += max_shift
+        y, x = np.mgrid[:h, :w]
+        img = (x * 255 // w + y * 255 // h) // 2 + self._random.randint(0, 16, (h, w))
+        img = img.astype(np.uint8)
+        if pixel_format in ['BGR8', 'RGB8']:
+            img = np.stack([img, img[::-1], 255 - img], -1)
+        return img
+
+
+""" Simulated cameras, one for each camera in config/camera_infos.py. """
+class SimulatedBackend(CameraBackend):
+    GrabStrategy_LatestImages = 'LatestImages'
+    GrabStrategy_LatestImageOnly = 'LatestImageOnly'
+    GrabStrategy_OneByOne = 'OneByOne'
+    TimeoutHandling_ThrowException = 'ThrowException'
+    TimeoutException = SimulatedTimeoutException
+
+    def __init__(self):
+        camera_info = get_camera_infos()
+        serials = sorted(camera_info.keys(), key=lambda sn: camera_info[sn]['name'])
+        if params_t.sim_num_cams is not None:
+            serials = serials[:params_t.sim_num_cams]
+        self._devices = [SimulatedDeviceInfo(sn) for sn in serials]
+
+    def enumerate_devices(self):
+        return list(self._devices)
+
+    def create_camera(self, device):
+        return SimulatedCamera(device.GetSerialNumber(),
+                               size=params_t.sim_size,
+                               color=params_t.sim_color)
+
+
+if __name__ == '__main__':
+    # Load test of the recording path: python -m core.SimulatedBackend --num-cams 16 --fps 50
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description='Record from simulated cameras to find out what a rig can sustain.')
+    parser.add_argument('--num-cams', type=int, default=8)
+    parser.add_argument('--fps', type=float, default=params_t.fps)
+    parser.add_argument('--duration', type=float, default=10.0, help='Recording time in sec.')
+    parser.add_argument('--size', type=int, nargs=2, default=list(params_t.sim_size), help='Frame height and width.')
+    parser.add_argument('--mono', action='store_true', help='Simulate mono cameras.')
+    parser.add_argument('--out-path', type=str, default=None)
+    args = parser.parse_args()
+
+    params_t.camera_backend = 'simulated'
+    params_t.trigger_type = 'Simulated'
+    params_t.cam_set = 'sim'
+    params_t.sim_num_cams = args.num_cams
+    params_t.sim_size = tuple(args.size)
+    params_t.sim_color = not args.mono
+    params_t.show_recorded_frames = False
+    params_t.out_path = args.out_path if args.out_path is not None else tempfile.mkdtemp()
+
+    from core.Recorder import Recorder
+    recorder = Recorder(verbosity=3)
+    recorder.fps = args.fps
+    recorder.run_record_cams(duration=args.duration)
@@ -1,8 +1,19 @@
+import sys
 import serial
 import time
 from threading import Thread
 
 from config.params import params_t
+from utils.PulseScheduler import PulseScheduler, clock
+
+if sys.version_info >= (3, 0):
+    from queue import Queue, Empty
+else:
+    from Queue import Queue, Empty
+
+
+class TriggerTimeout(Exception):
+    pass
 
 
 def trigger_factory():
@@ -10,6 +21,8 @@ def trigger_factory():
         return TriggerGPIO()
     elif params_t.trigger_type == 'Arduino':
         return TriggerArduino()
+    elif params_t.trigger_type == 'Simulated':
+        return TriggerSimulated()
     else:
         raise  NotImplementedError
 
@@ -31,14 +44,19 @@ class Trigger(object):
     def end(self):
         raise NotImplementedError
 
+    def close(self):
+        """ Releases the device, the trigger can not be used afterwards. """
+        pass
+
 
 class TriggerGPIO(Trigger):
-    def __init__(self):
+    def __init__(self, device=None):
+        """ device replaces the serial port of the GPIO module, e.g. by core.TriggerEmulator.GPIOEmulator. """
         self.device = None
-        self.device = serial.Serial(params_t.gpio_path, timeout=1)
+        self.device = serial.Serial(params_t.gpio_path, timeout=1) if device is None else device
         self._fps = params_t.fps
+        self.scheduler = None
 
-        self._gpio_delay = 1  # rough delay this module has in ms
         self._gpio_pin_id = 0
 
         self._clear_gpio(self._gpio_pin_id)  # default state is low
@@ -47,9 +65,10 @@ class TriggerGPIO(Trigger):
         self.thread = Thread(target=self.trigger_loop, args=())
         self.thread.daemon = True
 
-    def __del__(self):
+    def close(self):
         if self.device is not None:
             self.device.close()
+            self.device = None
 
     def ping(self):
         self.device.write(b'ver\r')
@@ -64,21 +83,28 @@ class TriggerGPIO(Trigger):
             return
 
         self._fps = fps
+        if self.scheduler is not None:
+            self.scheduler.set_period(1.0 / fps)
 
     def start(self):
         time.sleep(params_t.trigger_delay)
+        self.scheduler = PulseScheduler(1.0 / self._fps, params_t.trigger_spin_budget)
         self.thread.start()
 
     def trigger_loop(self):
+        # pulses are timed against absolute deadlines, the delay of the module itself is the same for every pulse
         self._stop = False
+        self.scheduler.start = clock()
         while not self._stop:
-            start = time.time()
+            index = self.scheduler.next()
             self._set_gpio(self._gpio_pin_id)
-            while (time.time() - start)*1000.0 < 500.0/self._fps - self._gpio_delay:
-                time.sleep(0.001)
+            self.scheduler.wait_until(self.scheduler.deadline(index) + 0.5 * self.scheduler.period)
             self._clear_gpio(self._gpio_pin_id)
-            while (time.time() - start)*1000.0 < 1000.0/self._fps - self._gpio_delay:
-                time.sleep(0.001)
+
+    def get_state(self):
+        if self.scheduler is None:
+            return ' Not started;'
+        return self.scheduler.get_state()
 
     def end(self):
         self._stop = True
@@ -99,26 +125,92 @@ class TriggerGPIO(Trigger):
 
 
 class TriggerArduino(Trigger):
-    def __init__(self):
+    def __init__(self, path=None):
+        """ path of the serial port, params_t.gpio_path by default. core.TriggerEmulator.ArduinoEmulator provides one
+            without the board. """
         self.device = None
-        self.device = serial.Serial(params_t.gpio_path, timeout=1)
+        self.device = serial.Serial(params_t.gpio_path if path is None else path, timeout=0.1)
         self._fps = params_t.fps
+        self.num_pulses = None  # pulses fired between start and end, as counted by the firmware
+        self.latency = dict()  # command -> round trip times in sec, from sending to its reply
 
-        # arduino commands
+        # arduino commands, each one is answered with its reply code once it took effect
         self._ping_cmd = b'P\r'
         self._start_cmd = b'S%d\r'
         self._stop_cmd = b'Q\r'
         self._send_string_cmd =b'T%s\r'
-        
-    def __del__(self):
+
+        # replies are read by a background thread, so commands can wait for them with a timeout
+        self._replies = Queue()
+        self._closed = False
+        self.thread = Thread(target=self.read_loop, args=())
+        self.thread.daemon = True
+        self.thread.start()
+        try:
+            self._wait_for_board()
+        except TriggerTimeout:
+            self.close()
+            raise
+
+    def _wait_for_board(self):
+        # opening the port resets the board, commands sent while its bootloader runs are lost. So ping until it answers
+        start = clock()
+        while True:
+            try:
+                self._command(self._ping_cmd, '1', timeout=0.2)
+                return
+            except TriggerTimeout:
+                if clock() - start > params_t.trigger_boot_timeout:
+                    raise TriggerTimeout('Arduino did not answer within %.1f sec after opening %s.'
+                                         % (params_t.trigger_boot_timeout, self.device.port))
+
+    def close(self):
+        # the reading thread holds a reference to us, so the port has to be closed explicitly
+        self._closed = True
+        if self.thread.is_alive():
+            self.thread.join()
         if self.device is not None:
             self.device.close()
+            self.device = None
+
+    def read_loop(self):
+        line = b''
+        while not self._closed:
+            try:
+                line += self.device.readline()
+            except (serial.SerialException, OSError):
+                break
+            if not line.endswith(b'\n'):
+                continue  # timed out, maybe within a line
+            reply = self._pretty_str(line)
+            line = b''
+            if len(reply) > 0:
+                self._replies.put((clock(), reply))
+
+    def _command(self, cmd, reply_code, timeout=None):
+        """ Sends cmd, waits for the reply starting with reply_code and returns the remaining fields of it. Waits at
+            most timeout sec, params_t.trigger_ack_timeout by default. """
+        if timeout is None:
+            timeout = params_t.trigger_ack_timeout
+        # replies that came late for earlier commands are not ours
+        while not self._replies.empty():
+            self._replies.get_nowait()
+        sent = clock()
+        self.device.write(cmd)
+        deadline = sent + timeout
+        while True:
+            try:
+                received, reply = self._replies.get(timeout=max(deadline - clock(), 0.0))
+            except Empty:
+                raise TriggerTimeout('Arduino did not answer %r within %.1f sec.' % (cmd, timeout))
+            fields = reply.split()
+            if fields[0] == reply_code:
+                self.latency.setdefault(cmd[:1].decode('ascii'), list()).append(received - sent)
+                return fields[1:]
 
     def ping(self):
-        self.device.write(self._ping_cmd)
-        time.sleep(0.1)
-        s = self.device.read(100)
-        print('pong=', self._pretty_str(s))
+        self._command(self._ping_cmd, '1')
+        print('pong= 1 (%.1f ms)' % (self.latency['P'][-1] * 1000.0))
 
     def set_fps(self, fps):
         fps = float(fps)
@@ -129,13 +221,21 @@ class TriggerArduino(Trigger):
         self._fps = fps
 
     def start(self):
-        self.device.write(self._start_cmd % self._fps)
-        
+        # returns once the Arduino confirmed that the timer runs
+        self._command(self._start_cmd % self._fps, '2')
+
     def send_string(self,string2send):
-        self.device.write(self._send_string_cmd % string2send.encode('utf-8'))
+        self._command(self._send_string_cmd % string2send.encode('utf-8'), '4')
 
     def end(self):
-        self.device.write(self._stop_cmd)
+        # the firmware answers with the number of pulses it fired since start
+        fields = self._command(self._stop_cmd, '3')
+        self.num_pulses = int(fields[0]) if len(fields) > 0 else None
+
+    def get_state(self):
+        latency = ''.join([' %s %.1f ms' % (name, 1000.0 * self.latency[c][-1])
+                           for c, name in [('S', 'start'), ('Q', 'stop')] if c in self.latency])
+        return ' Pulses %s; ack%s;' % (self.num_pulses, latency)
 
     def _pretty_str(self, s):
         s = s.decode('utf-8')
@@ -145,6 +245,34 @@ class TriggerArduino(Trigger):
         return s
 
 
+class TriggerSimulated(Trigger):
+    """ Drives the software trigger clock of the simulated cameras. """
+    def __init__(self):
+        from core.SimulatedBackend import get_trigger_clock
+        self._clock = get_trigger_clock()
+        self._fps = params_t.fps
+        self.num_pulses = None  # pulses of the last recording
+
+    def ping(self):
+        print('pong= simulated')
+
+    def set_fps(self, fps):
+        fps = float(fps)
+        if fps < params_t.min_fps or fps > params_t.max_fps:
+            print('Invalid fps value', fps)
+            return
+
+        self._fps = fps
+
+    def start(self):
+        self.num_pulses = None
+        self._clock.start(self._fps)
+
+    def end(self):
+        self._clock.stop()
+        self.num_pulses = self._clock.num_pulses()
+
+
 if __name__ == '__main__':
     # mod = TriggerGPIO()
     # mod.ping()
@@ -0,0 +1,183 @@
+"""
+    Stand-ins for the trigger hardware.
+
+    GPIOEmulator takes the place of the serial port of the USB GPIO module and records when each edge was commanded,
+    so the timing of TriggerGPIO can be measured without the module. Jitter benchmark of the GPIO trigger:
+
+        python -m core.TriggerEmulator --fps 10 30 50 100 --duration 5
+
+    ArduinoEmulator speaks the protocol of Arduino_trigger.ino on a pseudo terminal, TriggerArduino opens it like the
+    serial port of the board. Acknowledge latency and pulse count of the Arduino trigger:
+
+        python -m core.TriggerEmulator --arduino --fps 30 --duration 2
+"""
+import os
+import sys
+import pty
+import tty
+import time
+import select
+from threading import Thread
+import numpy as np
+
+from utils.PulseScheduler import clock
+
+
+class GPIOEmulator(object):
+    """ Serial device speaking the command set of the USB GPIO module (ver, gpio set/clear). """
+    def __init__(self, write_latency=0.0):
+        self.write_latency = write_latency  # sec every write takes, like a USB round trip
+        self.rising = list()  # times of 'gpio set'
+        self.falling = list()  # times of 'gpio clear'
+        self._response = b''
+
+    def write(self, data):
+        t = clock()
+        command = data.decode('ascii').strip()
+        if command.startswith('gpio set'):
+            self.rising.append(t)
+        elif command.startswith('gpio clear'):
+            self.falling.append(t)
+        elif command == 'ver':
+            self._response += b'ver\n\r00000000\n\r>'
+        if self.write_latency > 0:
+            time.sleep(self.write_latency)
+        return len(data)
+
+    def read(self, size=1):
+        data, self._response = self._response[:size], self._response[size:]
+        return data
+
+    def close(self):
+        pass
+
+
+class ArduinoEmulator(object):
+    """ Runs the command protocol of Arduino_trigger.ino on a pseudo terminal, connect to it with path. """
+    def __init__(self, reply_delay=0.0):
+        self.reply_delay = reply_delay  # sec until a command took effect and is answered
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self.path = os.ttyname(self._slave)
+
+        self.fps = None
+        self.texts = list()  # strings sent with T
+        self._t0 = None  # time the timer started, None while stopped
+        self._count = 0  # pulses of the last run, once stopped
+
+        self._stopped = False
+        self.thread = Thread(target=self.update, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+    def num_pulses(self):
+        """ Pulses fired since the last start, pulse n at t0 + n / fps. """
+        if self._t0 is None:
+            return self._count
+        return int((clock() - self._t0) * self.fps) + 1
+
+    def update(self):
+        data = b''
+        while not self._stopped:
+            readable, _, _ = select.select([self._master], [], [], 0.05)
+            if len(readable) == 0:
+                continue
+            try:
+                data += os.read(self._master, 1024)
+            except OSError:
+                break
+            while b'\r' in data:
+                command, data = data.split(b'\r', 1)
+                self._handle(command.decode('utf-8'))
+
+    def _handle(self, command):
+        if len(command) == 0:
+            return
+        time.sleep(self.reply_delay)
+        if command[0] == 'P':
+            reply = '1'
+        elif command[0] == 'S':
+            if self._t0 is None:
+                self.fps = int(command[1:])
+                self._t0 = clock()
+            reply = '2 %d' % self.fps
+        elif command[0] == 'Q':
+            self._count = self.num_pulses()
+            self._t0 = None
+            reply = '3 %d' % self._count
+        elif command[0] == 'T':
+            self.texts.append(command[1:])
+            reply = '4'
+        else:
+            return
+        os.write(self._master, (reply + '\r\n').encode('ascii'))
+
+    def close(self):
+        self._stopped = True
+        self.thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+
+def benchmark_gpio(fps, duration, write_latency=0.0):
+    """ Runs TriggerGPIO against the emulator and returns the rising edge times and the trigger. """
+    from core.Trigger import TriggerGPIO
+    device = GPIOEmulator(write_latency)
+    trigger = TriggerGPIO(device=device)
+    trigger.set_fps(fps)
+    trigger.start()
+    time.sleep(duration)
+    trigger.end()
+    return np.array(device.rising), trigger
+
+
+def check_arduino(fps, duration, reply_delay=0.0):
+    """ Records duration sec with TriggerArduino against the emulator, returns the trigger and the emulator. """
+    from core.Trigger import TriggerArduino
+    emulator = ArduinoEmulator(reply_delay)
+    trigger = TriggerArduino(path=emulator.path)
+    trigger.ping()
+    trigger.set_fps(fps)
+    trigger.start()
+    time.sleep(duration)
+    trigger.end()
+    trigger.close()
+    emulator.close()
+    return trigger, emulator
+
+
+if __name__ == '__main__':
+    import argparse
+    from config.params import params_t
+
+    parser = argparse.ArgumentParser(description='Measure the period jitter of the GPIO trigger against an emulated module.')
+    parser.add_argument('--fps', type=float, nargs='+', default=[10.0, 30.0, 50.0, 100.0])
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds per frame rate.')
+    parser.add_argument('--write-latency', type=float, default=0.0, help='Seconds every serial write takes.')
+    parser.add_argument('--spin-budget', type=float, default=params_t.trigger_spin_budget)
+    parser.add_argument('--arduino', action='store_true', help='Check the Arduino trigger instead.')
+    parser.add_argument('--reply-delay', type=float, default=0.0, help='Seconds the emulated Arduino takes to answer.')
+    args = parser.parse_args()
+    params_t.trigger_delay = 0.0
+
+    if args.arduino:
+        for fps in args.fps:
+            if not params_t.min_fps <= fps < params_t.max_fps:
+                print('%.1f FPS: skipped, the Arduino trigger accepts %.1f to below %.1f FPS' % (
+                    fps, params_t.min_fps, params_t.max_fps))
+                continue
+            trigger, emulator = check_arduino(fps, args.duration, args.reply_delay)
+            assert trigger.num_pulses == emulator.num_pulses(), 'Pulse count was not reported correctly.'
+            print('%.1f FPS:%s' % (fps, trigger.get_state()))
+        sys.exit(0)
+    params_t.trigger_spin_budget = args.spin_budget
+
+    print('%6s %7s %9s %9s %9s %9s %10s' % ('FPS', 'pulses', 'p50 us', 'p90 us', 'p99 us', 'max us', 'drift us'))
+    for fps in args.fps:
+        rising, trigger = benchmark_gpio(fps, args.duration, args.write_latency)
+        jitter = np.abs(np.diff(rising) - 1.0 / fps) * 1e6
+        drift = (rising[-1] - rising[0] - (len(rising) - 1) / fps) * 1e6
+        print('%6.1f %7d %9.0f %9.0f %9.0f %9.0f %10.0f' % (fps, len(rising), np.percentile(jitter, 50),
+                                                          np.percentile(jitter, 90), np.percentile(jitter, 99),
+                                                          jitter.max(), drift))
+        print('      %s' % trigger.get_state())
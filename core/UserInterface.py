@@ -1,4 +1,5 @@
 from core.Recorder import Recorder
+from core.Trigger import TriggerTimeout
 
 class UserInterface(object):
     def __init__(self, verbosity=0):
@@ -14,7 +15,8 @@ class UserInterface(object):
         self._commands.append(('g', 'auto gain', self._auto_gain))
         self._commands.append(('e', 'auto exposure', self._auto_exposure))
         self._commands.append(('d', 'default values gain/exposure', self._fix_gain_exposure))
-        self._commands.append(('x', 'quit', exit))        
+        self._commands.append(('c', 'tune codec for current fps', self._tune_codec))
+        self._commands.append(('x', 'quit', self._quit))
         self._commands.append(('k', 'calibrate cams', self._record_cams_delayed))
 
         self.recorder = Recorder(verbosity)
@@ -57,13 +59,20 @@ class UserInterface(object):
         self.recorder._take_name = take_name
 
     def _record_cams(self):
-        self.recorder.run_record_cams()
+        self._run_recording()
         
     def _record_cams_delayed(self):
         print('Calibration-waiting 20 sec..')
         import time
         time.sleep(20)
-        self.recorder.run_record_cams()
+        self._run_recording()
+
+    def _run_recording(self):
+        # the recorder cleaned up already when the recording could not start, the tool stays usable
+        try:
+            self.recorder.run_record_cams()
+        except (RuntimeError, TriggerTimeout) as e:
+            print('ERROR: Recording did not start: %s' % e)
 
     def _white_balance(self):
         self.recorder.run_white_balance()
@@ -77,6 +86,14 @@ class UserInterface(object):
     def _fix_gain_exposure(self):
         self.recorder.set_gain_exposure()
 
+    def _tune_codec(self):
+        retune = input('>Measure again if there is a cached result (y/n)=')
+        self.recorder.run_codec_tuning(retune=str(retune).strip().lower() == 'y')
+
+    def _quit(self):
+        self.recorder.close()
+        exit()
+
     def _check_cmd(self, cmd):
         """ Checks if a cmd exists and returns the respective function handle. """
         keys = [x[0] for x in self._commands]
@@ -0,0 +1,76 @@
+"""
+    Converts raw videos recorded with codec_t.raw into regular videos.
+
+        python transcode_raw.py recordings/take_2020-01-01_12-00/ --codec DIVX
+
+    Each runXXX_camN.raw becomes runXXX_camN.avi next to it. Videos are converted in parallel using all cores.
+    With --codec FFMPEG or FRAMES the ffmpeg_* or frames_* settings of config/params.py are used.
+"""
+import os
+import glob
+import argparse
+import multiprocessing
+
+from config.params import params_t
+from utils.RawVideo import read_raw_video
+from utils.VideoWriterFast import codec_t, open_stream, file_extension
+from utils.FFmpegStream import ffmpeg_options
+from utils.FrameStore import frame_store_options
+from utils.PixelFormat import to_bgr
+
+
+def transcode(raw_path, codec, delete=False):
+    frames, header = read_raw_video(raw_path)
+    video_path = os.path.splitext(raw_path)[0] + '.' + file_extension(codec, params_t.ffmpeg_container)
+    options = frame_store_options(params_t) if codec == codec_t.frames else ffmpeg_options(params_t)
+
+    writer, stream_format = open_stream(video_path, header['fps'], codec, (header['shape'][1], header['shape'][0]),
+                                        header['pixel_format'], options)
+    bgr_frame = None
+    for frame in frames:
+        if stream_format == header['pixel_format']:
+            writer.write(frame)
+        else:
+            # demosaicing of Bayer frames happens here
+            bgr_frame = to_bgr(frame, header['pixel_format'], dst=bgr_frame)
+            writer.write(bgr_frame)
+    writer.release()
+
+    if delete:
+        del frames
+        os.remove(raw_path)
+    return raw_path, header['frame_count']
+
+
+def _transcode_job(args):
+    return transcode(*args)
+
+
+def find_raw_videos(paths):
+    raw_paths = list()
+    for path in paths:
+        if os.path.isdir(path):
+            raw_paths.extend(sorted(glob.glob(os.path.join(path, '**', '*.raw'), recursive=True)))
+        else:
+            raw_paths.append(path)
+    return raw_paths
+
+
+if __name__ == '__main__':
+    codecs = [v for k, v in vars(codec_t).items() if not k.startswith('_') and v != codec_t.raw]
+    parser = argparse.ArgumentParser(description='Convert raw videos into regular videos.')
+    parser.add_argument('paths', type=str, nargs='+', help='Raw videos or folders containing them.')
+    parser.add_argument('--codec', type=str, default=codec_t.divx, choices=codecs)
+    parser.add_argument('--num-workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--delete', action='store_true', help='Delete raw videos after conversion.')
+    args = parser.parse_args()
+
+    raw_paths = find_raw_videos(args.paths)
+    print('Found %d raw videos' % len(raw_paths))
+
+    jobs = [(raw_path, args.codec, args.delete) for raw_path in raw_paths]
+    pool = multiprocessing.Pool(max(1, min(args.num_workers, len(jobs))))
+    for raw_path, num_frames in pool.imap_unordered(_transcode_job, jobs):
+        print('Converted %s (%d frames)' % (raw_path, num_frames))
+    pool.close()
+    pool.join()
@@ -0,0 +1,228 @@
+"""
+    Finds the encoder settings that keep up with a recording.
+
+    Every available encoder configuration encodes the same sample frames. We measure how many frames per second and
+    per CPU core it encodes, the bitrate of the result and its PSNR against the source. The most compact configuration
+    that sustains fps x number of cameras with a safety margin wins. Results are cached per host and load.
+    Run from the repository root to tune for a rig without cameras, on synthetic frames:
+
+        python -m utils.CodecTuner --num-cams 8 --fps 30
+"""
+import os
+import json
+import time
+import shutil
+import socket
+import tempfile
+import multiprocessing
+import cv2
+import numpy as np
+
+from utils.VideoWriterFast import codec_t, open_stream
+from utils.PixelFormat import to_bgr, is_bayer
+
+try:
+    import resource
+except ImportError:
+    resource = None  # not available on Windows, encoding time of ffmpeg is then measured as wall time
+
+
+def candidate_configs(ffmpeg_bin='ffmpeg'):
+    """ Encoder configurations to try: every OpenCV FourCC of codec_t and a few ffmpeg settings if ffmpeg is there. """
+    configs = list()
+    for name, fourcc in sorted(vars(codec_t).items()):
+        if name.startswith('_') or fourcc in [codec_t.raw, codec_t.ffmpeg, codec_t.frames]:
+            continue
+        configs.append({'name': 'opencv-%s' % fourcc, 'codec': fourcc, 'ffmpeg': None, 'container': 'avi'})
+
+    if shutil.which(ffmpeg_bin) is not None:
+        for preset in ['ultrafast', 'veryfast']:
+            for crf in [23, 28]:
+                configs.append({'name': 'ffmpeg-x264-%s-crf%d' % (preset, crf), 'codec': codec_t.ffmpeg,
+                                'ffmpeg': dict(codec='libx264', preset=preset, crf=crf, threads=0, pix_fmt='yuv420p',
+                                               ffmpeg_bin=ffmpeg_bin),
+                                'container': 'mp4'})
+        configs.append({'name': 'ffmpeg-ffv1', 'codec': codec_t.ffmpeg,
+                        'ffmpeg': dict(codec='ffv1', preset=None, crf=None, threads=0, pix_fmt=None,
+                                       ffmpeg_bin=ffmpeg_bin),
+                        'container': 'mkv'})
+    return configs
+
+
+def synthetic_frames(num_frames, shape, pixel_format='BGR8'):
+    """ Moving shapes on a textured background with some sensor noise, in the given pixel format. """
+    h, w = shape[:2]
+    yy, xx = np.mgrid[0:h, 0:w]
+    background = np.stack([128 + 60 * np.sin(xx / 37.0), 128 + 60 * np.cos(yy / 23.0),
+                           128 + 40 * np.sin((xx + yy) / 51.0)], -1).astype(np.uint8)
+    rng = np.random.RandomState(0)
+    frames = list()
+    for i in range(num_frames):
+        bgr = background.copy()
+        for k in range(5):
+            center = (int(w * (0.2 + 0.15 * k) + 5 * i) % w, int(h * 0.5 + h * 0.3 * np.sin(0.1 * i + k)))
+            cv2.circle(bgr, center, h // 10, (40 * k, 255 - 40 * k, 128), -1)
+        bgr = cv2.add(bgr, rng.randint(0, 8, bgr.shape).astype(np.uint8))
+
+        if pixel_format == 'BGR8':
+            frames.append(bgr)
+        elif pixel_format == 'RGB8':
+            frames.append(bgr[:, :, ::-1].copy())
+        elif is_bayer(pixel_format):
+            # sample the pattern, pylon names it by its first two pixels
+            index = {'R': 2, 'G': 1, 'B': 0}
+            pattern = pixel_format[len('Bayer'):len('Bayer') + 2]
+            second = {'RG': 'GB', 'BG': 'GR', 'GR': 'BG', 'GB': 'RG'}[pattern]
+            mosaic = np.empty((h, w), dtype=np.uint8)
+            mosaic[0::2, 0::2] = bgr[0::2, 0::2, index[pattern[0]]]
+            mosaic[0::2, 1::2] = bgr[0::2, 1::2, index[pattern[1]]]
+            mosaic[1::2, 0::2] = bgr[1::2, 0::2, index[second[0]]]
+            mosaic[1::2, 1::2] = bgr[1::2, 1::2, index[second[1]]]
+            frames.append(mosaic)
+        else:
+            frames.append(cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY))
+    return frames
+
+
+def _children_cpu_time():
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(config, frames, pixel_format, fps, tmp_dir):
+    """ Encodes frames with config and returns its encode speed, bitrate and PSNR. """
+    video_path = os.path.join(tmp_dir, '%s.%s' % (config['name'], config['container']))
+    shape = frames[0].shape
+    sources = [to_bgr(frame, pixel_format) for frame in frames]
+
+    wall, cpu, cpu_children = time.time(), time.process_time(), _children_cpu_time()
+    stream, stream_format = open_stream(video_path, fps, config['codec'], (shape[1], shape[0]), pixel_format,
+                                        config['ffmpeg'])
+    if not stream.isOpened():
+        raise RuntimeError('Encoder is not available on this host.')
+    for frame, source in zip(frames, sources):
+        stream.write(frame if stream_format == pixel_format else source)
+    stream.release()
+    wall = time.time() - wall
+    cpu = time.process_time() - cpu + _children_cpu_time() - cpu_children
+    if resource is None and config['ffmpeg'] is not None:
+        cpu = wall
+
+    # compare what we get back with what went in
+    psnr = list()
+    cap = cv2.VideoCapture(video_path)
+    for source in sources:
+        ret, decoded = cap.read()
+        if not ret or decoded.shape != source.shape:
+            break
+        psnr.append(cv2.PSNR(source, decoded))
+    cap.release()
+
+    size = os.path.getsize(video_path) if os.path.exists(video_path) else 0
+    result = dict(config)
+    result.update({'encode_fps': len(frames) / max(wall, 1e-6),
+                   'fps_per_core': len(frames) / max(cpu, 1e-6),
+                   'bitrate_mbit': size * 8.0 / (len(frames) / float(fps)) / 1e6,
+                   'psnr': float(np.mean(psnr)) if len(psnr) == len(sources) else None})
+    return result
+
+
+def choose(results, fps, num_cams, margin=1.5, min_psnr=30.0, num_cores=None):
+    """ Returns the result with the lowest bitrate that sustains the load or None if none does.
+        Every video needs fps, all videos together fps x num_cams spread over the cores of this host. """
+    if num_cores is None:
+        num_cores = multiprocessing.cpu_count()
+    feasible = list()
+    for r in results:
+        if r['encode_fps'] < fps * margin:
+            continue
+        if r['fps_per_core'] * num_cores < fps * num_cams * margin:
+            continue
+        if r['psnr'] is None or r['psnr'] < min_psnr:
+            # videos we can not read back do not count
+            continue
+        feasible.append(r)
+    if len(feasible) == 0:
+        return None
+    return min(feasible, key=lambda r: r['bitrate_mbit'])
+
+
+def load_key(fps, num_cams, shape, pixel_format):
+    return '%.1ffps_%dcams_%dx%d_%s' % (fps, num_cams, shape[1], shape[0], pixel_format)
+
+
+def load_cached(cache_path, key):
+    """ Returns the cached choice of this host for the load key or None. """
+    if not os.path.exists(cache_path):
+        return None
+    with open(cache_path, 'r') as fi:
+        cache = json.load(fi)
+    return cache.get(socket.gethostname(), dict()).get(key)
+
+
+def save_cached(cache_path, key, entry):
+    cache = dict()
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r') as fi:
+            cache = json.load(fi)
+    cache.setdefault(socket.gethostname(), dict())[key] = entry
+    with open(cache_path, 'w') as fo:
+        json.dump(cache, fo, indent=2)
+
+
+def tune(frames, pixel_format, fps, num_cams, margin=1.5, min_psnr=30.0, ffmpeg_bin='ffmpeg', verbose=True):
+    """ Measures all candidate configurations on frames and returns (choice, results). choice is None if no
+        configuration keeps up. """
+    tmp_dir = tempfile.mkdtemp(prefix='codec_tuner_')
+    results = list()
+    try:
+        for config in candidate_configs(ffmpeg_bin):
+            try:
+                results.append(measure(config, frames, pixel_format, fps, tmp_dir))
+            except (cv2.error, IOError, RuntimeError) as e:
+                if verbose:
+                    print('Skipping %s: %s' % (config['name'], e))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    choice = choose(results, fps, num_cams, margin, min_psnr)
+    if verbose:
+        print('%-28s %10s %12s %10s %8s' % ('config', 'enc FPS', 'FPS/core', 'Mbit/s', 'PSNR'))
+        for r in results:
+            print('%-28s %10.1f %12.1f %10.2f %8s %s' % (r['name'], r['encode_fps'], r['fps_per_core'],
+                                                         r['bitrate_mbit'],
+                                                         'nan' if r['psnr'] is None else '%.1f' % r['psnr'],
+                                                         '<-' if r is choice else ''))
+        print('Needed: %.1f FPS per video, %.1f FPS in total (margin %.1f, %d cores)' % (
+            fps * margin, fps * num_cams * margin, margin, multiprocessing.cpu_count()))
+    return choice, results
+
+
+def apply(choice, params):
+    """ Sets codec and ffmpeg settings of params (see config/params.py) to a configuration. """
+    params.codec = choice['codec']
+    if choice['ffmpeg'] is not None:
+        options = choice['ffmpeg']
+        params.ffmpeg_codec = options['codec']
+        params.ffmpeg_preset = options['preset']
+        params.ffmpeg_crf = options['crf']
+        params.ffmpeg_threads = options['threads']
+        params.ffmpeg_pix_fmt = options['pix_fmt']
+        params.ffmpeg_container = choice['container']
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Find encoder settings that keep up with a recording.')
+    parser.add_argument('--num-cams', type=int, default=8)
+    parser.add_argument('--fps', type=float, default=30.0)
+    parser.add_argument('--size', type=int, nargs=2, default=[1024, 1280], help='Frame height and width.')
+    parser.add_argument('--pixel-format', type=str, default='BayerRG8')
+    parser.add_argument('--num-frames', type=int, default=60)
+    args = parser.parse_args()
+
+    frames = synthetic_frames(args.num_frames, args.size, args.pixel_format)
+    choice, _ = tune(frames, args.pixel_format, args.fps, args.num_cams)
+    print('Choice:', None if choice is None else choice['name'])
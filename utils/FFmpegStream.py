@@ -0,0 +1,76 @@
+"""
+    Encoding with a local ffmpeg process.
+
+    Drop-in replacement for cv2.VideoWriter: frames are streamed uncompressed into the stdin of ffmpeg, which encodes
+    them with its own threads. This gives control over codec, preset, quality and container and encodes H.264 or FFV1
+    on several cores. Frames can be passed in their native pixel format, then ffmpeg does the demosaicing as well.
+"""
+import subprocess
+import numpy as np
+
+
+def ffmpeg_options(params):
+    """ Keyword arguments of FFmpegStream as configured by the ffmpeg_* settings of params (see config/params.py). """
+    return dict(codec=params.ffmpeg_codec,
+                preset=params.ffmpeg_preset,
+                crf=params.ffmpeg_crf,
+                threads=params.ffmpeg_threads,
+                pix_fmt=params.ffmpeg_pix_fmt,
+                ffmpeg_bin=params.ffmpeg_bin)
+
+
+class FFmpegStream(object):
+    def __init__(self, video_path, fps, frame_size, codec='libx264', preset='veryfast', crf=None, threads=0,
+                 pix_fmt='yuv420p', input_pix_fmt='bgr24', ffmpeg_bin='ffmpeg'):
+        """ frame_size is (width, height) like for cv2.VideoWriter, threads=0 lets ffmpeg decide. """
+        self.video_path = video_path
+        cmd = [ffmpeg_bin, '-y', '-loglevel', 'error', '-nostats',
+               '-f', 'rawvideo', '-pix_fmt', input_pix_fmt, '-s', '%dx%d' % tuple(frame_size), '-r', str(fps),
+               '-i', '-', '-an', '-c:v', codec, '-threads', str(threads)]
+        if preset is not None and codec in ['libx264', 'libx265']:
+            cmd += ['-preset', preset]
+        if crf is not None:
+            cmd += ['-crf', str(crf)]
+        if codec == 'ffv1':
+            # version 3 encodes slices in parallel
+            cmd += ['-level', '3']
+        if pix_fmt is not None:
+            cmd += ['-pix_fmt', pix_fmt]
+        cmd.append(video_path)
+
+        try:
+            self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        except OSError as e:
+            raise RuntimeError('Could not start %s, is ffmpeg installed? (%s)' % (ffmpeg_bin, e))
+
+    def isOpened(self):
+        return self.process.poll() is None
+
+    def write(self, frame):
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame).data)
+        except (IOError, OSError) as e:
+            raise IOError('ffmpeg stopped encoding %s (exit code %s): %s' % (self.video_path, self.process.poll(), e))
+
+    def release(self):
+        if self.process.stdin.closed:
+            return
+        try:
+            self.process.stdin.close()
+        except (IOError, OSError):
+            pass
+        if self.process.wait() != 0:
+            print('WARNING: ffmpeg exited with code %d while encoding %s' % (self.process.returncode, self.video_path))
+
+
+if __name__ == '__main__':
+    import time
+    NUM_FRAMES = 30*4
+
+    stream = FFmpegStream('./test.mkv', 30, (640, 480))
+    frame = np.random.randint(0, 255, (480, 640, 3)).astype('uint8')
+    start = time.time()
+    for _ in range(NUM_FRAMES):
+        stream.write(frame)
+    stream.release()
+    print('time passed', time.time() - start)
@@ -0,0 +1,122 @@
+"""
+    Per frame metadata written next to each video (runXXX_camN.meta).
+
+    For every written frame it stores the cameras frame id and tick timestamp, the number of frames skipped before
+    it and the host time it was received at. This tells which frames of different cameras were taken simultaneously.
+    Records are collected in preallocated blocks, which are written to disk by a background thread.
+"""
+import os
+import ast
+import glob
+import struct
+import sys
+import numpy as np
+from threading import Thread
+
+# import the Queue class from Python 3
+if sys.version_info >= (3, 0):
+    from queue import Queue, Empty
+
+# otherwise, import the Queue class for Python 2.7
+else:
+    from Queue import Queue, Empty
+
+
+frame_meta_dtype = np.dtype([('frame_index', '<i8'),  # index of the frame passed to the writer (see runXXX_camN.overflow.json)
+                             ('frame_id', '<i8'),  # block id the camera gave this frame
+                             ('timestamp', '<u8'),  # camera tick timestamp
+                             ('num_skipped', '<u4'),  # frames skipped by the camera before this one
+                             ('host_time', '<f8')])  # time the host received the frame (time.time())
+
+META_MAGIC = b'RTMETA01'
+
+
+def read_frame_meta(path):
+    """ Returns the metadata of all frames in a .meta file as structured array. """
+    with open(path, 'rb') as fi:
+        magic, header_size = struct.unpack('<8sI', fi.read(12))
+        assert magic == META_MAGIC, 'Not a frame meta file: %s' % path
+        dtype = np.dtype(ast.literal_eval(fi.read(header_size - 12).rstrip(b'\0 ').decode('ascii')))
+        # a record that was only partly written when recording stopped is ignored
+        data = fi.read()
+    num_records = len(data) // dtype.itemsize
+    return np.frombuffer(data[:num_records * dtype.itemsize], dtype=dtype)
+
+
+def load_run_meta(take_path, rid):
+    """ Returns the metadata of all cameras of a run as dict: camera name -> structured array. """
+    meta = dict()
+    for path in sorted(glob.glob(os.path.join(take_path, 'run%03d_*.meta' % rid))):
+        cam_name = os.path.splitext(os.path.basename(path))[0][len('run%03d_' % rid):]
+        meta[cam_name] = read_frame_meta(path)
+    return meta
+
+
+class FrameMetaWriter(object):
+    def __init__(self, path, block_size=1024, num_blocks=4):
+        self.path = path
+        self.block_size = block_size
+
+        self._fo = open(path, 'wb')
+        descr = str(frame_meta_dtype.descr).encode('ascii')
+        header_size = 64 * ((12 + len(descr)) // 64 + 1)
+        self._fo.write(struct.pack('<8sI', META_MAGIC, header_size) + descr.ljust(header_size - 12))
+
+        # full blocks go to the writing thread, which hands them back once written
+        self._free = Queue()
+        for _ in range(num_blocks - 1):
+            self._free.put(np.zeros(block_size, dtype=frame_meta_dtype))
+        self._block = np.zeros(block_size, dtype=frame_meta_dtype)
+        self._num = 0
+        self.num_records = 0
+
+        self.Q = Queue()
+        self.thread = Thread(target=self.update, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+    def update(self):
+        while True:
+            item = self.Q.get()
+            if item is None:
+                break
+            block, num = item
+            block[:num].tofile(self._fo)
+            self._fo.flush()
+            self._free.put(block)
+        self._fo.close()
+
+    def append(self, frame_index, frame_id, timestamp, num_skipped, host_time):
+        self._block[self._num] = (frame_index, frame_id, timestamp, num_skipped, host_time)
+        self._num += 1
+        self.num_records += 1
+        if self._num == self.block_size:
+            self._flush_block()
+
+    def _flush_block(self):
+        self.Q.put((self._block, self._num))
+        try:
+            self._block = self._free.get_nowait()
+        except Empty:
+            # writing to disk is behind, this is the only case we allocate
+            self._block = np.zeros(self.block_size, dtype=frame_meta_dtype)
+        self._num = 0
+
+    def close(self):
+        if self._num > 0:
+            self._flush_block()
+        self.Q.put(None)
+        self.thread.join()
+
+
+if __name__ == '__main__':
+    import time
+    writer = FrameMetaWriter('./test.meta', block_size=16)
+    start = time.time()
+    for i in range(1000):
+        writer.append(i, i + 5, int(time.time() * 1e9), 0, time.time())
+    print('Time per record %.2f us' % ((time.time() - start) / 1000 * 1e6))
+    writer.close()
+
+    meta = read_frame_meta('./test.meta')
+    print(len(meta), meta[:3])
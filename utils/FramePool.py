@@ -0,0 +1,102 @@
+"""
+    Fixed number of preallocated frame buffers.
+
+    Producers acquire a free slot, fill its buffer in place and hand the slot on. Whoever consumes the frame
+    releases the slot afterwards, so in steady state no memory is allocated per frame.
+
+    With a MemoryGovernor the pool can grow beyond its preallocated slots while the governor has room left. Those
+    extra buffers are given back to the governor as soon as they are released.
+"""
+import sys
+import threading
+import numpy as np
+
+# import the Queue class from Python 3
+if sys.version_info >= (3, 0):
+    from queue import Queue, Empty
+
+# otherwise, import the Queue class for Python 2.7
+else:
+    from Queue import Queue, Empty
+
+
+class FramePool(object):
+    def __init__(self, num_slots, shape, dtype=np.uint8, governor=None, name=None):
+        self.num_slots = num_slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+
+        self.governor = governor
+        self.name = name
+        if governor is not None:
+            governor.register(name)
+            # the preallocated slots are always granted, the budget only limits growing
+            governor.reserve(name, num_slots * self.frame_bytes, force=True)
+
+        # one contiguous block for the preallocated slots
+        block = np.empty((num_slots,) + self.shape, dtype=self.dtype)
+        self.buffers = [block[slot] for slot in range(num_slots)]
+        self._spare_slots = list()  # indices of released extra slots
+        self._lock = threading.Lock()
+
+        self._free = Queue()
+        for slot in range(num_slots):
+            self._free.put(slot)
+        self._num_extra = 0
+        self.max_used = 0
+
+    def _grow(self):
+        """ Returns a new extra slot if the governor has room for it or None. """
+        if self.governor is None or not self.governor.reserve(self.name, self.frame_bytes):
+            return None
+        with self._lock:
+            if self._spare_slots:
+                slot = self._spare_slots.pop()
+            else:
+                slot = len(self.buffers)
+                self.buffers.append(None)
+            self.buffers[slot] = np.empty(self.shape, dtype=self.dtype)
+            self._num_extra += 1
+        return slot
+
+    def acquire(self, timeout=None):
+        """ Returns a free slot and its buffer or (None, None) if all slots are in use.
+            If timeout is given, it waits up to timeout sec for a slot to become free. """
+        try:
+            slot = self._free.get_nowait()
+        except Empty:
+            slot = self._grow()
+            if slot is None:
+                if timeout is None:
+                    return None, None
+                try:
+                    slot = self._free.get(timeout=timeout)
+                except Empty:
+                    return None, None
+        self.max_used = max(self.max_used, self.num_used())
+        return slot, self.buffers[slot]
+
+    def release(self, slot):
+        if slot < self.num_slots:
+            self._free.put(slot)
+            return
+
+        # extra slots go back to the governor, so other writers can use the memory
+        with self._lock:
+            self.buffers[slot] = None
+            self._spare_slots.append(slot)
+            self._num_extra -= 1
+        self.governor.release(self.name, self.frame_bytes)
+
+    def num_used(self):
+        return self.num_slots + self._num_extra - self._free.qsize()
+
+    def fits(self, shape, dtype=np.uint8):
+        return self.shape == tuple(shape) and self.dtype == np.dtype(dtype)
+
+    def close(self):
+        """ Gives the memory of all slots back to the governor. """
+        if self.governor is not None:
+            self.governor.release(self.name, (self.num_slots + self._num_extra) * self.frame_bytes)
+            self._num_extra = 0
@@ -0,0 +1,216 @@
+"""
+    Frame store: a video format in which every frame can be read on its own.
+
+    Each frame is compressed independently (JPEG, PNG, zstd or lz4) and appended to chunk files of chunk_frames
+    frames. An index file holds offset and size of every frame, so reading frame i costs one lookup and one read,
+    no matter how far into the video it is. A store is a folder:
+
+        runXXX_camN.frames/header.json       shape, dtype, pixel format, fps, compression and chunk size
+        runXXX_camN.frames/index.bin         offset and size of each frame (2 x uint64)
+        runXXX_camN.frames/chunk_00000.bin   compressed frames 0 ... chunk_frames-1
+
+    FrameStoreWriter has the write()/release() interface of cv2.VideoWriter, frames are compressed by a thread pool.
+    FrameStoreReader can be used from many threads at the same time.
+"""
+import os
+import json
+import struct
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+INDEX_RECORD = struct.Struct('<QQ')  # offset, size
+
+
+def is_lossless(compression):
+    return compression in ['png', 'zstd', 'lz4']
+
+
+def _compressor(compression, quality):
+    """ Returns a thread safe function turning a frame into bytes. """
+    if compression == 'jpg':
+        return lambda frame: cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+    if compression == 'png':
+        return lambda frame: cv2.imencode('.png', frame, [cv2.IMWRITE_PNG_COMPRESSION, 1])[1].tobytes()
+    if compression == 'zstd':
+        import zstandard
+        local = threading.local()  # compressors must not be shared between threads
+
+        def compress(frame):
+            if not hasattr(local, 'cctx'):
+                local.cctx = zstandard.ZstdCompressor(level=quality)
+            return local.cctx.compress(np.ascontiguousarray(frame).data)
+        return compress
+    if compression == 'lz4':
+        import lz4.frame
+        return lambda frame: lz4.frame.compress(np.ascontiguousarray(frame).data)
+    raise NotImplementedError('Unsupported compression %s' % compression)
+
+
+def _decompressor(compression, shape, dtype):
+    if compression in ['jpg', 'png']:
+        return lambda data: cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    if compression == 'zstd':
+        import zstandard
+        local = threading.local()
+
+        def decompress(data):
+            if not hasattr(local, 'dctx'):
+                local.dctx = zstandard.ZstdDecompressor()
+            return np.frombuffer(local.dctx.decompress(data), dtype=dtype).reshape(shape)
+        return decompress
+    if compression == 'lz4':
+        import lz4.frame
+        return lambda data: np.frombuffer(lz4.frame.decompress(data), dtype=dtype).reshape(shape)
+    raise NotImplementedError('Unsupported compression %s' % compression)
+
+
+def frame_store_options(params):
+    """ Keyword arguments of FrameStoreWriter as configured by the frames_* settings of params (see config/params.py). """
+    return dict(compression=params.frames_compression,
+                quality=params.frames_quality,
+                chunk_frames=params.frames_chunk_size,
+                num_workers=params.frames_workers)
+
+
+class FrameStoreWriter(object):
+    def __init__(self, path, fps, shape, dtype=np.uint8, pixel_format='BGR8', compression='jpg', quality=95,
+                 chunk_frames=1000, num_workers=None):
+        """ quality is the JPEG quality or the zstd level, num_workers=None uses all cores. """
+        self.path = path
+        self.chunk_frames = chunk_frames
+        self.frame_count = 0
+        if not os.path.exists(path):
+            os.makedirs(path)
+        with open(os.path.join(path, 'header.json'), 'w') as fo:
+            json.dump({'shape': list(shape), 'dtype': np.dtype(dtype).str, 'pixel_format': pixel_format, 'fps': fps,
+                       'compression': compression, 'chunk_frames': chunk_frames}, fo)
+        self._index = open(os.path.join(path, 'index.bin'), 'wb')
+        self._chunk, self._offset = None, 0
+
+        if num_workers is None or num_workers <= 0:
+            num_workers = multiprocessing.cpu_count()
+        self._compress = _compressor(compression, quality)
+        self._executor = ThreadPoolExecutor(num_workers)
+        self._pending = deque()  # compressions in order of the frames
+        self._max_pending = 2 * num_workers
+
+    def isOpened(self):
+        return self._index is not None
+
+    def write(self, frame):
+        # the callers buffer is reused once we return, so compress a copy
+        self._pending.append(self._executor.submit(self._compress, frame.copy()))
+        while len(self._pending) >= self._max_pending:
+            self._append(self._pending.popleft().result())
+
+    def _append(self, data):
+        if self.frame_count % self.chunk_frames == 0:
+            if self._chunk is not None:
+                self._chunk.close()
+            chunk_name = 'chunk_%05d.bin' % (self.frame_count // self.chunk_frames)
+            self._chunk, self._offset = open(os.path.join(self.path, chunk_name), 'wb'), 0
+        self._chunk.write(data)
+        self._index.write(INDEX_RECORD.pack(self._offset, len(data)))
+        self._offset += len(data)
+        self.frame_count += 1
+
+    def release(self):
+        if self._index is None:
+            return
+        while self._pending:
+            self._append(self._pending.popleft().result())
+        self._executor.shutdown()
+        if self._chunk is not None:
+            self._chunk.close()
+        self._index.close()
+        self._index = None
+
+
+class FrameStoreReader(object):
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'header.json'), 'r') as fi:
+            self.header = json.load(fi)
+        self.shape = tuple(self.header['shape'])
+        self.dtype = np.dtype(self.header['dtype'])
+        self.pixel_format = self.header['pixel_format']
+        self.fps = self.header['fps']
+        self.chunk_frames = self.header['chunk_frames']
+
+        # a record that was only partly written when recording stopped is ignored
+        with open(os.path.join(path, 'index.bin'), 'rb') as fi:
+            data = fi.read()
+        num = len(data) // INDEX_RECORD.size
+        self.index = np.frombuffer(data[:num * INDEX_RECORD.size], dtype=np.uint64).reshape(num, 2)
+        self._decompress = _decompressor(self.header['compression'], self.shape, self.dtype)
+
+        self._chunks = dict()  # chunk id -> file descriptor, shared by all threads
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.index.shape[0]
+
+    def _fd(self, chunk_id):
+        fd = self._chunks.get(chunk_id)
+        if fd is None:
+            with self._lock:
+                fd = self._chunks.get(chunk_id)
+                if fd is None:
+                    chunk_path = os.path.join(self.path, 'chunk_%05d.bin' % chunk_id)
+                    fd = os.open(chunk_path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+                    self._chunks[chunk_id] = fd
+        return fd
+
+    def read_bytes(self, i):
+        """ Compressed data of frame i. """
+        offset, size = int(self.index[i, 0]), int(self.index[i, 1])
+        fd = self._fd(i // self.chunk_frames)
+        if hasattr(os, 'pread'):
+            return os.pread(fd, size, offset)
+        with self._lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            return os.read(fd, size)
+
+    def read(self, i):
+        """ Returns frame i in the pixel format it was stored in. """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('Frame %d out of range, the store has %d frames.' % (i, len(self)))
+        return self._decompress(self.read_bytes(i))
+
+    def __getitem__(self, i):
+        return self.read(i)
+
+    def close(self):
+        with self._lock:
+            for fd in self._chunks.values():
+                os.close(fd)
+            self._chunks = dict()
+
+
+if __name__ == '__main__':
+    import time
+    import shutil
+    NUM_FRAMES = 30*4
+
+    frame = np.random.randint(0, 255, (480, 640, 3)).astype('uint8')
+    writer = FrameStoreWriter('./test.frames', 30, frame.shape, chunk_frames=50)
+    start = time.time()
+    for i in range(NUM_FRAMES):
+        frame[:16] = i
+        writer.write(frame)
+    writer.release()
+    print('Writing %.1f FPS' % (NUM_FRAMES / (time.time() - start)))
+
+    reader = FrameStoreReader('./test.frames')
+    start = time.time()
+    for i in np.random.permutation(len(reader)):
+        assert abs(reader[i][:8].mean() - i) < 3
+    print('Random access %.1f FPS' % (len(reader) / (time.time() - start)))
+    reader.close()
+    shutil.rmtree('./test.frames')
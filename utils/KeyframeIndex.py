@@ -0,0 +1,150 @@
+"""
+    Which frames of a video are keyframes.
+
+    Decoding can only start at a keyframe, so reading frame i means seeking to the last keyframe before i and
+    decoding forward from there. The index is built once per video and stored next to it (runXXX_camN.keyframes.json).
+
+    AVI files carry this information in their index, which we read directly (idx1 and the OpenDML indx/ix00 used
+    by files over 1 GB). For other containers ffprobe is asked if it is installed. Without either only the first
+    frame is known to be a keyframe, which is correct but slow.
+"""
+import os
+import json
+import shutil
+import struct
+import subprocess
+
+
+def _read_chunk_header(fi):
+    data = fi.read(8)
+    if len(data) < 8:
+        return None, 0
+    return struct.unpack('<4sI', data)
+
+
+def _odml_keyframes(fi, super_index):
+    """ Keyframes from the OpenDML standard index chunks (ix00) listed in the super index of the video stream. """
+    keyframes, num_frames = list(), 0
+    for offset in super_index:
+        fi.seek(offset)
+        _, size = _read_chunk_header(fi)
+        longs_per_entry, _, _, num_entries, _, _ = struct.unpack('<HBBI4sQ', fi.read(20))
+        fi.read(4)  # reserved
+        entries = fi.read(num_entries * longs_per_entry * 4)
+        for i in range(num_entries):
+            _, entry_size = struct.unpack_from('<II', entries, i * longs_per_entry * 4)
+            if not entry_size & 0x80000000:
+                keyframes.append(num_frames)
+            num_frames += 1
+    return num_frames, keyframes
+
+
+def avi_keyframes(path):
+    """ Returns (number of frames, keyframe indices) of the first stream of an AVI file or None. """
+    with open(path, 'rb') as fi:
+        fourcc, riff_size = _read_chunk_header(fi)
+        if fourcc != b'RIFF' or fi.read(4) != b'AVI ':
+            return None
+
+        super_index, idx1 = None, None
+        end = 8 + riff_size
+        while fi.tell() + 8 <= end:
+            start = fi.tell()
+            fourcc, size = _read_chunk_header(fi)
+            if fourcc is None:
+                break
+            if fourcc == b'LIST' and fi.read(4) == b'hdrl':
+                # look for the super index of the first stream: hdrl/strl/indx
+                hdrl_end = start + 8 + size
+                while fi.tell() + 8 <= hdrl_end and super_index is None:
+                    sub_start = fi.tell()
+                    sub_fourcc, sub_size = _read_chunk_header(fi)
+                    if sub_fourcc == b'LIST' and fi.read(4) == b'strl':
+                        strl_end = sub_start + 8 + sub_size
+                        while fi.tell() + 8 <= strl_end:
+                            item_start = fi.tell()
+                            item_fourcc, item_size = _read_chunk_header(fi)
+                            if item_fourcc == b'indx':
+                                longs_per_entry, _, _, num_entries = struct.unpack('<HBBI', fi.read(8))
+                                fi.read(4 + 12)  # chunk id, reserved
+                                entries = fi.read(num_entries * longs_per_entry * 4)
+                                super_index = [struct.unpack_from('<Q', entries, i * longs_per_entry * 4)[0]
+                                               for i in range(num_entries)]
+                            fi.seek(item_start + 8 + item_size + (item_size & 1))
+                        break
+                    fi.seek(sub_start + 8 + sub_size + (sub_size & 1))
+            elif fourcc == b'idx1':
+                idx1 = fi.read(size)
+            fi.seek(start + 8 + size + (size & 1))
+
+        if super_index:
+            return _odml_keyframes(fi, super_index)
+        if idx1 is None:
+            return None
+
+    keyframes, num_frames = list(), 0
+    for i in range(len(idx1) // 16):
+        ckid, flags = struct.unpack_from('<4sI', idx1, i * 16)
+        if ckid[:2] != b'00' or ckid[2:] not in [b'dc', b'db']:
+            continue
+        if flags & 0x10:  # AVIIF_KEYFRAME
+            keyframes.append(num_frames)
+        num_frames += 1
+    return num_frames, keyframes
+
+
+def ffprobe_keyframes(path, ffprobe_bin='ffprobe'):
+    """ Returns (number of frames, keyframe indices) of the first video stream as reported by ffprobe or None. """
+    if shutil.which(ffprobe_bin) is None:
+        return None
+    cmd = [ffprobe_bin, '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=flags', '-of', 'csv=p=0',
+           path]
+    try:
+        flags = subprocess.check_output(cmd).decode('ascii').split()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return len(flags), [i for i, f in enumerate(flags) if f.startswith('K')]
+
+
+def index_path(video_path):
+    return os.path.splitext(video_path)[0] + '.keyframes.json'
+
+
+def build_keyframe_index(video_path):
+    """ Returns dict with 'num_frames' (None if unknown) and 'keyframes'. """
+    result = avi_keyframes(video_path)
+    if result is None:
+        result = ffprobe_keyframes(video_path)
+    if result is None:
+        return {'num_frames': None, 'keyframes': [0]}
+    num_frames, keyframes = result
+    if len(keyframes) == 0 or keyframes[0] != 0:
+        keyframes = [0] + keyframes
+    return {'num_frames': num_frames, 'keyframes': keyframes}
+
+
+def load_keyframe_index(video_path):
+    """ Returns the keyframe index of a video, building and storing it if there is no current one. """
+    stat = os.stat(video_path)
+    path = index_path(video_path)
+    if os.path.exists(path):
+        with open(path, 'r') as fi:
+            index = json.load(fi)
+        if index.get('size') == stat.st_size and index.get('mtime') == stat.st_mtime:
+            return index
+
+    index = build_keyframe_index(video_path)
+    index['size'], index['mtime'] = stat.st_size, stat.st_mtime
+    try:
+        with open(path, 'w') as fo:
+            json.dump(index, fo)
+    except (IOError, OSError):
+        pass  # read-only location, the index is rebuilt next time
+    return index
+
+
+if __name__ == '__main__':
+    import sys
+    for video_path in sys.argv[1:]:
+        index = load_keyframe_index(video_path)
+        print('%s: %s frames, %d keyframes' % (video_path, index['num_frames'], len(index['keyframes'])))
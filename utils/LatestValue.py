@@ -0,0 +1,58 @@
+"""
+    Hands the most recent value from one thread to another without locking.
+
+    The writer overwrites the value, readers only ever see the latest one. A value and its sequence number are
+    stored as one tuple, so they are replaced by a single (atomic) assignment.
+"""
+import numpy as np
+
+
+class LatestValue(object):
+    def __init__(self):
+        self._item = (0, None)
+
+    def put(self, value):
+        self._item = (self._item[0] + 1, value)
+
+    def get(self):
+        """ Returns the sequence number and the latest value, which is None if nothing was put yet. """
+        return self._item
+
+    def clear(self):
+        self._item = (self._item[0], None)
+
+
+
+class LatestFrame(LatestValue):
+    """ LatestValue for frames whose buffer is reused once it was put, e.g. a slot that goes on to a video writer.
+
+        put() copies the frame into one of two buffers owned by this object, but only after the reader got the previous
+        one, so at most one frame is copied per frame shown. The buffer returned by get() is not written until the reader
+        got a newer frame with the next get().
+    """
+    def __init__(self):
+        super(LatestFrame, self).__init__()
+        self._buffers = [None, None]
+        self._last = 1  # buffer holding the latest frame, the other one is written next
+        self._taken = 0  # sequence number the reader got last
+        self._requested = True  # the reader got the latest frame, the next put() is copied
+
+    def put(self, value):
+        if not self._requested:
+            return
+        index = 1 - self._last
+        if self._buffers[index] is None:
+            self._buffers[index] = value.copy()
+        else:
+            np.copyto(self._buffers[index], value)
+        self._last = index
+        self._requested = False
+        super(LatestFrame, self).put(self._buffers[index])
+
+    def get(self):
+        seq, value = self._item
+        if value is not None and seq != self._taken:
+            # put() only runs again after this, so the other buffer is free to be written
+            self._taken = seq
+            self._requested = True
+        return seq, value
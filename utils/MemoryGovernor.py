@@ -0,0 +1,88 @@
+"""
+    One RAM budget for the frames buffered by all writers of a recording.
+
+    Writers register with the governor and reserve bytes before they allocate a frame buffer. A writer that falls
+    behind can buffer more frames as long as the other writers leave room for it, instead of every writer getting
+    a fixed number of frames regardless of their size.
+"""
+import os
+import threading
+
+
+def available_ram():
+    """ Returns the RAM available to new allocations in bytes or None if it can not be determined. """
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class MemoryGovernor(object):
+    def __init__(self, budget=None, fraction=0.5, fallback=2 * 1024**3):
+        """ budget is given in bytes, without it fraction of the currently available RAM is used. """
+        if budget is None:
+            ram = available_ram()
+            budget = fallback if ram is None else int(ram * fraction)
+        self.budget = int(budget)
+
+        self._lock = threading.Lock()
+        self.used = 0
+        self.peak = 0
+        self.clients = dict()  # name -> [used, peak]
+
+    def register(self, name):
+        with self._lock:
+            self.clients.setdefault(name, [0, 0])
+        return name
+
+    def reserve(self, name, nbytes, force=False):
+        """ Books nbytes for client name. Returns False if they do not fit into the budget, unless force is set. """
+        with self._lock:
+            if not force and self.used + nbytes > self.budget:
+                return False
+            self.used += nbytes
+            self.peak = max(self.peak, self.used)
+            client = self.clients[name]
+            client[0] += nbytes
+            client[1] = max(client[1], client[0])
+        return True
+
+    def release(self, name, nbytes):
+        with self._lock:
+            self.used -= nbytes
+            self.clients[name][0] -= nbytes
+
+    def free(self):
+        return max(0, self.budget - self.used)
+
+    def fair_share(self):
+        """ Bytes of the budget per registered client. """
+        return self.budget // max(1, len(self.clients))
+
+    def get_state(self):
+        return 'RAM %.0f/%.0f MB (peak %.0f MB);' % (self.used / 1024.0**2, self.budget / 1024.0**2,
+                                                     self.peak / 1024.0**2)
+
+    def report(self):
+        """ Returns a line per client with its high-water mark. """
+        lines = ['Writer RAM peak %.0f MB of %.0f MB budget' % (self.peak / 1024.0**2, self.budget / 1024.0**2)]
+        for name in sorted(self.clients.keys()):
+            lines.append('  %s: peak %.0f MB' % (name, self.clients[name][1] / 1024.0**2))
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    governor = MemoryGovernor(budget=100 * 1024**2)
+    print('Available RAM %s bytes' % available_ram())
+    for name in ['cam0', 'cam1']:
+        governor.register(name)
+    print(governor.reserve('cam0', 80 * 1024**2), governor.reserve('cam1', 40 * 1024**2))
+    governor.release('cam0', 80 * 1024**2)
+    print(governor.reserve('cam1', 40 * 1024**2))
+    print(governor.get_state())
+    print(governor.report())
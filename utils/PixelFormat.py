@@ -0,0 +1,59 @@
+"""
+    Conversion of the pixel formats delivered by the cameras into BGR images.
+
+    Cameras send their native format (Bayer pattern or Mono8), which has a single channel and a third of the bytes of
+    BGR8. Frames keep this format all the way to the writer and are only converted when they are encoded.
+"""
+import cv2
+
+
+# pylon names Bayer patterns by their first row, OpenCV by the second one: BayerRG8 (RGGB) is COLOR_BayerBG2BGR
+_to_bgr_codes = {'Mono8': cv2.COLOR_GRAY2BGR,
+                 'RGB8': cv2.COLOR_RGB2BGR,
+                 'BayerRG8': cv2.COLOR_BayerBG2BGR,
+                 'BayerBG8': cv2.COLOR_BayerRG2BGR,
+                 'BayerGR8': cv2.COLOR_BayerGB2BGR,
+                 'BayerGB8': cv2.COLOR_BayerGR2BGR}
+
+# the same formats as ffmpeg calls them, Bayer patterns are named by their first row like in pylon
+_ffmpeg_pix_fmts = {'BGR8': 'bgr24',
+                    'RGB8': 'rgb24',
+                    'Mono8': 'gray',
+                    'BayerRG8': 'bayer_rggb8',
+                    'BayerBG8': 'bayer_bggr8',
+                    'BayerGR8': 'bayer_grbg8',
+                    'BayerGB8': 'bayer_gbrg8'}
+
+
+def is_bayer(pixel_format):
+    return pixel_format.startswith('Bayer')
+
+
+def num_channels(pixel_format):
+    if pixel_format in ['BGR8', 'RGB8']:
+        return 3
+    return 1
+
+
+def native_pixel_format(available_formats):
+    """ The format a sensor delivers without any processing on the camera: its 8 bit Bayer pattern or Mono8. """
+    for pixel_format in ['BayerRG8', 'BayerBG8', 'BayerGR8', 'BayerGB8']:
+        if pixel_format in available_formats:
+            return pixel_format
+    return 'Mono8'
+
+
+def to_bgr(frame, pixel_format, dst=None):
+    """ Converts a frame into a BGR image. Writes into dst if it has the right shape.
+        BGR8 frames are returned as they are.
+    """
+    if pixel_format == 'BGR8':
+        return frame
+    if pixel_format not in _to_bgr_codes:
+        raise NotImplementedError('Unsupported pixel format %s' % pixel_format)
+    return cv2.cvtColor(frame, _to_bgr_codes[pixel_format], dst=dst)
+
+
+def ffmpeg_pix_fmt(pixel_format):
+    """ Name of a pixel format in ffmpeg or None if ffmpeg does not know it. """
+    return _ffmpeg_pix_fmts.get(pixel_format)
@@ -0,0 +1,68 @@
+"""
+    Preview of many cameras in one image.
+
+    Unlike StitchedImage the layout is computed once for a set of cameras and every frame is resized directly into
+    its tile of a preallocated canvas, so updating the preview neither copies full resolution frames nor allocates.
+"""
+import cv2
+import numpy as np
+
+from utils.StitchedImage import StitchedImage
+from utils.PixelFormat import to_bgr, num_channels, is_bayer
+
+
+class PreviewCompositor(object):
+    def __init__(self, frame_shapes, pixel_formats, target_size=(800, 1000)):
+        assert len(frame_shapes) > 0, 'There should be at least one camera.'
+        self.canvas = np.zeros((target_size[0], target_size[1], 3), dtype=np.uint8)
+        self.grid_shape = StitchedImage._calc_stack_shape(len(frame_shapes))
+        self.tile_size = target_size[0] // self.grid_shape[0], target_size[1] // self.grid_shape[1]
+
+        self.pixel_formats = list(pixel_formats)
+        self.tiles, self.scales, self._scratch = list(), list(), list()
+        th, tw = self.tile_size
+        for i, shape in enumerate(frame_shapes):
+            r, c = divmod(i, self.grid_shape[1])
+            self.tiles.append(self.canvas[r*th:(r+1)*th, c*tw:(c+1)*tw])
+            self.scales.append((th / float(shape[0]), tw / float(shape[1])))
+
+            # intermediate buffers: single channel frames are resized before and Bayer frames after conversion
+            pixel_format = self.pixel_formats[i]
+            if pixel_format == 'BGR8':
+                self._scratch.append(None)
+            elif num_channels(pixel_format) == 1 and not is_bayer(pixel_format):
+                self._scratch.append(np.empty((th, tw), dtype=np.uint8))
+            else:
+                self._scratch.append(np.empty((shape[0], shape[1], 3), dtype=np.uint8))
+
+    @property
+    def image(self):
+        return self.canvas
+
+    def update(self, cid, frame):
+        """ Draws the most recent frame of camera cid into its tile. """
+        tile, scratch, pixel_format = self.tiles[cid], self._scratch[cid], self.pixel_formats[cid]
+        th, tw = self.tile_size
+        if scratch is None:
+            out = cv2.resize(frame, (tw, th), dst=tile, interpolation=cv2.INTER_LINEAR)
+        elif len(scratch.shape) == 2:
+            small = cv2.resize(frame, (tw, th), dst=scratch, interpolation=cv2.INTER_LINEAR)
+            out = to_bgr(small, pixel_format, dst=tile)
+        else:
+            bgr = to_bgr(frame, pixel_format, dst=scratch)
+            out = cv2.resize(bgr, (tw, th), dst=tile, interpolation=cv2.INTER_LINEAR)
+
+        if out is not tile:
+            tile[...] = out
+
+
+if __name__ == '__main__':
+    import time
+    frames = [np.random.randint(0, 255, (1024, 1280), dtype=np.uint8) for _ in range(8)]
+    compositor = PreviewCompositor([f.shape for f in frames], ['BayerRG8'] * 4 + ['Mono8'] * 4)
+
+    start = time.time()
+    for _ in range(10):
+        for cid, frame in enumerate(frames):
+            compositor.update(cid, frame)
+    print('Preview update takes %.1f ms' % ((time.time() - start) / 10 * 1000.0))
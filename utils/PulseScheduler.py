@@ -0,0 +1,81 @@
+"""
+    Absolute deadline timing for software generated trigger pulses.
+
+    Pulse k is due at start + k * period on the monotonic clock, so a late pulse does not shift the ones after it and
+    the error does not build up over a recording. Waiting sleeps until shortly before a deadline and spins for the
+    rest, because the OS wakes sleeping threads late by up to a millisecond. The spin window follows how late sleep
+    actually wakes up, capped by spin_budget, the fraction of each period we allow to keep a core busy.
+"""
+import time
+from array import array
+import numpy as np
+
+clock = time.perf_counter  # monotonic, highest resolution available
+
+
+class PulseScheduler(object):
+    def __init__(self, period, spin_budget=0.05, start=None):
+        self.period = float(period)
+        self.spin_budget = spin_budget
+        self.start = clock() if start is None else start
+        self.index = 0  # index of the next pulse
+        self.lateness = array('d')  # of every pulse in sec, measured when the wait returned
+        self.num_missed = 0
+        self.spin_time = 0.0
+        self._oversleep = 0.0005  # running estimate of how late sleep() wakes up, in sec
+
+    def deadline(self, index):
+        return self.start + index * self.period
+
+    def set_period(self, period):
+        """ Changes the period from the next pulse on, without moving the next deadline. """
+        next_deadline = self.deadline(self.index)
+        self.period = float(period)
+        self.start = next_deadline - self.index * self.period
+
+    def wait_until(self, deadline):
+        """ Sleeps, then spins until deadline. Returns how late we returned in sec. """
+        margin = min(2.0 * self._oversleep, self.spin_budget * self.period)
+        now = clock()
+        if deadline - margin > now:
+            wake = deadline - margin
+            time.sleep(wake - now)
+            now = clock()
+            self._oversleep = 0.9 * self._oversleep + 0.1 * max(now - wake, 0.0)
+        spin_start = now
+        while now < deadline:
+            now = clock()
+        self.spin_time += now - spin_start
+        return now - deadline
+
+    def next(self):
+        """ Waits for the next pulse and returns its index. Pulses we are more than a period late for are skipped, so a
+            stall does not end in a burst of pulses. """
+        late = clock() - self.deadline(self.index)
+        if late > self.period:
+            missed = int(late / self.period)
+            self.num_missed += missed
+            self.index += missed
+        self.lateness.append(self.wait_until(self.deadline(self.index)))
+        self.index += 1
+        return self.index - 1
+
+    def get_state(self):
+        if len(self.lateness) == 0:
+            return ' No pulses;'
+        lateness = np.frombuffer(self.lateness, dtype=np.float64) * 1e6
+        elapsed = max(clock() - self.start, 1e-6)
+        return ' Pulses %d, late p50 %.0f us, p99 %.0f us, max %.0f us; missed %d; spinning %.1f%% CPU;' % (
+            len(lateness), np.percentile(lateness, 50), np.percentile(lateness, 99), lateness.max(), self.num_missed,
+            100.0 * self.spin_time / elapsed)
+
+
+if __name__ == '__main__':
+    scheduler = PulseScheduler(1.0 / 100)
+    edges = list()
+    for _ in range(300):
+        scheduler.next()
+        edges.append(clock())
+    jitter = (np.diff(edges) - scheduler.period) * 1e6
+    print('Period jitter p50 %.0f us, p99 %.0f us' % (np.percentile(np.abs(jitter), 50), np.percentile(np.abs(jitter), 99)))
+    print(scheduler.get_state())
@@ -0,0 +1,164 @@
+"""
+    Uncompressed, memory-mapped video files.
+
+    For short sessions at high frame rates encoding in real time is the bottleneck, so RawVideoWriter only copies
+    frames into a preallocated file per camera and run. transcode_raw.py converts them into regular videos later.
+
+    File layout: A header of RAW_HEADER_SIZE bytes, followed by the frames as one C-contiguous array.
+"""
+import os
+import struct
+import numpy as np
+
+from utils.VideoWriterFast import QueueOverflow
+
+
+RAW_MAGIC = b'RTRAWVID'
+RAW_VERSION = 1
+RAW_HEADER_SIZE = 4096  # keeps frames page aligned
+_header_fmt = '<8sII QQ II 4Q 16s16sd'  # magic, version, header size, frame count, capacity, ndim, pad, shape, dtype, pixel format, fps
+_frame_count_offset = 16
+
+
+def _pack_header(frame_count, capacity, shape, dtype, pixel_format, fps):
+    ndim = len(shape)
+    shape = tuple(shape) + (0,) * (4 - ndim)
+    return struct.pack(_header_fmt, RAW_MAGIC, RAW_VERSION, RAW_HEADER_SIZE,
+                       frame_count, capacity, ndim, 0,
+                       *shape, np.dtype(dtype).str.encode('ascii'), pixel_format.encode('ascii'), fps)
+
+
+def read_raw_header(path):
+    """ Returns the header of a raw video as dict. """
+    with open(path, 'rb') as fi:
+        data = fi.read(struct.calcsize(_header_fmt))
+    values = struct.unpack(_header_fmt, data)
+    assert values[0] == RAW_MAGIC, 'Not a raw video: %s' % path
+    ndim = values[5]
+    return {'version': values[1],
+            'header_size': values[2],
+            'frame_count': values[3],
+            'capacity': values[4],
+            'shape': tuple(values[7:7 + ndim]),
+            'dtype': np.dtype(values[11].rstrip(b'\0').decode('ascii')),
+            'pixel_format': values[12].rstrip(b'\0').decode('ascii'),
+            'fps': values[13]}
+
+
+def read_raw_video(path):
+    """ Returns a read-only memory-mapped array of all frames in a raw video (no data is copied) and its header. """
+    header = read_raw_header(path)
+    if header['frame_count'] == 0:
+        return np.empty((0,) + header['shape'], dtype=header['dtype']), header
+    frames = np.memmap(path, dtype=header['dtype'], mode='r', offset=header['header_size'],
+                       shape=(header['frame_count'],) + header['shape'])
+    return frames, header
+
+
+"""
+    Writes frames into a preallocated, memory-mapped raw video file.
+    Same interface as VideoWriterFast. Frames obtained with acquire() point directly into the file,
+    so the only work per frame is filling them. The file grows when more frames come than were preallocated.
+"""
+class RawVideoWriter:
+    def __init__(self, video_path, fps, max_frames=1000, pixel_format='BGR8'):
+        self.fps = fps
+        self.video_path = video_path
+        self.max_frames = max_frames  # number of frames to preallocate
+        self.pixel_format = pixel_format
+
+        # the file is initialized when we get the first frame
+        self.frame_count = 0
+        self.capacity = 0
+        self.shape, self.dtype = None, None
+        self._mm = None
+        self._frames = None
+        self._header_count = None
+        self.stopped = False
+
+    def _map(self, capacity):
+        """ (Re)maps the file for capacity frames, allocating disk space if necessary. """
+        if self._mm is not None:
+            self._mm.flush()
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        size = RAW_HEADER_SIZE + capacity * frame_bytes
+        with open(self.video_path, 'r+b' if os.path.exists(self.video_path) else 'w+b') as fo:
+            fo.truncate(size)
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(fo.fileno(), 0, size)
+
+        # views on the old mapping stay valid as long as they are referenced
+        self._mm = np.memmap(self.video_path, dtype=np.uint8, mode='r+', shape=(size,))
+        self._mm[:RAW_HEADER_SIZE] = 0
+        header = _pack_header(self.frame_count, capacity, self.shape, self.dtype, self.pixel_format, self.fps)
+        self._mm[:len(header)] = np.frombuffer(header, dtype=np.uint8)
+        self._header_count = self._mm[_frame_count_offset:_frame_count_offset + 8].view(np.uint64)
+        self._frames = self._mm[RAW_HEADER_SIZE:].view(self.dtype).reshape((capacity,) + self.shape)
+        self.capacity = capacity
+
+    def acquire(self, shape, dtype=np.uint8):
+        """ Returns the index of the next frame and its location in the file, which should be filled and passed on to feed(). """
+        if self._mm is None:
+            self.shape, self.dtype = tuple(shape), np.dtype(dtype)
+            self._map(self.max_frames)
+        assert self.shape == tuple(shape), 'All frames of a video need to have the same shape.'
+
+        if self.stopped:
+            raise QueueOverflow
+        if self.frame_count == self.capacity:
+            self._map(2 * self.capacity)
+        return self.frame_count, self._frames[self.frame_count]
+
+    def feed(self, frame, slot=None):
+        if slot is None:
+            slot, buffer = self.acquire(frame.shape, frame.dtype)
+            np.copyto(buffer, frame)
+        assert slot == self.frame_count, 'Frames have to be fed in the order they were acquired.'
+        self.frame_count += 1
+        self._header_count[0] = self.frame_count
+
+    def running(self):
+        return not self.stopped
+
+    def is_active(self):
+        # there is no queue, frames are in the file once they are fed
+        return False
+
+    def wait_to_finish(self):
+        if self._mm is not None:
+            self._mm.flush()
+
+    def stop(self):
+        # release the mapping and remove preallocated space that was not used
+        self.stopped = True
+        if self._mm is None:
+            return
+        self._mm.flush()
+        self._mm, self._frames, self._header_count = None, None, None
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        with open(self.video_path, 'r+b') as fo:
+            fo.seek(0)
+            fo.write(_pack_header(self.frame_count, self.frame_count, self.shape, self.dtype, self.pixel_format, self.fps))
+            fo.truncate(RAW_HEADER_SIZE + self.frame_count * frame_bytes)
+
+    def get_state(self):
+        return 'Frames %d/%d;' % (self.frame_count, self.capacity)
+
+
+if __name__ == '__main__':
+    import time
+    NUM_FRAMES = 30*4
+
+    writer = RawVideoWriter('./test.raw', fps=30, max_frames=16)
+    frame = np.random.randint(0, 255, (480, 640, 3)).astype('uint8')
+    start = time.time()
+    for _ in range(NUM_FRAMES):
+        slot, buffer = writer.acquire(frame.shape)
+        np.copyto(buffer, frame)
+        writer.feed(buffer, slot)
+    writer.stop()
+    print('time passed', time.time() - start)
+
+    frames, header = read_raw_video('./test.raw')
+    print(header)
+    print('Frames read back', frames.shape, 'equal', np.all(frames[-1] == frame))
@@ -0,0 +1,127 @@
+"""
+    Reads all cameras of one run together.
+
+    Every runXXX_camN video of a run gets its own VideoReaderFast, so all videos are decoded in parallel and each
+    reader decodes at most queue_size frames ahead. Frames are returned per time step, as tuple or stacked into one
+    (num_cams, H, W, C) array.
+"""
+import os
+import re
+import glob
+import numpy as np
+
+from utils.VideoReaderFast import VideoReaderFast
+from utils.FrameMeta import load_run_meta
+
+VIDEO_EXTENSIONS = ['.avi', '.mp4', '.mkv']
+
+
+def _natural_key(name):
+    return [int(t) if t.isdigit() else t for t in re.split(r'(\d+)', name)]
+
+
+def find_run_videos(take_path, rid):
+    """ Returns dict camera name -> video path of all videos of run rid. """
+    videos = dict()
+    prefix = 'run%03d_' % rid
+    for path in glob.glob(os.path.join(take_path, prefix + '*')):
+        name, ext = os.path.splitext(os.path.basename(path))
+        if ext in VIDEO_EXTENSIONS:
+            videos[name[len(prefix):]] = path
+    return videos
+
+
+class RunReader(object):
+    def __init__(self, take_path, rid, cam_names=None, transform=None, queue_size=32, strict=True):
+        """ cam_names selects and orders the cameras, by default all cameras of the run are used.
+            With strict, videos of different length raise a ValueError, otherwise reading stops with the shortest. """
+        videos = find_run_videos(take_path, rid)
+        if cam_names is None:
+            cam_names = sorted(videos.keys(), key=_natural_key)
+        missing = [c for c in cam_names if c not in videos]
+        assert len(missing) == 0, 'No video of run %d for cameras %s in %s' % (rid, missing, take_path)
+        assert len(cam_names) > 0, 'Run %d has no videos in %s' % (rid, take_path)
+
+        self.take_path = take_path
+        self.rid = rid
+        self.cam_names = list(cam_names)
+        self.video_paths = [videos[c] for c in self.cam_names]
+        self.strict = strict
+        self.readers = [VideoReaderFast(p, transform=transform, queue_size=queue_size) for p in self.video_paths]
+
+        sizes = [r.get_size() for r in self.readers]
+        if len(set(sizes)) > 1:
+            msg = 'Videos of run %d differ in length: %s' % (rid, ', '.join(['%s=%d' % x for x in zip(self.cam_names, sizes)]))
+            if strict:
+                raise ValueError(msg)
+            print('WARNING: %s. Reading %d frames.' % (msg, min(sizes)))
+        self.num_frames = min(sizes)
+        self.frame_index = 0
+        self._check_meta()
+
+    def _check_meta(self):
+        """ Frames are aligned by position, which is only right as long as no camera skipped a trigger. """
+        meta = load_run_meta(self.take_path, self.rid)
+        for cam_name in self.cam_names:
+            if cam_name not in meta or len(meta[cam_name]) == 0:
+                continue
+            skipped = np.nonzero(meta[cam_name]['num_skipped'])[0]
+            if len(skipped) > 0:
+                print('WARNING: %s skipped %d frames, starting at frame %d. Later frames are not aligned.' % (
+                    cam_name, int(meta[cam_name]['num_skipped'].sum()), skipped[0]))
+
+    def __len__(self):
+        return self.num_frames
+
+    def start(self):
+        for r in self.readers:
+            r.start()
+        return self
+
+    def read(self):
+        """ Returns the frames of all cameras for the next time step as tuple or None after the last one. """
+        if self.frame_index >= self.num_frames:
+            return None
+        frames = tuple(r.read() for r in self.readers)
+        if any(f is None for f in frames):
+            ended = [c for c, f in zip(self.cam_names, frames) if f is None]
+            raise ValueError('Videos of %s ended at frame %d, before the others.' % (', '.join(ended), self.frame_index))
+        self.frame_index += 1
+        return frames
+
+    def read_stacked(self, out=None):
+        """ Like read(), but returns a (num_cams, H, W, C) array. Pass out to reuse an array. """
+        frames = self.read()
+        if frames is None:
+            return None
+        if out is None:
+            out = np.empty((len(frames),) + frames[0].shape, dtype=frames[0].dtype)
+        for i, frame in enumerate(frames):
+            out[i] = frame
+        return out
+
+    def __iter__(self):
+        while True:
+            frames = self.read()
+            if frames is None:
+                break
+            yield frames
+
+    def stop(self):
+        for r in self.readers:
+            r.stop()
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+    reader = RunReader(sys.argv[1], int(sys.argv[2])).start()
+    print('Reading %d frames of %s' % (len(reader), ', '.join(reader.cam_names)))
+    start = time.time()
+    stack = None
+    while True:
+        stack = reader.read_stacked(out=stack)
+        if stack is None:
+            break
+    reader.stop()
+    print('%.1f time steps per sec' % (len(reader) / (time.time() - start)))
@@ -0,0 +1,99 @@
+"""
+    Ring of frame buffers in shared memory, to hand frames from one process to another without pickling them.
+
+    There is exactly one producer and one consumer. The producer fills the buffer returned by acquire() and
+    calls commit(), the consumer reads peek() and calls release() afterwards. Both sides only advance their own
+    counter, which lives in the shared memory header together with a few statistics.
+"""
+import numpy as np
+from multiprocessing import shared_memory
+
+
+def _attach_shared_memory(name):
+    """ Attach to an existing block, its lifetime stays with the process that created it. """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # python < 3.13 always tracks the block. Child processes share the resource tracker of their parent,
+        # which already knows the block, so this does not change when it is unlinked.
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedRingBuffer(object):
+    _header_bytes = 64
+
+    # int64 header fields
+    WRITE_COUNT, READ_COUNT, CLOSED = 0, 1, 2
+    # float64 header fields
+    WRITE_SPEED = 0
+
+    def __init__(self, num_slots, shape, dtype=np.uint8, name=None):
+        self.num_slots = num_slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=self._header_bytes + num_slots * frame_bytes)
+        else:
+            self.shm = _attach_shared_memory(name)
+
+        self._counters = np.ndarray((4,), dtype=np.int64, buffer=self.shm.buf, offset=0)
+        self.stats = np.ndarray((4,), dtype=np.float64, buffer=self.shm.buf, offset=32)
+        self.buffers = np.ndarray((num_slots,) + self.shape, dtype=self.dtype,
+                                  buffer=self.shm.buf, offset=self._header_bytes)
+        if self.owner:
+            self._counters[:] = 0
+            self.stats[:] = 0.0
+
+    def describe(self):
+        """ Arguments needed to attach to this ring from another process. """
+        return self.num_slots, self.shape, self.dtype.str, self.shm.name
+
+    @classmethod
+    def attach(cls, num_slots, shape, dtype, name):
+        return cls(num_slots, shape, dtype, name=name)
+
+    def num_used(self):
+        return int(self._counters[self.WRITE_COUNT] - self._counters[self.READ_COUNT])
+
+    def acquire(self):
+        """ Producer: Returns the next free slot and its buffer or (None, None) if the ring is full. """
+        write_count = int(self._counters[self.WRITE_COUNT])
+        if write_count - self._counters[self.READ_COUNT] >= self.num_slots:
+            return None, None
+        slot = write_count % self.num_slots
+        return slot, self.buffers[slot]
+
+    def commit(self):
+        """ Producer: Hands the buffer returned by the last acquire() to the consumer. """
+        self._counters[self.WRITE_COUNT] += 1
+
+    def peek(self):
+        """ Consumer: Returns the oldest committed frame or None if there is none. """
+        read_count = int(self._counters[self.READ_COUNT])
+        if read_count >= self._counters[self.WRITE_COUNT]:
+            return None
+        return self.buffers[read_count % self.num_slots]
+
+    def release(self):
+        """ Consumer: Frees the frame returned by peek(). """
+        self._counters[self.READ_COUNT] += 1
+
+    def set_closed(self):
+        self._counters[self.CLOSED] = 1
+
+    def is_closed(self):
+        return self._counters[self.CLOSED] > 0
+
+    def close(self):
+        # views into the block have to be gone before it can be closed
+        self._counters, self.stats, self.buffers = None, None, None
+        try:
+            self.shm.close()
+        except BufferError:
+            # frames handed out are still referenced somewhere, the mapping goes away together with them
+            pass
+        if self.owner:
+            self.shm.unlink()
@@ -3,8 +3,21 @@
 
     Author: czimmerm@adobe.com
 """
+import cv2
 import numpy as np
-import scipy.misc
+
+
+def imread(path):
+    """ Reads an image as RGB. """
+    return cv2.imread(path)[:, :, ::-1]
+
+
+def imresize(img, size):
+    """ Resizes an image to size = (height, width), keeping its number of channels. """
+    out = cv2.resize(img, (int(size[1]), int(size[0])), interpolation=cv2.INTER_LINEAR)
+    if len(img.shape) == 3 and len(out.shape) == 2:
+        out = np.expand_dims(out, 2)
+    return out
 
 
 class StitchedImage(object):
@@ -14,7 +27,7 @@ class StitchedImage(object):
         self.images = list()
         for img in image_list:
             if type(img) == str:
-                img = scipy.misc.imread(img)
+                img = imread(img)
             else:
                 img = np.copy(img)
 
@@ -35,7 +48,7 @@ class StitchedImage(object):
             target_size = (800, 1000)
 
         self._global_scale = np.array(target_size[:2], dtype=np.float32) / np.array(self.image.shape[:2], dtype=np.float32)
-        self.image = scipy.misc.imresize(self.image, target_size)
+        self.image = imresize(self.image, target_size)
 
     @staticmethod
     def _calc_stack_shape(num_samples):
@@ -85,7 +98,7 @@ class StitchedImage(object):
 
                 self._subframe_img_id_map[v_shape, h_shape] = i
                 self._subframe_scales[i] = np.array(self._common_shape[:2], dtype=np.float32) / np.array(self.images[i].shape[:2], dtype=np.float32)
-                img = scipy.misc.imresize(self.images[i], self._common_shape)
+                img = imresize(self.images[i], self._common_shape)
                 img_list_v.append(img)
                 i += 1
 
@@ -161,14 +174,14 @@ if __name__ == '__main__':
     import matplotlib.pyplot as plt
     fig = plt.figure(1)
     ax = fig.add_subplot(111)
-    ax.imshow(scipy.misc.imread(img_list[1]))
+    ax.imshow(imread(img_list[1]))
     ax.plot(pt_cam1[0], pt_cam1[1], "ro")
     plt.show(block=False)
 
     import matplotlib.pyplot as plt
     fig = plt.figure(2)
     ax = fig.add_subplot(111)
-    ax.imshow(scipy.misc.imread(img_list[3]))
+    ax.imshow(imread(img_list[3]))
     ax.plot(pt_cam2[0], pt_cam2[1], "bo")
     plt.show(block=False)
 
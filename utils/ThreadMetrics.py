@@ -0,0 +1,44 @@
+"""
+    Where a worker thread spends its time.
+
+    A thread blocked on a queue should neither use CPU nor take long to wake up once there is work, and a writer
+    should be done shortly after its last frame arrived. These numbers tell whether that is the case.
+"""
+import time
+
+
+class ThreadMetrics(object):
+    def __init__(self):
+        self.idle_time = 0.0  # sec spent waiting for work
+        self.idle_cpu = 0.0  # CPU sec used while waiting, should stay close to zero
+        self.num_wakeups = 0
+        self.wake_latency = None  # smoothed sec from work being available to the thread picking it up
+        self.max_wake_latency = 0.0
+        self.time_to_drain = None  # sec it took to finish all work once asked to
+        self._wait_start = None
+
+    def begin_wait(self):
+        self._wait_start = time.time(), time.thread_time()
+
+    def end_wait(self):
+        wall, cpu = self._wait_start
+        self.idle_time += time.time() - wall
+        self.idle_cpu += time.thread_time() - cpu
+
+    def woke(self, since):
+        """ The thread picked up work that became available at time since. """
+        latency = max(0.0, time.time() - since)
+        self.num_wakeups += 1
+        self.max_wake_latency = max(self.max_wake_latency, latency)
+        if self.wake_latency is None:
+            self.wake_latency = latency
+        else:
+            self.wake_latency = 0.85*self.wake_latency + 0.15*latency
+
+    def get_state(self):
+        state = ' Idle %.1f sec (CPU %.1f ms);' % (self.idle_time, self.idle_cpu * 1000.0)
+        if self.wake_latency is not None:
+            state += ' Wake %.2f ms (max %.2f ms);' % (self.wake_latency * 1000.0, self.max_wake_latency * 1000.0)
+        if self.time_to_drain is not None:
+            state += ' Drain %.0f ms;' % (self.time_to_drain * 1000.0)
+        return state
@@ -1,31 +1,73 @@
 # import the necessary packages
-from threading import Thread
+from threading import Thread, Lock
+import bisect
 import sys
 import cv2
 import time
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.ThreadMetrics import ThreadMetrics
+from utils.KeyframeIndex import load_keyframe_index
 
 # import the Queue class from Python 3
 if sys.version_info >= (3, 0):
-    from queue import Queue
+    from queue import Queue, Empty
 
 # otherwise, import the Queue class for Python 2.7
 else:
-    from Queue import Queue
+    from Queue import Queue, Empty
+
+
+_END = None  # put into the queue after the last frame
 
 
 class VideoReaderFast:
-    def __init__(self, path, transform=None, queue_size=128):
+    def __init__(self, path, transform=None, queue_size=128, batch_size=None, frame_size=None, dtype=np.uint8,
+                 num_workers=0):
+        """ With batch_size the reader thread decodes into pooled (batch_size, H, W, C) arrays of dtype, read them
+            with read_array(). frame_size=(width, height) resizes frames on the way, also for read_into().
+            num_workers > 0 runs transform and resize on a thread pool, frames still come out in order. """
         # initialize the file video stream along with the boolean
         # used to indicate if the thread should be stopped or not
+        self.path = path
         self.stream = cv2.VideoCapture(path)
         self.stopped = False
         self.transform = transform
+        self.batch_size = batch_size
+        self.frame_size = None if frame_size is None else tuple(frame_size)
+        self.dtype = np.dtype(dtype)
+        self._scratch = None  # decoded frame, when it can not be decoded into the output directly
+
+        # transform workers, at most 2 x num_workers frames are in flight between decoding and the queue
+        self.num_workers = num_workers
+        self._executor = ThreadPoolExecutor(num_workers) if num_workers > 0 else None
+        self._max_pending = 2 * num_workers
+        self._num_decoded = 0
+        self._decode_time = 0.0
+        self._transform_time = 0.0  # summed over all workers
 
         # initialize the queue used to store frames read from
         # the video file
         self.Q = Queue(maxsize=queue_size)
+        self._next = None  # frame taken from the queue by more(), but not read() yet
+        self._ended = False
+        self._last_get = 0.0
+
+        # batches: arrays are handed out by index and come back through the free queue
+        self._buffers = list()
+        self._free = Queue()
+        self._held = None  # index of the buffer the consumer got last
+        self.metrics = ThreadMetrics()
+
+        # random access uses its own capture, so it does not disturb reading in order
+        self._keyframes = None
+        self._seek_stream = None
+        self._seek_pos = None  # index of the frame the seek stream decodes next
+        self._seek_lock = Lock()
         # intialize thread
-        self.thread = Thread(target=self.update, args=())
+        self.thread = Thread(target=self.update if batch_size is None else self.update_batches, args=())
         self.thread.daemon = True
 
     def start(self):
@@ -34,49 +76,201 @@ class VideoReaderFast:
         return self
 
     def update(self):
+        # frames being transformed by the workers, oldest first. Taking results from the left keeps the order
+        pending = deque()
         # keep looping infinitely
-        while True:
-            # if the thread indicator variable is set, stop the
-            # thread
-            if self.stopped:
+        while not self.stopped:
+            # read the next frame from the file
+            t = time.time()
+            (grabbed, frame) = self.stream.read()
+            self._decode_time += time.time() - t
+
+            # if the `grabbed` boolean is `False`, then we have
+            # reached the end of the video file
+            if not grabbed:
                 break
+            self._num_decoded += 1
 
-            # otherwise, ensure the queue has room in it
-            if not self.Q.full():
-                # read the next frame from the file
-                (grabbed, frame) = self.stream.read()
+            # if there are transforms to be done, might as well
+            # do them on producer thread before handing back to
+            # consumer thread. ie. Usually the producer is so far
+            # ahead of consumer that we have time to spare.
+            #
+            # Python is not parallel but the transform operations
+            # are usually OpenCV native so release the GIL.
+            #
+            # Transforms that take longer than decoding, like
+            # undistortion, make this thread the bottleneck. Then
+            # set num_workers and they run on a thread pool.
+            if self._executor is None:
+                self._put(self._transform(frame))
+            else:
+                pending.append(self._executor.submit(self._transform, frame))
+                while len(pending) >= self._max_pending and not self.stopped:
+                    self._put(pending.popleft().result())
 
-                # if the `grabbed` boolean is `False`, then we have
-                # reached the end of the video file
-                if not grabbed:
-                    self.stopped = True
-                    break
+        while pending and not self.stopped:
+            self._put(pending.popleft().result())
+        self.stopped = True
+        self.Q.put(_END)
+        self.stream.release()
+
+    def _transform(self, frame):
+        """ Applies transform and resize, returns (frame, seconds it took). """
+        t = time.time()
+        if self.transform:
+            frame = self.transform(frame)
+        if self.frame_size is not None and (frame.shape[1], frame.shape[0]) != self.frame_size:
+            frame = cv2.resize(frame, self.frame_size, interpolation=cv2.INTER_AREA)
+        return frame, time.time() - t
+
+    def _put(self, result):
+        frame, transform_time = result
+        self._transform_time += transform_time
+        # add the frame to the queue, blocks while it is full
+        waited = self.Q.full()
+        self.metrics.begin_wait()
+        self.Q.put(frame)
+        self.metrics.end_wait()
+        if waited and not self.stopped:
+            self.metrics.woke(self._last_get)
+
+    def _store(self, frame, out):
+        """ Transforms a decoded frame into out, returns the seconds it took. """
+        t = time.time()
+        if self.transform:
+            frame = self.transform(frame)
+        if self.frame_size is not None and (frame.shape[1], frame.shape[0]) != self.frame_size:
+            if frame.dtype == out.dtype and frame.ndim == out.ndim:
+                cv2.resize(frame, self.frame_size, dst=out, interpolation=cv2.INTER_AREA)
+                return time.time() - t
+            frame = cv2.resize(frame, self.frame_size, interpolation=cv2.INTER_AREA)
+        np.copyto(out, frame.reshape(out.shape), casting='unsafe')
+        return time.time() - t
+
+    def _decode_into(self, stream, out):
+        """ Decodes the next frame of stream into out, an (H, W, C) array. Returns False at the end. """
+        direct = self.transform is None and out.dtype == np.uint8 and self.frame_size is None
+        t = time.time()
+        grabbed, frame = stream.read(out if direct else self._scratch)
+        self._decode_time += time.time() - t
+        if not grabbed:
+            return False
+        self._num_decoded += 1
+        if direct:
+            if frame.__array_interface__['data'][0] != out.__array_interface__['data'][0]:
+                np.copyto(out, frame)  # out is not contiguous, OpenCV decoded into a new array
+            return True
+        self._scratch = frame
+        self._transform_time += self._store(frame, out)
+        return True
+
+    def _decode_batch(self, buffer, count):
+        """ Fills buffer from row count on, returns the number of rows filled. With workers the rows are transformed
+            in parallel while the next frames are decoded. """
+        if self._executor is None or (self.transform is None and self.frame_size is None):
+            while count < len(buffer) and self._decode_into(self.stream, buffer[count]):
+                count += 1
+            return count
+
+        pending = list()
+        while count < len(buffer):
+            t = time.time()
+            grabbed, frame = self.stream.read()
+            self._decode_time += time.time() - t
+            if not grabbed:
+                break
+            self._num_decoded += 1
+            pending.append(self._executor.submit(self._store, frame, buffer[count]))
+            count += 1
+        for future in pending:
+            self._transform_time += future.result()
+        return count
 
-                # if there are transforms to be done, might as well
-                # do them on producer thread before handing back to
-                # consumer thread. ie. Usually the producer is so far
-                # ahead of consumer that we have time to spare.
-                #
-                # Python is not parallel but the transform operations
-                # are usually OpenCV native so release the GIL.
-                #
-                # Really just trying to avoid spinning up additional
-                # native threads and overheads of additional
-                # producer/consumer queues since this one was generally
-                # idle grabbing frames.
-                if self.transform:
-                    frame = self.transform(frame)
-
-                # add the frame to the queue
-                self.Q.put(frame)
+    def _new_buffer(self, stream):
+        """ Decodes the first frame to learn the shape and returns a new batch array holding it, or None at the end. """
+        grabbed, frame = stream.read()
+        if not grabbed:
+            return None
+        self._num_decoded += 1
+        frame, transform_time = self._transform(frame)
+        self._transform_time += transform_time
+        if frame.ndim == 2:
+            frame = frame[:, :, None]
+        buffer = np.empty((self.batch_size,) + frame.shape, dtype=self.dtype)
+        np.copyto(buffer[0], frame, casting='unsafe')
+        return buffer
+
+    def update_batches(self):
+        # like update(), but frames are decoded straight into pooled batch arrays and a whole batch is one queue item
+        num_buffers = max(2, self.Q.maxsize // self.batch_size) + 1  # one is held by the consumer
+        while not self.stopped:
+            if len(self._buffers) < num_buffers:
+                buffer = self._new_buffer(self.stream)
+                if buffer is None:
+                    break
+                self._buffers.append(buffer)
+                slot, count = len(self._buffers) - 1, 1
             else:
-                time.sleep(0.1)  # Rest for 10ms, we have a full queue
+                waited = self._free.empty()
+                self.metrics.begin_wait()
+                slot = self._free.get()  # None is put by stop()
+                self.metrics.end_wait()
+                if slot is None or self.stopped:
+                    break
+                if waited and not self.stopped:
+                    self.metrics.woke(self._last_get)
+                count = 0
+
+            count = self._decode_batch(self._buffers[slot], count)
+            if count > 0:
+                self.Q.put((slot, count))
+            if count < self.batch_size:
+                break
 
+        self.stopped = True
+        self.Q.put(_END)
         self.stream.release()
 
+    def read_array(self):
+        """ Returns the next batch as (n, H, W, C) array, n is batch_size except for the last batch. None once all
+            frames were read. The array is a view of a pooled buffer and is reused by the next call, so copy what you
+            want to keep. """
+        assert self.batch_size is not None, 'read_array() needs a reader created with batch_size'
+        if self._held is not None:
+            self._free.put(self._held)
+            self._held = None
+        item = self.read()
+        if item is None:
+            return None
+        self._held, count = item
+        return self._buffers[self._held][:count]
+
+    def read_into(self, out):
+        """ Decodes the next len(out) frames straight into out, an (n, H, W, C) array of any dtype, e.g. a pinned
+            tensor's numpy view. Does not use the reader thread, so do not start() it. Returns the view of out that
+            was filled, shorter than out at the end of the video. """
+        assert not self.thread.is_alive(), 'read_into() reads on the calling thread, do not start() the reader'
+        count = 0
+        while count < len(out) and self._decode_into(self.stream, out[count]):
+            count += 1
+        return out[:count]
+
+    def _get(self):
+        if self._next is not None:
+            frame, self._next = self._next, None
+            return frame
+        frame = self.Q.get()
+        self._last_get = time.time()
+        if frame is _END:
+            self._ended = True
+        return frame
+
     def read(self):
-        # return next frame in the queue
-        return self.Q.get()
+        # return next frame in the queue, None once all frames were read
+        if self._ended:
+            return None
+        return self._get()
 
     # Insufficient to have consumer use while(more()) which does
     # not take into account if the producer has reached end of
@@ -85,19 +279,82 @@ class VideoReaderFast:
         return self.more() or not self.stopped
 
     def more(self):
-        # return True if there are still frames in the queue. If stream is not stopped, try to wait a moment
-        tries = 0
-        while self.Q.qsize() == 0 and not self.stopped and tries < 5:
-            time.sleep(0.1)
-            tries += 1
-
-        return self.Q.qsize() > 0
+        # return True if there is another frame. Blocks until the reader thread got one or reached the end
+        if self._ended:
+            return False
+        if self._next is None:
+            self._next = self._get()
+        return not self._ended
 
     def stop(self):
-        # indicate that the thread should be stopped
+        # indicate that the thread should be stopped and unblock it, in case it waits for room in the queue
+        start = time.time()
         self.stopped = True
-        # wait until stream resources are released (producer thread might be still grabbing frame)
-        self.thread.join()
+        if self.batch_size is not None:
+            self._free.put(None)  # wakes the thread if it waits for a free buffer
+        if self.thread.is_alive():
+            while self.thread.is_alive():
+                try:
+                    self.Q.get(timeout=0.01)
+                except Empty:
+                    pass
+            self.thread.join()
+        if self._executor is not None:
+            self._executor.shutdown()
+        self.stream.release()
+        if self._seek_stream is not None:
+            self._seek_stream.release()
+        self._ended = True
+        self.metrics.time_to_drain = time.time() - start
 
     def get_size(self):
+        index = self.keyframe_index()
+        if index['num_frames'] is not None:
+            return index['num_frames']
         return int(self.stream.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    def keyframe_index(self):
+        """ Keyframes of the video, built on first use and stored next to it (see utils/KeyframeIndex.py). """
+        if self._keyframes is None:
+            self._keyframes = load_keyframe_index(self.path)
+        return self._keyframes
+
+    def read_at(self, index):
+        """ Returns frame index, decoding from the keyframe before it. """
+        return self.read_batch([index])[0]
+
+    def read_batch(self, indices):
+        """ Returns the frames at indices in the given order. Requests are served in sorted order, so frames of the
+            same group of pictures are decoded in one pass. Negative indices are not supported. """
+        for i in indices:
+            if i < 0:
+                raise IndexError('Frame %d out of range, indices start at 0.' % i)
+        keyframes = self.keyframe_index()['keyframes']
+        frames = dict()
+        with self._seek_lock:
+            if self._seek_stream is None:
+                self._seek_stream = cv2.VideoCapture(self.path)
+                self._seek_pos = 0
+
+            for i in sorted(set(indices)):
+                keyframe = keyframes[bisect.bisect_right(keyframes, i) - 1]
+                if self._seek_pos > i or keyframe > self._seek_pos:
+                    # going back or there is a keyframe between us and the frame: seek instead of decoding
+                    self._seek_stream.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+                    self._seek_pos = keyframe
+                while self._seek_pos < i:
+                    self._seek_stream.grab()
+                    self._seek_pos += 1
+
+                grabbed, frame = self._seek_stream.read()
+                if not grabbed:
+                    raise IndexError('Could not read frame %d of %s' % (i, self.path))
+                self._seek_pos += 1
+                frames[i], _ = self._transform(frame)
+        return [frames[i] for i in indices]
+
+    def get_state(self):
+        per_frame = 1000.0 / max(self._num_decoded, 1)
+        stages = ' Decode %.1f ms, transform %.1f ms per frame (%d workers);' % (
+            self._decode_time * per_frame, self._transform_time * per_frame, self.num_workers)
+        return 'Queue %d/%d;' % (self.Q.qsize(), self.Q.maxsize) + stages + self.metrics.get_state()
@@ -1,16 +1,25 @@
 # import the necessary packages
 from threading import Thread
+import os
 import sys
 import cv2
+import json
 import time
+import numpy as np
+
+from utils.FramePool import FramePool
+from utils.ThreadMetrics import ThreadMetrics
+from utils.PixelFormat import to_bgr, ffmpeg_pix_fmt
+from utils.FFmpegStream import FFmpegStream
+from utils.FrameStore import FrameStoreWriter, is_lossless
 
 # import the Queue class from Python 3
 if sys.version_info >= (3, 0):
-    from queue import Queue
+    from queue import Queue, Empty, Full
 
 # otherwise, import the Queue class for Python 2.7
 else:
-    from Queue import Queue
+    from Queue import Queue, Empty, Full
 
 
 class QueueOverflow(Exception):
@@ -21,17 +30,100 @@ class codec_t:
     divx = 'DIVX'
     x264 = 'X264'
     mjpg = 'MJPG'
+    raw = 'RAW'  # no encoding, see utils/RawVideo.py and transcode_raw.py
+    ffmpeg = 'FFMPEG'  # encoding in an ffmpeg process, see utils/FFmpegStream.py and params_t.ffmpeg_*
+    frames = 'FRAMES'  # every frame compressed on its own for random access, see utils/FrameStore.py and params_t.frames_*
+
+
+class overflow_t:
+    """ What a writer does with a frame it has no room for. """
+    error = 'error'  # raise QueueOverflow
+    block = 'block'  # wait up to overflow_timeout for room, drop the frame if there is none by then
+    drop_newest = 'drop_newest'  # drop the frame that does not fit
+    drop_oldest = 'drop_oldest'  # drop the oldest frame waiting to be written to make room
+    duplicate = 'duplicate'  # drop the frame that does not fit, but write the previous one again to keep timing
+
+
+def file_extension(codec, ffmpeg_container='mp4'):
+    """ Extension of the videos written with codec. """
+    if codec == codec_t.ffmpeg:
+        return ffmpeg_container
+    if codec == codec_t.frames:
+        return 'frames'
+    return 'avi'
+
+
+def open_stream(video_path, fps, codec, frame_size, pixel_format, stream_options=None):
+    """ Returns an encoder for frames of frame_size (width, height) and the pixel format it expects them in.
+        ffmpeg and lossless frame stores take the native format of the camera, cv2.VideoWriter wants BGR8.
+        stream_options are passed on to FFmpegStream or FrameStoreWriter.
+    """
+    options = dict() if stream_options is None else stream_options
+    if codec == codec_t.frames:
+        if not is_lossless(options.get('compression', 'jpg')) and pixel_format != 'Mono8':
+            pixel_format = 'BGR8'
+        channels = (3,) if pixel_format in ['BGR8', 'RGB8'] else ()
+        shape = (frame_size[1], frame_size[0]) + channels
+        return FrameStoreWriter(video_path, fps, shape, pixel_format=pixel_format, **options), pixel_format
+
+    if codec == codec_t.ffmpeg:
+        if ffmpeg_pix_fmt(pixel_format) is None:
+            pixel_format = 'BGR8'
+        return FFmpegStream(video_path, fps, frame_size, input_pix_fmt=ffmpeg_pix_fmt(pixel_format), **options), pixel_format
+
+    stream = cv2.VideoWriter(video_path,
+                             cv2.VideoWriter_fourcc(*codec),
+                             fps,
+                             frame_size)
+    return stream, 'BGR8'
+
+
+class OverflowCounter(object):
+    """ Indices of the frames affected by the overflow policy of a writer. Frames are counted in the order they were fed. """
+    def __init__(self, policy):
+        self.policy = policy
+        self.dropped = list()
+        self.duplicated = list()
+        self.blocked = list()
+        self.blocked_time = 0.0
+
+    def num_lost(self):
+        return len(self.dropped) + len(self.duplicated)
+
+    def get_state(self):
+        return ' Dropped %d, duplicated %d, blocked %d (%.2f sec);' % (len(self.dropped), len(self.duplicated),
+                                                                       len(self.blocked), self.blocked_time)
+
+    def save(self, path):
+        with open(path, 'w') as fo:
+            json.dump({'policy': self.policy,
+                       'dropped': self.dropped,
+                       'duplicated': self.duplicated,
+                       'blocked': self.blocked,
+                       'blocked_time': self.blocked_time}, fo)
 
 
 """
     Utility for faster Video writing with OpenCV.
     Basically runs writing of frames in an separate thread.
+
+    Frames can either be fed directly or written into a buffer taken from the writers frame pool
+    with acquire() first. Pool buffers are recycled once they are written.
+    Frames are converted from pixel_format (see utils/PixelFormat.py) to BGR right before encoding.
+    When the writer can not keep up, overflow_policy (see overflow_t) decides what happens to new frames.
+    With a MemoryGovernor (see utils/MemoryGovernor.py) the frames waiting to be written are limited by the RAM
+    budget shared by all writers instead of queue_size, the pool grows beyond pool_size as long as there is room.
 """
 class VideoWriterFast:
-    def __init__(self, video_path, fps, codec, queue_size=128):
+    def __init__(self, video_path, fps, codec, queue_size=128, pool_size=32, pixel_format='BGR8',
+                 overflow_policy=overflow_t.error, overflow_timeout=0.1, governor=None, stream_options=None):
         self.fps = fps
         self.codec = codec
         self.video_path = video_path
+        self.pixel_format = pixel_format
+        self.stream_options = stream_options
+        self._stream_format = None  # pixel format the stream expects
+        self._bgr_frame = None  # reused for conversion into BGR
 
         # initialize the file video stream along with the boolean
         # used to indicate if the thread should be stopped or not
@@ -41,11 +133,27 @@ class VideoWriterFast:
         self.started = False
 
         self.write_speed = None
+        self.error = None  # set when writing failed, frames fed afterwards are discarded
 
         # initialize the queue used to store frames read from
         # the video file
-        self.queue_size = queue_size
-        self.Q = Queue(maxsize=queue_size)
+        self.governor = governor
+        if governor is not None:
+            governor.register(os.path.basename(video_path))
+        self.queue_size = queue_size if governor is None else 0  # with a governor the pool bounds the queue
+        self.Q = Queue(maxsize=self.queue_size)
+
+        # preallocated frame buffers, created once the frame shape is known
+        self.pool_size = pool_size
+        self.pool = None
+
+        self.num_frames = 0  # frames fed so far, including the ones lost to overflow
+        self.overflow = OverflowCounter(overflow_policy)
+        self.overflow_timeout = overflow_timeout
+        self._last_frame = None  # last written frame, kept for overflow_t.duplicate
+        self._last_slot = None
+        self._last_copy = None  # our copy of the last frame, if it was neither in the pool nor converted
+        self.metrics = ThreadMetrics()
         # intialize thread
         self.thread = Thread(target=self.update, args=())
         self.thread.daemon = True
@@ -57,74 +165,205 @@ class VideoWriterFast:
         return self
 
     def update(self):
-        # keep looping infinitely
         while True:
-            # if the thread indicator variable is set, stop the
-            # thread
-            if self.stopped:
+            # block until there is a frame, None tells us to stop once everything before it was written
+            waited = self.Q.qsize() == 0
+            self.metrics.begin_wait()
+            item = self.Q.get()
+            self.metrics.end_wait()
+            if item is None:
+                self.Q.task_done()
                 break
+            frame, slot, _, put_time = item
+            if waited:
+                self.metrics.woke(put_time)
 
-            # otherwise, ensure the there is something in the queue and the stream was initialized
-            if self.Q.qsize() > 0 and self.stream is not None:
-                # get the next frame from the queue
-                frame = self.Q.get()
+            try:
+                if self.error is not None:
+                    # the stream is broken, only give the frames back so nobody waits for them
+                    if slot is not None:
+                        self.pool.release(slot)
+                    continue
 
                 start = time.time()
+                if frame is None:
+                    # there was no room for this frame, so repeat the previous one
+                    if self._last_frame is not None:
+                        self.stream.write(self._last_frame)
+                    continue
+
                 # write to stream
-                self.stream.write(frame)
+                if self._stream_format == self.pixel_format:
+                    out_frame = frame
+                else:
+                    out_frame = to_bgr(frame, self.pixel_format, dst=self._bgr_frame)
+                    if out_frame is not frame:
+                        self._bgr_frame = out_frame
+                self.stream.write(out_frame)
+                self._recycle(out_frame, frame, slot)
                 if self.write_speed is None:
                     self.write_speed = time.time() - start
                 else:
                     self.write_speed = 0.85*self.write_speed + 0.15*(time.time() - start)
+            except Exception as e:
+                # e.g. ffmpeg exited, the grabber notices and stops the recording
+                self.error = e
+                if slot is not None:
+                    self.pool.release(slot)
+            finally:
+                self.Q.task_done()
+
+        if self.stream is not None:
+            self.stream.release()
 
+    def _recycle(self, out_frame, frame, slot):
+        """ Gives a written frame back to the pool, with overflow_t.duplicate the last one is kept. """
+        if self.overflow.policy != overflow_t.duplicate:
+            if slot is not None:
+                self.pool.release(slot)
+            return
+
+        if self._last_slot is not None:
+            self.pool.release(self._last_slot)
+        self._last_frame, self._last_slot = out_frame, None
+        if slot is not None:
+            if out_frame is frame:
+                self._last_slot = slot
+            else:
+                self.pool.release(slot)
+        elif out_frame is frame:
+            # the array belongs to the caller and may be reused
+            if self._last_copy is None:
+                self._last_copy = frame.copy()
+            else:
+                np.copyto(self._last_copy, frame)
+            self._last_frame = self._last_copy
+
+    def _on_overflow(self, index, make_room):
+        """ Applies the overflow policy to frame index, which found no room.
+            make_room(timeout) waits up to timeout sec for room and returns what it got or None. """
+        policy = self.overflow.policy
+        if policy == overflow_t.error:
+            raise QueueOverflow
+
+        result = None
+        if policy == overflow_t.block:
+            start = time.time()
+            result = make_room(self.overflow_timeout)
+            self.overflow.blocked.append(index)
+            self.overflow.blocked_time += time.time() - start
+
+        elif policy == overflow_t.drop_oldest:
+            try:
+                frame, slot, oldest, _ = self.Q.get_nowait()
+                self.Q.task_done()
+                if slot is not None:
+                    self.pool.release(slot)
+                self.overflow.dropped.append(oldest)
+                result = make_room(self.overflow_timeout)
+            except Empty:
+                pass
+
+        if result is None:
+            if policy == overflow_t.duplicate and not self.Q.full():
+                self.Q.put((None, None, index, time.time()))
+                self.overflow.duplicated.append(index)
             else:
-                time.sleep(0.001)  # Rest for 10ms, we have an empty queue
+                self.overflow.dropped.append(index)
+        return result
+
+    def acquire(self, shape, dtype=np.uint8):
+        """ Returns a free slot of the frame pool and its buffer, which should be filled and passed on to feed().
+            Returns (None, None) if the overflow policy decided to drop this frame. """
+        if self.pool is None or not self.pool.fits(shape, dtype):
+            # with overflow_t.duplicate the writer holds on to one extra frame
+            pool_size = self.pool_size + 1 if self.overflow.policy == overflow_t.duplicate else self.pool_size
+            if self.pool is not None:
+                self.pool.close()
+            self.pool = FramePool(pool_size, shape, dtype, governor=self.governor,
+                                  name=os.path.basename(self.video_path))
+
+        index = self.num_frames
+        self.num_frames += 1
+        slot, frame = self.pool.acquire()
+        if slot is None:
+            def make_room(timeout):
+                slot, frame = self.pool.acquire(timeout)
+                return None if slot is None else (slot, frame)
 
-        self.stream.release()
+            result = self._on_overflow(index, make_room)
+            if result is None:
+                return None, None
+            slot, frame = result
+        return slot, frame
 
-    def feed(self, frame):
+    def feed(self, frame, slot=None):
         if self.stream is None:
-            self.stream = cv2.VideoWriter(self.video_path,
-                                          cv2.VideoWriter_fourcc(*self.codec),
-                                          self.fps,
-                                          (frame.shape[1], frame.shape[0]))
+            self.stream, self._stream_format = open_stream(self.video_path, self.fps, self.codec,
+                                                           (frame.shape[1], frame.shape[0]),
+                                                           self.pixel_format, self.stream_options)
 
         if not self.started:
             self.start()
 
-        if not self.Q.full():
-            # add the frame to the queue
-            return self.Q.put(frame)
+        if slot is None:
+            index = self.num_frames
+            self.num_frames += 1
         else:
-            raise QueueOverflow
+            # frames from the pool were counted by acquire()
+            index = self.num_frames - 1
+
+        try:
+            # add the frame to the queue
+            return self.Q.put_nowait((frame, slot, index, time.time()))
+        except Full:
+            def make_room(timeout):
+                try:
+                    self.Q.put((frame, slot, index, time.time()), timeout=timeout)
+                    return True
+                except Full:
+                    return None
+
+            try:
+                if self._on_overflow(index, make_room) is None and slot is not None:
+                    self.pool.release(slot)
+            except QueueOverflow:
+                if slot is not None:
+                    self.pool.release(slot)
+                raise
 
-    # Insufficient to have consumer use while(more()) which does
-    # not take into account if the producer has reached end of
-    # file stream.
     def running(self):
         return self.is_active() or not self.stopped
 
     def is_active(self):
-        # return True if there are still frames in the queue. If stream is not stopped, try to wait a moment
-        tries = 0
-        while self.Q.qsize() == 0 and not self.stopped and tries < 5:
-            time.sleep(0.1)
-            tries += 1
-
-        return self.Q.qsize() > 0
+        # return True while there are frames that were fed but not written yet
+        return self.Q.unfinished_tasks > 0
 
     def wait_to_finish(self):
-        while self.is_active():
-            time.sleep(0.1)
+        """ Blocks until every frame fed so far is written. """
+        start = time.time()
+        if self.started:
+            self.Q.join()
+        self.metrics.time_to_drain = time.time() - start
 
     def stop(self):
-        # indicate that the thread should be stopped
+        # write what is still queued, then let the thread release the stream
         self.stopped = True
-        # wait until stream resources are released (producer thread might be still grabbing frame)
-        self.thread.join()
+        if self.started:
+            self.Q.put(None)
+            self.thread.join()
+        if self.pool is not None:
+            self.pool.close()
 
     def get_state(self):
-        state = 'Queue %d/%d;' % (self.Q.qsize(), self.queue_size)
+        if self.queue_size > 0:
+            state = 'Queue %d/%d;' % (self.Q.qsize(), self.queue_size)
+        else:
+            state = 'Queue %d;' % self.Q.qsize()
+        if self.pool is not None:
+            state += ' Pool %d/%d (max %d);' % (self.pool.num_used(), self.pool.num_slots, self.pool.max_used)
+        if self.overflow.policy != overflow_t.error:
+            state += self.overflow.get_state()
         if self.write_speed is None:
             state += ' Write speed nan FPS'
         else:
@@ -138,16 +377,13 @@ if __name__ == '__main__':
     # 1. TIME FAST VERSION
     import numpy as np
     writer = VideoWriterFast('./test.avi', fps=30, codec=codec_t.divx)
+    start = time.time()
     for _ in range(NUM_FRAMES):
         # time.sleep(0.1)  # time it takes to produce a frame, this is why a separate thread is faster
         writer.feed(np.random.randint(0, 255, (480, 640, 3)).astype('uint8'))
-
-    start = time.time()
-    writer.start()
-    while writer.is_active():
-        print('Still active')
-        time.sleep(1)
-    print('Not active anymore')
+    print('Frames fed after %.2f sec' % (time.time() - start))
+    writer.wait_to_finish()
     print('time passed', time.time() - start)
     writer.stop()
+    print(writer.get_state())
     print('finished')
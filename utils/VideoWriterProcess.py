@@ -0,0 +1,286 @@
+"""
+    Video writing in separate processes.
+
+    Same interface as VideoWriterFast, but frames are encoded by an EncoderProcess, so encoding does not compete
+    with acquisition for the GIL. Frames are handed over through a SharedRingBuffer per video, only a short
+    notification per frame goes through a queue. One EncoderProcess can serve the videos of several cameras.
+
+    The overflow policies are those of VideoWriterFast, except for overflow_t.drop_oldest: the oldest frame may already
+    be in the encoder, so the newest one is dropped instead.
+    Shared memory rings can not grow, so with a MemoryGovernor each ring takes at most queue_size slots of its fair
+    share of the budget.
+"""
+import os
+import multiprocessing
+import time
+import numpy as np
+
+from utils.SharedRingBuffer import SharedRingBuffer
+from utils.VideoWriterFast import QueueOverflow, overflow_t, OverflowCounter, open_stream
+from utils.PixelFormat import to_bgr
+
+
+class EncoderDied(Exception):
+    """ The encoder process of a writer exited while it still had frames to write. """
+    pass
+
+
+def _encoder_loop(jobs):
+    streams = dict()
+    while True:
+        msg = jobs.get()
+        if msg is None:
+            break
+
+        kind, sid = msg[0], msg[1]
+        if kind == 'frame':
+            ring, stream, pixel_format, stream_format, bgr_frame, keep_last = streams[sid][:6]
+            start = time.time()
+            frame = ring.peek()
+            if stream_format == pixel_format:
+                out = frame
+            else:
+                out = to_bgr(frame, pixel_format, dst=bgr_frame)
+                if out is not frame:
+                    streams[sid][4] = out
+            stream.write(out)
+            if keep_last:
+                # keep a copy, the ring slot is reused once released
+                if streams[sid][6] is None:
+                    streams[sid][6] = out.copy()
+                else:
+                    np.copyto(streams[sid][6], out)
+            del frame, out
+            ring.release()
+            duration = time.time() - start
+            if ring.stats[ring.WRITE_SPEED] > 0:
+                ring.stats[ring.WRITE_SPEED] = 0.85*ring.stats[ring.WRITE_SPEED] + 0.15*duration
+            else:
+                ring.stats[ring.WRITE_SPEED] = duration
+
+        elif kind == 'repeat':
+            # there was no room for a frame, so the previous one is written again
+            last_frame = streams[sid][6]
+            if last_frame is not None:
+                streams[sid][1].write(last_frame)
+
+        elif kind == 'open':
+            ring_desc, video_path, fps, codec, pixel_format, overflow_policy, stream_options = msg[2:]
+            ring = SharedRingBuffer.attach(*ring_desc)
+            stream, stream_format = open_stream(video_path, fps, codec, (ring.shape[1], ring.shape[0]),
+                                                pixel_format, stream_options)
+            keep_last = overflow_policy == overflow_t.duplicate
+            streams[sid] = [ring, stream, pixel_format, stream_format, None, keep_last, None]
+
+        elif kind == 'close':
+            ring, stream = streams.pop(sid)[:2]
+            stream.release()
+            ring.set_closed()
+            ring.close()
+
+    for ring, stream in [v[:2] for v in streams.values()]:
+        stream.release()
+        ring.set_closed()
+        ring.close()
+
+
+class EncoderProcess(object):
+    """ A process encoding the frames of one or more VideoWriterProcess. """
+    def __init__(self):
+        ctx = multiprocessing.get_context('spawn')
+        self.jobs = ctx.Queue()
+        self.process = ctx.Process(target=_encoder_loop, args=(self.jobs,))
+        self.process.daemon = True
+        self.process.start()
+        self._num_streams = 0
+
+    def new_stream_id(self):
+        self._num_streams += 1
+        return self._num_streams
+
+    def stop(self):
+        self.jobs.put(None)
+        self.process.join()
+
+
+class EncoderPool(object):
+    """ A fixed number of encoder processes, videos are distributed round robin. """
+    def __init__(self, num_processes):
+        self.encoders = [EncoderProcess() for _ in range(num_processes)]
+        self._next = 0
+
+    def get_encoder(self):
+        encoder = self.encoders[self._next % len(self.encoders)]
+        self._next += 1
+        return encoder
+
+    def stop(self):
+        for encoder in self.encoders:
+            encoder.stop()
+
+
+class VideoWriterProcess:
+    def __init__(self, video_path, fps, codec, encoder=None, queue_size=32, pixel_format='BGR8',
+                 overflow_policy=overflow_t.error, overflow_timeout=0.1, governor=None, stream_options=None):
+        self.fps = fps
+        self.codec = codec
+        self.video_path = video_path
+        self.pixel_format = pixel_format
+        self.stream_options = stream_options
+
+        # without an encoder given this writer starts its own process
+        self._own_encoder = encoder is None
+        if self._own_encoder:
+            encoder = EncoderProcess()
+        self.encoder = encoder
+        self.sid = encoder.new_stream_id()
+
+        # the ring is initialized when we get the first frame
+        self.queue_size = queue_size
+        self.ring = None
+        self.stopped = False
+        self.governor = governor
+        self._name = os.path.basename(video_path)
+        self._reserved = 0
+        self.time_to_drain = None
+        self.error = None  # set when the encoder process died
+        if governor is not None:
+            governor.register(self._name)
+
+        self.num_frames = 0  # frames fed so far, including the ones lost to overflow
+        if overflow_policy == overflow_t.drop_oldest:
+            overflow_policy = overflow_t.drop_newest
+        self.overflow = OverflowCounter(overflow_policy)
+        self.overflow_timeout = overflow_timeout
+
+    def _open(self, shape, dtype):
+        if self.governor is not None:
+            frame_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            share = min(self.governor.free(), self.governor.fair_share())
+            self.queue_size = max(2, min(self.queue_size, share // frame_bytes))
+            self._reserved = self.queue_size * frame_bytes
+            self.governor.reserve(self._name, self._reserved, force=True)
+        self.ring = SharedRingBuffer(self.queue_size, shape, dtype)
+        self.encoder.jobs.put(('open', self.sid, self.ring.describe(), self.video_path, self.fps, self.codec,
+                                self.pixel_format, self.overflow.policy, self.stream_options))
+
+    def _on_overflow(self, index):
+        """ Applies the overflow policy to frame index, which found the ring full. """
+        policy = self.overflow.policy
+        if policy == overflow_t.error:
+            raise QueueOverflow
+
+        if policy == overflow_t.block:
+            start = time.time()
+            slot, frame = None, None
+            while slot is None and time.time() - start < self.overflow_timeout:
+                time.sleep(0.001)
+                slot, frame = self.ring.acquire()
+            self.overflow.blocked.append(index)
+            self.overflow.blocked_time += time.time() - start
+            if slot is not None:
+                return slot, frame
+
+        if policy == overflow_t.duplicate:
+            self.encoder.jobs.put(('repeat', self.sid))
+            self.overflow.duplicated.append(index)
+        else:
+            self.overflow.dropped.append(index)
+        return None, None
+
+    def acquire(self, shape, dtype=np.uint8):
+        """ Returns the next free slot of the ring and its buffer, which should be filled and passed on to feed().
+            Returns (None, None) if the overflow policy decided to drop this frame. """
+        if self.ring is None:
+            self._open(shape, dtype)
+        assert self.ring.shape == tuple(shape), 'All frames of a video need to have the same shape.'
+
+        index = self.num_frames
+        self.num_frames += 1
+        slot, frame = self.ring.acquire()
+        if slot is None:
+            return self._on_overflow(index)
+        return slot, frame
+
+    def feed(self, frame, slot=None):
+        if slot is None:
+            slot, buffer = self.acquire(frame.shape, frame.dtype)
+            if slot is None:
+                return
+            np.copyto(buffer, frame)
+        self.ring.commit()
+        self.encoder.jobs.put(('frame', self.sid))
+
+    def running(self):
+        return self.is_active() or not self.stopped
+
+    def is_active(self):
+        # return True if there are still frames in the ring
+        return self.ring is not None and self.ring.num_used() > 0
+
+    def wait_to_finish(self):
+        """ Blocks until every frame fed so far is written. The ring lives in another process, so we poll it.
+            Raises EncoderDied if that process is gone before. """
+        start = time.time()
+        while self.is_active():
+            self._check_encoder()
+            time.sleep(0.005)
+        self.time_to_drain = time.time() - start
+
+    def stop(self):
+        # indicate that the writer should be stopped and wait until the encoder released the video
+        self.stopped = True
+        if self.ring is not None:
+            self.encoder.jobs.put(('close', self.sid))
+            while not self.ring.is_closed():
+                self._check_encoder()
+                time.sleep(0.01)
+        self._release()
+        if self._own_encoder:
+            self.encoder.stop()
+
+    def _check_encoder(self):
+        # a dead encoder never empties or closes the ring, so free what it would have and give up
+        if self.encoder.process.is_alive():
+            return
+        self.error = EncoderDied('Encoder process of %s exited with code %s.' % (self._name, self.encoder.process.exitcode))
+        self._release()
+        raise self.error
+
+    def _release(self):
+        # the ring owns the shared memory, closing it also unlinks the block
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+        if self.governor is not None and self._reserved > 0:
+            self.governor.release(self._name, self._reserved)
+            self._reserved = 0
+
+    def get_state(self):
+        if self.ring is None:
+            return 'Queue 0/%d; Write speed nan FPS' % self.queue_size
+        state = 'Queue %d/%d;' % (self.ring.num_used(), self.queue_size)
+        if self.overflow.policy != overflow_t.error:
+            state += self.overflow.get_state()
+        if self.ring.stats[self.ring.WRITE_SPEED] > 0:
+            state += ' Write speed %.1f FPS' % (1.0 / self.ring.stats[self.ring.WRITE_SPEED])
+        else:
+            state += ' Write speed nan FPS'
+        return state
+
+
+if __name__ == '__main__':
+    NUM_FRAMES = 30*4
+
+    writer = VideoWriterProcess('./test.avi', fps=30, codec='DIVX')
+    frame = np.random.randint(0, 255, (480, 640, 3)).astype('uint8')
+    start = time.time()
+    for _ in range(NUM_FRAMES):
+        slot, buffer = writer.acquire(frame.shape)
+        buffer[:] = frame
+        writer.feed(buffer, slot)
+        while writer.ring.num_used() == writer.queue_size:
+            time.sleep(0.001)
+    writer.wait_to_finish()
+    writer.stop()
+    print('time passed', time.time() - start)
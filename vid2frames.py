@@ -0,0 +1,115 @@
+"""
+    Extracts frames of recorded videos as images.
+
+        python vid2frames.py recordings/take00/run000_cam5.avi --out-path ./recordings_frames/
+        python vid2frames.py recordings/take00/ --out-path ./recordings_frames/ --stride 10
+
+    Frames of runXXX_camN.avi go to <out-path>/<take>/runXXX_camN/frame_000000.jpg. Videos are processed in parallel,
+    images of each batch of frames are encoded by a thread pool. Images are written under a temporary name and
+    renamed once complete, so an interrupted extraction is resumed by running the same command again.
+"""
+import os
+import glob
+import argparse
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+
+from utils.VideoReaderFast import VideoReaderFast
+
+VIDEO_EXTENSIONS = ['.avi', '.mp4', '.mkv']
+
+
+def find_videos(paths):
+    video_paths = list()
+    for path in paths:
+        if os.path.isdir(path):
+            for ext in VIDEO_EXTENSIONS:
+                video_paths.extend(glob.glob(os.path.join(path, '**', '*' + ext), recursive=True))
+        else:
+            video_paths.append(path)
+    return sorted(video_paths)
+
+
+def parse_indices(indices):
+    """ Frame indices given as comma separated list or as text file with one index per line. """
+    if indices is None:
+        return None
+    if os.path.isfile(indices):
+        with open(indices, 'r') as fi:
+            return sorted(set(int(line) for line in fi if line.strip()))
+    return sorted(set(int(i) for i in indices.split(',') if i.strip()))
+
+
+def frame_path(out_dir, i, ext):
+    return os.path.join(out_dir, 'frame_%06d.%s' % (i, ext))
+
+
+def _encode_and_save(args):
+    frame, path, params = args
+    ok, data = cv2.imencode(os.path.splitext(path)[1], frame, params)
+    assert ok, 'Could not encode %s' % path
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fo:
+        fo.write(data.tobytes())
+    os.replace(tmp_path, path)
+
+
+def extract(video_path, out_dir, stride=1, indices=None, ext='jpg', quality=95, batch_size=32, num_threads=4):
+    """ Writes the frames of a video that are not there yet. Returns (video_path, frames written, frames wanted). """
+    reader = VideoReaderFast(video_path)
+    num_frames = reader.get_size()
+    if indices is None:
+        wanted = list(range(0, num_frames, stride))
+    else:
+        wanted = [i for i in indices if 0 <= i < num_frames]
+
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    todo = [i for i in wanted if not os.path.exists(frame_path(out_dir, i, ext))]
+
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if ext == 'jpg' else []
+    with ThreadPoolExecutor(num_threads) as pool:
+        for start in range(0, len(todo), batch_size):
+            batch = todo[start:start + batch_size]
+            frames = reader.read_batch(batch)
+            list(pool.map(_encode_and_save, [(f, frame_path(out_dir, i, ext), params) for i, f in zip(batch, frames)]))
+    reader.stop()
+    return video_path, len(todo), len(wanted)
+
+
+def _extract_job(args):
+    return extract(*args)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract frames of videos as images.')
+    parser.add_argument('paths', type=str, nargs='+', help='Videos or folders containing them.')
+    parser.add_argument('--out-path', type=str, required=True)
+    parser.add_argument('--stride', type=int, default=1, help='Extract every n-th frame.')
+    parser.add_argument('--indices', type=str, default=None,
+                        help='Frames to extract, comma separated or a text file with one index per line.')
+    parser.add_argument('--ext', type=str, default='jpg', choices=['jpg', 'png'])
+    parser.add_argument('--quality', type=int, default=95, help='JPEG quality.')
+    parser.add_argument('--batch-size', type=int, default=32, help='Frames decoded and encoded together.')
+    parser.add_argument('--num-workers', type=int, default=multiprocessing.cpu_count(), help='Videos in parallel.')
+    parser.add_argument('--num-threads', type=int, default=4, help='Encoding threads per video.')
+    args = parser.parse_args()
+
+    video_paths = find_videos(args.paths)
+    indices = parse_indices(args.indices)
+    print('Found %d videos' % len(video_paths))
+
+    jobs = list()
+    for video_path in video_paths:
+        take_name = os.path.basename(os.path.dirname(os.path.abspath(video_path)))
+        video_name = os.path.splitext(os.path.basename(video_path))[0]
+        out_dir = os.path.join(args.out_path, take_name, video_name)
+        jobs.append((video_path, out_dir, args.stride, indices, args.ext, args.quality, args.batch_size,
+                     args.num_threads))
+
+    pool = multiprocessing.Pool(max(1, min(args.num_workers, len(jobs))))
+    for video_path, num_written, num_wanted in pool.imap_unordered(_extract_job, jobs):
+        print('%s: wrote %d frames, %d were there already' % (video_path, num_written, num_wanted - num_written))
+    pool.close()
+    pool.join()